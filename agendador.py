@@ -0,0 +1,456 @@
+"""
+Módulo: agendador.py
+
+Descrição:
+    Emissão mensal das guias dos clientes com assinatura (tabela `assinaturas`), sem que
+    a mesma planilha precise ser reenviada todo mês com uma nova DATA_ENVIO.
+
+    A cada rodada, o agendador calcula a parcela do mês corrente e emite, pelo envio em
+    lote, as guias das assinaturas ativas ainda pendentes. Para não concentrar as chamadas
+    ao SERPRO em um único horário, as emissões são distribuídas ao longo de uma janela fora
+    do horário comercial: cada rodada inclui em um lote apenas a fração das assinaturas
+    proporcional ao tempo já decorrido da janela, e o lote respeita o limite de chamadas
+    por segundo do motor de lote.
+
+    - Assinaturas cuja guia da parcela já foi emitida (por um lote ou envio avulso) são ignoradas.
+    - Cada assinatura é incluída em um lote uma única vez por parcela. A marcação é feita
+      com um UPDATE condicional, de modo que vários processos (workers do gunicorn) podem
+      executar o agendador ao mesmo tempo sem emitir a mesma guia duas vezes.
+    - A marcação e a criação do lote são transações separadas. Uma assinatura marcada cujo
+      lote não foi gravado (erro ao criar o lote, queda do processo) volta a ser pendente
+      quando, passados SERPRO_LOTE_HEARTBEAT_EXPIRACAO segundos da marcação, não há
+      requisição da parcela criada depois dela.
+    - Uma assinatura cuja última requisição da parcela terminou com erro (circuito aberto,
+      falha de autenticação, erro do SERPRO) volta a ser pendente SERPRO_AGENDADOR_ESPERA_ERRO
+      segundos depois da resposta, até SERPRO_AGENDADOR_TENTATIVAS erros na parcela. Esgotadas
+      as tentativas, a falha aparece no painel (empresas sem guia) e pode ser reenviada pela planilha.
+
+Uso:
+    python agendador.py importar assinaturas.xlsx   # inclui/reativa assinaturas (CNPJ, ID_SISTEMA, ID_SERVICO)
+    python agendador.py executar                    # uma rodada, respeitando a janela
+    python agendador.py executar --agora            # emite todas as pendentes, fora da janela
+    python agendador.py servico                     # rodadas a cada SERPRO_AGENDADOR_INTERVALO segundos
+
+Configuração (.env):
+    SERPRO_AGENDADOR_JANELA_INICIO: início da janela de emissão, HH:MM (padrão: 22:00).
+    SERPRO_AGENDADOR_JANELA_FIM: fim da janela, HH:MM; se anterior ao início, a janela
+        termina no dia seguinte (padrão: 06:00).
+    SERPRO_AGENDADOR_DIA: dia do mês a partir do qual as guias são emitidas (padrão: 1).
+    SERPRO_AGENDADOR_INTERVALO: segundos entre as rodadas (padrão: 300).
+    SERPRO_AGENDADOR_ATIVO: executa as rodadas em uma thread do app (padrão: False).
+    SERPRO_AGENDADOR_ESPERA_ERRO: segundos após um erro de emissão até a nova tentativa (padrão: 1800).
+    SERPRO_AGENDADOR_TENTATIVAS: erros de emissão por parcela após os quais a assinatura
+        deixa de ser repetida no mês (padrão: 3).
+"""
+import argparse
+import datetime
+import logging
+import math
+import threading
+import time
+from decouple import config
+from sqlalchemy import and_, func, insert, or_, select, update
+from models import Session, Assinatura, Requisicao
+from ingestao import ler_blocos, normalizar_cnpjs
+from tarefas_lote import criar_lote, iniciar_lote, processar_lote, HEARTBEAT_EXPIRACAO
+
+# ===========================================
+# CONFIGURAÇÃO
+# ===========================================
+
+
+def _horario(valor):
+    """
+    Converte um horário HH:MM.
+    """
+    return datetime.datetime.strptime(valor.strip(), '%H:%M').time()
+
+
+JANELA_INICIO = config('SERPRO_AGENDADOR_JANELA_INICIO', default='22:00', cast=_horario)
+JANELA_FIM = config('SERPRO_AGENDADOR_JANELA_FIM', default='06:00', cast=_horario)
+DIA_EMISSAO = config('SERPRO_AGENDADOR_DIA', default=1, cast=int)
+INTERVALO = config('SERPRO_AGENDADOR_INTERVALO', default=300, cast=int)
+ESPERA_ERRO = config('SERPRO_AGENDADOR_ESPERA_ERRO', default=1800, cast=int)
+TENTATIVAS = config('SERPRO_AGENDADOR_TENTATIVAS', default=3, cast=int)
+
+COLUNAS_ASSINATURAS = ['CNPJ', 'ID_SISTEMA', 'ID_SERVICO']
+
+_agendador = None
+_agendador_lock = threading.Lock()
+
+
+# ===========================================
+# JANELA DE EMISSÃO
+# ===========================================
+
+def janela_emissao(agora, inicio=JANELA_INICIO, fim=JANELA_FIM):
+    """
+    Retorna a janela de emissão que contém o instante informado.
+
+    Parâmetros:
+        agora (datetime): Instante de referência (horário local).
+        inicio (time): Início da janela.
+        fim (time): Fim da janela; se não for posterior ao início, a janela termina no dia seguinte.
+
+    Retorna:
+        tuple | None: (início, fim) da janela como datetime, ou None fora dela.
+    """
+    hoje = agora.date()
+    if inicio < fim:
+        abertura = datetime.datetime.combine(hoje, inicio)
+        fechamento = datetime.datetime.combine(hoje, fim)
+    elif agora.time() >= inicio:
+        abertura = datetime.datetime.combine(hoje, inicio)
+        fechamento = datetime.datetime.combine(hoje + datetime.timedelta(days=1), fim)
+    else:
+        abertura = datetime.datetime.combine(hoje - datetime.timedelta(days=1), inicio)
+        fechamento = datetime.datetime.combine(hoje, fim)
+
+    return (abertura, fechamento) if abertura <= agora < fechamento else None
+
+
+def _quantidade_rodada(total, agendadas, janela, agora, intervalo):
+    """
+    Calcula quantas assinaturas incluir na rodada para que, ao fim dela, a fração emitida
+    acompanhe a fração decorrida da janela. Como a meta é calculada sobre o total do mês,
+    rodadas concorrentes ou atrasadas se compensam nas seguintes.
+    """
+    abertura, fechamento = janela
+    decorrido = (agora - abertura).total_seconds() + intervalo
+    fracao = min(decorrido / (fechamento - abertura).total_seconds(), 1.0)
+    return max(math.ceil(total * fracao) - agendadas, 0)
+
+
+# ===========================================
+# RODADA DO AGENDADOR
+# ===========================================
+
+def _requisicoes_da_assinatura(parcela, *condicoes):
+    """
+    Consulta correlacionada às requisições da parcela com a chave da assinatura.
+    """
+    return select(Requisicao.id).where(
+        Requisicao.parcela == parcela,
+        Requisicao.contribuinte == Assinatura.contribuinte,
+        # Assinaturas importadas por versões anteriores podem estar em minúsculas
+        Requisicao.id_sistema == func.upper(Assinatura.id_sistema),
+        Requisicao.id_servico == func.upper(Assinatura.id_servico),
+        *condicoes
+    )
+
+
+def _possui_guia(parcela):
+    """
+    Condição verdadeira quando a assinatura já tem guia emitida para a parcela.
+    """
+    return _requisicoes_da_assinatura(parcela, Requisicao.status == "Concluído").exists()
+
+
+def _sem_lote(parcela, limite):
+    """
+    Condição verdadeira quando a assinatura foi marcada para a parcela antes de `limite`
+    e nenhuma requisição da parcela foi criada para ela depois da marcação.
+    """
+    return and_(
+        Assinatura.ultima_parcela == parcela,
+        Assinatura.data_agendamento < limite,
+        ~_requisicoes_da_assinatura(parcela, Requisicao.data_envio >= Assinatura.data_agendamento).exists()
+    )
+
+
+def _com_erro(parcela, limite_erro):
+    """
+    Condição verdadeira quando a requisição criada para a assinatura depois da última
+    marcação terminou com erro antes de `limite_erro`, e a parcela ainda não acumulou
+    TENTATIVAS erros.
+    """
+    depois_da_marcacao = Requisicao.data_envio >= Assinatura.data_agendamento
+    erros = (
+        _requisicoes_da_assinatura(parcela, Requisicao.status == "Erro")
+        .with_only_columns(func.count(Requisicao.id))
+        .scalar_subquery()
+    )
+    return and_(
+        Assinatura.ultima_parcela == parcela,
+        _requisicoes_da_assinatura(
+            parcela, depois_da_marcacao, Requisicao.status == "Erro", Requisicao.data_resposta < limite_erro
+        ).exists(),
+        # Nenhuma requisição da marcação ainda em andamento
+        ~_requisicoes_da_assinatura(parcela, depois_da_marcacao, Requisicao.status != "Erro").exists(),
+        erros < TENTATIVAS
+    )
+
+
+def _filtro_pendentes(parcela, limite, limite_erro):
+    return (
+        Assinatura.ativa.is_(True),
+        or_(Assinatura.ultima_parcela.is_(None), Assinatura.ultima_parcela != parcela,
+            _sem_lote(parcela, limite), _com_erro(parcela, limite_erro)),
+        ~_possui_guia(parcela)
+    )
+
+
+def executar_rodada(agora=None, imediato=False, intervalo=INTERVALO, processar=iniciar_lote):
+    """
+    Executa uma rodada: inclui em lotes as assinaturas pendentes da parcela do mês.
+
+    Parâmetros:
+        agora (datetime): Instante da rodada (padrão: horário local atual).
+        imediato (bool): Ignora a janela e o dia de emissão e inclui todas as pendentes.
+        intervalo (int): Segundos até a próxima rodada, usados para dimensionar esta.
+        processar (callable): Recebe o identificador de cada lote criado
+            (padrão: processamento em segundo plano).
+
+    Retorna:
+        dict: {"parcela": str, "pendentes": int, "agendadas": int, "lotes": [str]}
+    """
+    agora = agora or datetime.datetime.now()
+    parcela = agora.strftime('%Y%m')
+    resultado = {"parcela": parcela, "pendentes": 0, "agendadas": 0, "lotes": []}
+
+    janela = None
+    if not imediato:
+        janela = janela_emissao(agora)
+        if agora.day < DIA_EMISSAO or janela is None:
+            return resultado
+
+    # Marcações mais antigas que o limite, sem requisição correspondente, são refeitas,
+    # assim como as que terminaram com erro antes de `limite_erro`
+    marcacao = datetime.datetime.now(datetime.timezone.utc)
+    limite = marcacao - datetime.timedelta(seconds=HEARTBEAT_EXPIRACAO)
+    limite_erro = marcacao - datetime.timedelta(seconds=ESPERA_ERRO)
+    filtro_pendentes = _filtro_pendentes(parcela, limite, limite_erro)
+
+    db = Session()
+    try:
+        pendentes = db.query(func.count(Assinatura.id)).filter(*filtro_pendentes).scalar()
+        resultado["pendentes"] = pendentes
+        if not pendentes:
+            return resultado
+
+        if imediato:
+            quantidade = pendentes
+        else:
+            # As marcadas sem lote ou com erro a repetir já estão entre as pendentes
+            agendadas = (
+                db.query(func.count(Assinatura.id)).filter(Assinatura.ultima_parcela == parcela).scalar()
+                - db.query(func.count(Assinatura.id))
+                .filter(or_(_sem_lote(parcela, limite), _com_erro(parcela, limite_erro))).scalar()
+            )
+            quantidade = _quantidade_rodada(pendentes + agendadas, agendadas, janela, agora, intervalo)
+        if not quantidade:
+            return resultado
+
+        # Seleção e marcação em um único UPDATE: assinaturas marcadas por outro processo
+        # entre a contagem e a marcação não são incluídas novamente
+        selecionadas = (
+            select(Assinatura.id)
+            .where(*filtro_pendentes)
+            .order_by(Assinatura.id)
+            .limit(quantidade)
+        )
+        marcadas = db.execute(
+            update(Assinatura)
+            .where(Assinatura.id.in_(selecionadas))
+            .values(ultima_parcela=parcela, data_agendamento=marcacao)
+            .returning(Assinatura.tipo_contribuinte, Assinatura.contribuinte,
+                       Assinatura.id_sistema, Assinatura.id_servico)
+        ).all()
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+    # Um lote por tipo de contribuinte
+    por_tipo = {}
+    for tipo, contribuinte, id_sistema, id_servico in marcadas:
+        por_tipo.setdefault(tipo, []).append(
+            {'CNPJ': contribuinte, 'ID_SISTEMA': id_sistema.upper(), 'ID_SERVICO': id_servico.upper(),
+             'PARCELA': parcela}
+        )
+    for tipo, linhas in por_tipo.items():
+        try:
+            lote_id = criar_lote(linhas, nome_arquivo=f"agendador-{parcela}", tipo_contribuinte=tipo)
+        except Exception as e:
+            # As assinaturas continuam marcadas, sem lote, e voltam a ser pendentes nas próximas rodadas
+            logging.error(f"Agendador: erro ao criar o lote da parcela {parcela}: {str(e)}")
+            continue
+        resultado["lotes"].append(lote_id)
+        processar(lote_id)
+
+    resultado["agendadas"] = len(marcadas)
+    logging.info("Agendador: %d de %d assinaturas pendentes incluídas em lote para a parcela %s.",
+                 len(marcadas), pendentes, parcela)
+    return resultado
+
+
+def iniciar_agendador(intervalo=INTERVALO):
+    """
+    Inicia a thread que executa as rodadas periodicamente.
+    Chamadas repetidas no mesmo processo não iniciam uma segunda thread.
+    """
+    global _agendador
+
+    with _agendador_lock:
+        if _agendador is not None and _agendador.is_alive():
+            return
+        _agendador = threading.Thread(target=_agendar, args=(intervalo,), name='agendador', daemon=True)
+        _agendador.start()
+
+
+def _agendar(intervalo, processar=iniciar_lote):
+    while True:
+        try:
+            executar_rodada(intervalo=intervalo, processar=processar)
+        except Exception as e:
+            logging.error(f"Erro na rodada do agendador: {str(e)}")
+        time.sleep(intervalo)
+
+
+# ===========================================
+# IMPORTAÇÃO DAS ASSINATURAS
+# ===========================================
+
+def importar_assinaturas(db, arquivo, nome_arquivo, tipo_contribuinte=2, tamanho_bloco=1000):
+    """
+    Inclui as assinaturas de uma planilha com as colunas CNPJ, ID_SISTEMA e ID_SERVICO
+    (a mesma do envio em lote; as demais colunas são ignoradas). Assinaturas já
+    cadastradas e inativas são reativadas.
+
+    Parâmetros:
+        db: Sessão SQLAlchemy.
+        arquivo: Arquivo binário (ex.: `FileStorage` do Flask).
+        nome_arquivo (str): Nome do arquivo (.xlsx ou .csv).
+        tipo_contribuinte (int): Tipo do contribuinte das linhas (padrão: 2 - CNPJ).
+        tamanho_bloco (int): Linhas lidas e gravadas por bloco.
+
+    Retorna:
+        dict: {"incluidas": int, "reativadas": int, "rejeitadas": [{"linha", "CNPJ", "mensagem"}]}
+
+    Exceções:
+        ErroPlanilha: Se o arquivo não puder ser lido ou faltar alguma coluna obrigatória.
+    """
+    resultado = {"incluidas": 0, "reativadas": 0, "rejeitadas": []}
+    # A linha 1 da planilha é o cabeçalho
+    primeira_linha = 2
+
+    try:
+        for bloco in ler_blocos(arquivo, nome_arquivo, COLUNAS_ASSINATURAS, tamanho_bloco):
+            bloco = bloco.reset_index(drop=True)
+            cnpjs, validos = normalizar_cnpjs(bloco['CNPJ'])
+            # Normalizados como no envio em lote (ingestao.validar_bloco), para casar com as requisições
+            sistemas = bloco['ID_SISTEMA'].fillna('').astype(str).str.strip().str.upper()
+            servicos = bloco['ID_SERVICO'].fillna('').astype(str).str.strip().str.upper()
+
+            chaves = {}
+            for posicao in range(len(bloco)):
+                if not validos[posicao] or not sistemas.iat[posicao] or not servicos.iat[posicao]:
+                    resultado["rejeitadas"].append({
+                        "linha": primeira_linha + posicao,
+                        "CNPJ": None if bloco['CNPJ'].isna().iat[posicao] else str(bloco['CNPJ'].iat[posicao]),
+                        "mensagem": "CNPJ inválido" if not validos[posicao] else "ID_SISTEMA ou ID_SERVICO não informado"
+                    })
+                    continue
+                chaves[(cnpjs.iat[posicao], sistemas.iat[posicao], servicos.iat[posicao])] = True
+            primeira_linha += len(bloco)
+
+            if chaves:
+                incluidas, reativadas = _gravar_assinaturas(db, list(chaves), tipo_contribuinte)
+                resultado["incluidas"] += incluidas
+                resultado["reativadas"] += reativadas
+
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    return resultado
+
+
+def _gravar_assinaturas(db, chaves, tipo_contribuinte):
+    """
+    Grava um bloco de assinaturas (contribuinte, id_sistema, id_servico): as novas com um
+    INSERT em massa e as inativas já cadastradas com um UPDATE em massa.
+
+    Retorna:
+        tuple: (incluídas, reativadas)
+    """
+    pedidas = set(chaves)
+    existentes = {}
+    for contribuintes in _partes(sorted({chave[0] for chave in pedidas}), 500):
+        for id_, contribuinte, id_sistema, id_servico, ativa in (
+            db.query(Assinatura.id, Assinatura.contribuinte, Assinatura.id_sistema,
+                     Assinatura.id_servico, Assinatura.ativa)
+            .filter(Assinatura.contribuinte.in_(contribuintes))
+        ):
+            existentes[(contribuinte, id_sistema, id_servico)] = (id_, ativa)
+
+    novas = [
+        {'contribuinte': contribuinte, 'tipo_contribuinte': tipo_contribuinte,
+         'id_sistema': id_sistema, 'id_servico': id_servico, 'ativa': True}
+        for contribuinte, id_sistema, id_servico in pedidas
+        if (contribuinte, id_sistema, id_servico) not in existentes
+    ]
+    reativadas = [{'id': id_, 'ativa': True} for chave, (id_, ativa) in existentes.items()
+                  if chave in pedidas and not ativa]
+
+    if novas:
+        db.execute(insert(Assinatura), novas)
+    if reativadas:
+        db.execute(update(Assinatura), reativadas)
+
+    return len(novas), len(reativadas)
+
+
+def _partes(valores, tamanho):
+    for inicio in range(0, len(valores), tamanho):
+        yield valores[inicio:inicio + tamanho]
+
+
+# ===========================================
+# LINHA DE COMANDO
+# ===========================================
+
+def main():
+    from models import init_db
+    from registro import configurar_logging
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='comando', required=True)
+
+    importar = subparsers.add_parser('importar', help='Inclui assinaturas de uma planilha .xlsx ou .csv')
+    importar.add_argument('planilha')
+
+    executar = subparsers.add_parser('executar', help='Executa uma rodada e aguarda os lotes criados')
+    executar.add_argument('--agora', action='store_true', help='Ignora a janela e emite todas as pendentes')
+
+    subparsers.add_parser('servico', help='Executa rodadas periodicamente, em primeiro plano')
+
+    args = parser.parse_args()
+    configurar_logging()
+    init_db()
+
+    if args.comando == 'importar':
+        db = Session()
+        try:
+            with open(args.planilha, 'rb') as arquivo:
+                resultado = importar_assinaturas(db, arquivo, args.planilha)
+        finally:
+            db.close()
+        print(f"{resultado['incluidas']} assinaturas incluídas, {resultado['reativadas']} reativadas, "
+              f"{len(resultado['rejeitadas'])} linhas rejeitadas.")
+        for erro in resultado['rejeitadas']:
+            print(f"  linha {erro['linha']}: {erro['CNPJ']} - {erro['mensagem']}")
+    elif args.comando == 'executar':
+        # Na linha de comando, os lotes são processados antes de encerrar o processo
+        resultado = executar_rodada(imediato=args.agora, processar=processar_lote)
+        print(f"Parcela {resultado['parcela']}: {resultado['agendadas']} de {resultado['pendentes']} "
+              f"assinaturas pendentes emitidas em {len(resultado['lotes'])} lote(s).")
+    else:
+        _agendar(INTERVALO, processar=processar_lote)
+
+
+if __name__ == '__main__':
+    main()
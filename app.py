@@ -1,23 +1,112 @@
-from flask import Flask, request, jsonify, render_template, redirect, url_for, flash, send_from_directory, send_file
+from flask import Flask, Blueprint, request, jsonify, render_template, redirect, url_for, flash, \
+    send_from_directory, send_file, Response, stream_with_context, g, current_app
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.http import is_resource_modified
 from models import init_db, session, Requisicao
-from utils import montar_json_gerardas, fazer_requisicao_serpro
-from empresa_codigos import CNPJ_CODIGO_EMPRESA
-from sqlalchemy import extract
-import secrets
+from cache_emissao import emitir_guia, liberar_reservas
+from clientes_http import estatisticas_conexoes
+from resiliencia import estatisticas_resiliencia
+from tarefas_lote import criar_lote, iniciar_lote, iniciar_supervisor, progresso_lote, eventos_lote
+from agendador import iniciar_agendador, importar_assinaturas
+from empresas import codigo_empresa, codigos_empresas, contratantes_empresas, importar_empresas, \
+    normalizar_documento, CODIGO_PADRAO
+from contratantes import estatisticas_contratantes
+from consultas import filtrar_requisicoes, listar_requisicoes, resumo_painel
+from sqlalchemy.orm import undefer
+from exportacao import gerar_zip_streaming, NomesUnicos
+from cache_pdfs import cache_pdfs
+from ingestao import IngestaoPlanilha, ErroPlanilha
+from registro import configurar_logging
+from metricas import REGISTRO, TIPO_CONTEUDO, DURACAO_HTTP
+from config import obter_configuracao, carregar_chave_secreta
+import hmac
+import json
+import threading
+import time
+import os
 import io
-import pandas as pd
-import zipfile
-import base64
 import datetime
 import logging
 
-app = Flask(__name__)
-app.secret_key = secrets.token_hex(32)
+# Rotas da aplicação; registradas no app criado por `criar_app`
+rotas = Blueprint('rotas', __name__)
+
 login_manager = LoginManager()
-login_manager.init_app(app)
-login_manager.login_view = 'login'
+login_manager.login_view = 'rotas.login'
+
+_inicializacao_lock = threading.Lock()
+_banco_inicializado = False
+
+
+# ===========================================
+# FÁBRICA DA APLICAÇÃO
+# ===========================================
+
+def criar_app(configuracao=None, iniciar_servicos=True):
+    """
+    Cria e configura a aplicação Flask.
+
+    A inicialização é idempotente: o banco é preparado uma única vez por processo,
+    mesmo que vários apps sejam criados (testes, benchmarks), e o supervisor de lotes
+    não é iniciado em duplicidade.
+
+    Parâmetros:
+        configuracao (type | str): Classe de configuração ou nome do ambiente
+            (padrão: variável APP_AMBIENTE).
+        iniciar_servicos (bool): Inicia as threads de segundo plano (`iniciar_segundo_plano`).
+            Use False quando o app é criado antes do fork dos processos do servidor
+            (gunicorn com `preload_app`, wsgi.py); cada processo as inicia depois.
+
+    Retorna:
+        Flask: Aplicação pronta para ser servida (ex.: `gunicorn -c gunicorn.conf.py wsgi:app`).
+    """
+    global _banco_inicializado
+
+    configurar_logging()
+
+    app = Flask(__name__)
+    if configuracao is None or isinstance(configuracao, str):
+        configuracao = obter_configuracao(configuracao)
+    app.config.from_object(configuracao)
+
+    if not app.config['SECRET_KEY']:
+        app.config['SECRET_KEY'] = carregar_chave_secreta(
+            app.config['SECRET_KEY_ARQUIVO'] or os.path.join(app.instance_path, 'secret_key')
+        )
+
+    login_manager.init_app(app)
+    app.register_blueprint(rotas)
+    app.teardown_appcontext(encerrar_sessao)
+
+    if app.config['INICIALIZAR_BANCO']:
+        with _inicializacao_lock:
+            if not _banco_inicializado:
+                init_db()
+                _banco_inicializado = True
+
+    # No modo debug, o processo monitor do reloader não processa lotes
+    processo_servidor = not app.debug or os.environ.get("WERKZEUG_RUN_MAIN") == "true"
+    if iniciar_servicos and processo_servidor:
+        iniciar_segundo_plano(app)
+
+    return app
+
+
+def iniciar_segundo_plano(app):
+    """
+    Inicia, conforme a configuração do app, o supervisor que retoma lotes interrompidos
+    (INICIAR_SUPERVISOR) e o agendador de emissões mensais (INICIAR_AGENDADOR).
+    Chamadas repetidas no mesmo processo não iniciam threads em duplicidade.
+
+    Parâmetros:
+        app (Flask): Aplicação criada por `criar_app`.
+    """
+    if app.config['INICIAR_SUPERVISOR']:
+        iniciar_supervisor()
+    if app.config['INICIAR_AGENDADOR']:
+        # As rodadas de vários processos se compensam: a meta de cada uma é calculada sobre o total do mês
+        iniciar_agendador()
 
 
 class User(UserMixin):
@@ -48,6 +137,35 @@ class User(UserMixin):
         return None
 
 
+def encerrar_sessao(exception=None):
+    """
+    Descarta a sessão do banco da requisição atual, devolvendo a conexão ao pool.
+    """
+    session.remove()
+
+
+@rotas.before_app_request
+def iniciar_cronometro():
+    g.inicio_requisicao = time.perf_counter()
+
+
+@rotas.after_app_request
+def registrar_duracao(response):
+    """
+    Registra a duração de cada requisição por rota, método e status.
+    Em respostas em streaming, mede até o início do envio.
+    """
+    inicio = g.pop('inicio_requisicao', None)
+    if inicio is not None:
+        DURACAO_HTTP.observar(
+            time.perf_counter() - inicio,
+            rota=request.url_rule.rule if request.url_rule else 'nao_encontrada',
+            metodo=request.method,
+            status=response.status_code
+        )
+    return response
+
+
 @login_manager.user_loader
 def load_user(user_id):
     """
@@ -56,10 +174,7 @@ def load_user(user_id):
     return User.get(user_id)
 
 
-init_db()
-
-
-@app.route('/')
+@rotas.route('/')
 @login_required
 def index():
     """
@@ -68,13 +183,13 @@ def index():
     return render_template('index.html')
 
 
-@app.route('/login', methods=['GET', 'POST'])
+@rotas.route('/login', methods=['GET', 'POST'])
 def login():
     """
         Gerencia o login de usuários.
     """
     if current_user.is_authenticated:
-        return redirect(url_for('index'))
+        return redirect(url_for('rotas.index'))
 
     if request.method == 'POST':
         username = request.form.get('username')
@@ -84,44 +199,39 @@ def login():
 
         if user and check_password_hash(User.user_database[username]['password'], password):
             login_user(user)
-            return redirect(url_for('index'))
+            return redirect(url_for('rotas.index'))
         else:
             flash('Usuário ou senha inválidos', 'error')
 
     return render_template('login.html')
 
 
-@app.route('/logout')
+@rotas.route('/logout')
 @login_required
 def logout():
     """
      Realiza o logout do usuário.
     """
     logout_user()
-    return redirect(url_for('login'))
+    return redirect(url_for('rotas.login'))
 
 
-@app.route('/consulta', methods=['GET'])
+@rotas.route('/consulta', methods=['GET'])
 def consulta():
     """
-     Consulta requisições enviadas com base nos parâmetros fornecidos.
+     Consulta requisições enviadas com base nos parâmetros fornecidos, em páginas de `limite` itens.
     """
-    contribuinte = request.args.get('contribuinte', None)
-    mes = request.args.get('mes', None)
-
-    query = session.query(Requisicao)
-
-    if contribuinte:
-        query = query.filter(Requisicao.contribuinte == contribuinte)
-
-    if mes:
-        try:
-            mes = int(mes)
-            query = query.filter(extract('month', Requisicao.data_envio) == mes)
-        except ValueError:
-            pass
-
-    requisicoes = query.all()
+    filtros = {
+        'contribuinte': request.args.get('contribuinte', None),
+        'mes': request.args.get('mes', None),
+        'ano': request.args.get('ano', None)
+    }
+    pagina = listar_requisicoes(
+        session,
+        cursor=request.args.get('cursor', None),
+        limite=request.args.get('limite', None),
+        **filtros
+    )
 
     requisicoes_lista = [
         {
@@ -129,16 +239,48 @@ def consulta():
             'data_envio': req.data_envio.strftime('%d/%m/%Y') if req.data_envio else '',
             'status': req.status,
             'id': req.id,
-            'resposta_base64': req.resposta_base64
-        } for req in requisicoes
+            'possui_pdf': req.possui_pdf
+        } for req in pagina['itens']
     ]
 
-    total_guias = len(requisicoes_lista)
+    # Links de navegação preservam os filtros aplicados
+    filtros = {chave: valor for chave, valor in filtros.items() if valor}
+    proxima_pagina = None
+    if pagina['proximo_cursor']:
+        proxima_pagina = url_for('rotas.consulta', cursor=pagina['proximo_cursor'], limite=pagina['limite'], **filtros)
+
+    return render_template(
+        'consulta.html',
+        requisicoes=requisicoes_lista,
+        total_guias=pagina['total'],
+        proxima_pagina=proxima_pagina,
+        primeira_pagina=url_for('rotas.consulta', **filtros) if request.args.get('cursor') else None
+    )
+
+
+@rotas.route('/painel', methods=['GET'])
+@login_required
+def painel():
+    """
+    Exibe os totais de requisições por status, parcela e contribuinte e as empresas
+    que ainda não têm a guia da parcela selecionada (padrão: mês corrente).
+    """
+    resumo = resumo_painel(session, parcela=request.args.get('parcela', None),
+                           limite=request.args.get('limite', None))
+    return render_template('painel.html', resumo=resumo)
 
-    return render_template('consulta.html', requisicoes=requisicoes_lista, total_guias=total_guias)
 
+@rotas.route('/resumo_requisicoes', methods=['GET'])
+@login_required
+def resumo_requisicoes():
+    """
+    Retorna em JSON os mesmos resumos do painel.
+    """
+    return jsonify(resumo_painel(session, parcela=request.args.get('parcela', None),
+                                 limite=request.args.get('limite', None)))
 
-@app.route('/static/images/<path:filename>')
+
+@rotas.route('/static/images/<path:filename>')
 def serve_static(filename):
     """
     Serve arquivos estáticos da pasta `static/images`.
@@ -146,11 +288,13 @@ def serve_static(filename):
     return send_from_directory('static/images', filename)
 
 
-@app.route('/gerar_das', methods=['POST'])
+@rotas.route('/gerar_das', methods=['POST'])
 @login_required
 def gerar_das():
     """
     Gera um documento DAS baseado nos dados fornecidos no formulário.
+    Uma guia idêntica emitida recentemente é reaproveitada, exceto se `forcar` for informado.
+    A guia é solicitada pelo contratante da empresa no cadastro (ou pelo contratante padrão).
     """
     numero_contribuinte = request.form.get('contribuinte')
     tipo_contribuinte = int(request.form.get('tipo_contribuinte'))
@@ -158,38 +302,58 @@ def gerar_das():
     id_servico = request.form.get('id_servico')
     parcela_para_emitir = request.form.get('parcela_para_emitir')
 
-    json_data = montar_json_gerardas(
-        numero_contribuinte,
-        tipo_contribuinte,
-        id_sistema,
-        id_servico,
-        parcela_para_emitir
-    )
+    forcar = request.form.get('forcar') in ('1', 'true', 'on')
+    contribuinte = normalizar_documento(numero_contribuinte)
 
     try:
-        resposta_pdf_b64, mensagem_erro = fazer_requisicao_serpro("/Emitir", method='POST', data=json_data)
-
-        if resposta_pdf_b64:
-            nova_requisicao = Requisicao(
-                contribuinte=numero_contribuinte,
-                tipo_contribuinte=tipo_contribuinte,
-                id_sistema=id_sistema,
-                id_servico=id_servico,
-                data_envio=datetime.datetime.now(datetime.timezone.utc),
-                status="Concluído",
-                resposta_base64=resposta_pdf_b64
-            )
+        contratante = contratantes_empresas(session, [contribuinte]).get(contribuinte)
+        resultado = emitir_guia(
+            numero_contribuinte,
+            tipo_contribuinte,
+            id_sistema,
+            id_servico,
+            parcela_para_emitir,
+            forcar=forcar,
+            contratante=contratante
+        )
+        agora = datetime.datetime.now(datetime.timezone.utc)
+
+        nova_requisicao = Requisicao(
+            contribuinte=contribuinte,
+            contratante=contratante,
+            tipo_contribuinte=tipo_contribuinte,
+            id_sistema=id_sistema,
+            id_servico=id_servico,
+            parcela=parcela_para_emitir,
+            chave_emissao=resultado.chave,
+            data_envio=agora,
+            data_resposta=agora
+        )
+
+        if resultado.pdf:
+            nova_requisicao.status = "Concluído"
+            nova_requisicao.response_message = resultado.mensagem
+            nova_requisicao.definir_pdf(resultado.pdf)
             session.add(nova_requisicao)
+            if resultado.reservada:
+                liberar_reservas(session, [resultado.chave])
             session.commit()
 
             return jsonify({
                 "message": "Documento DAS gerado com sucesso!",
-                "dados": {"id_requisicao": nova_requisicao.id}
+                "dados": {"id_requisicao": nova_requisicao.id, "em_cache": resultado.em_cache}
             }), 200
         else:
+            # Registra a falha para que possa ser consultada depois
+            mensagem_erro = resultado.mensagem or "Ocorreu um erro desconhecido durante a geração do documento."
+            nova_requisicao.status = "Erro"
+            nova_requisicao.response_message = mensagem_erro
+            session.add(nova_requisicao)
+            session.commit()
+
             return jsonify({
                 "error": "Erro ao gerar o documento DAS",
-                "mensagem": mensagem_erro or "Ocorreu um erro desconhecido durante a geração do documento."
+                "mensagem": mensagem_erro
             }), 500
 
     except Exception as e:
@@ -199,10 +363,12 @@ def gerar_das():
         }), 500
 
 
-@app.route('/enviar_em_lote', methods=['POST'])
+@rotas.route('/enviar_em_lote', methods=['POST'])
 def enviar_em_lote():
     """
-        Gera o documento DAS baseado nos dados fornecidos do arquivo xlsx, extraindo linha por linha.
+        Recebe a planilha (.xlsx ou .csv) e registra um lote para gerar os documentos DAS em segundo plano, linha por linha.
+        Retorna imediatamente o identificador do lote, cujo progresso é consultado em `/lotes/<lote_id>`
+        ou acompanhado em `/lotes/<lote_id>/eventos`, e as linhas rejeitadas na validação, com o número da linha na planilha.
     """
     if 'fileUpload' not in request.files:
         logging.error("Nenhum arquivo enviado no campo 'fileUpload'.")
@@ -215,175 +381,376 @@ def enviar_em_lote():
         return jsonify({'error': 'Nenhum arquivo selecionado'}), 400
 
     try:
-        df = pd.read_excel(file)
-        logging.info("Arquivo Excel lido com sucesso.")
-    except Exception as e:
-        logging.error(f"Erro ao ler o arquivo Excel: {str(e)}")
-        return jsonify({'error': f'Erro ao ler o arquivo: {str(e)}'}), 400
-
-    required_columns = {'CNPJ', 'ID_SISTEMA', 'ID_SERVICO', 'DATA_ENVIO'}
-    if not required_columns.issubset(df.columns):
-        logging.error(f"Colunas faltando no arquivo. Colunas encontradas: {list(df.columns)}")
-        return jsonify({'error': 'Arquivo inválido. Verifique as colunas.'}), 400
-
-    resultados = []
-    for _, row in df.iterrows():
-        numero_contribuinte = row['CNPJ']
-        id_sistema = row['ID_SISTEMA']
-        id_servico = row['ID_SERVICO']
-        data_envio = row['DATA_ENVIO']
-
-        logging.info(
-            f"Processando linha - CNPJ: {numero_contribuinte}, ID_SISTEMA: {id_sistema}, ID_SERVICO: {id_servico}, "
-            f"DATA_ENVIO: {data_envio}")
-
-        try:
-            if isinstance(data_envio, str) and '/' in data_envio:
-                parcela_para_emitir = data_envio.replace('/', '')
-            elif isinstance(data_envio, datetime.datetime):
-                parcela_para_emitir = data_envio.strftime('%Y%m')
-            else:
-                raise ValueError(f"Erro ao processar a data: formato inválido ({data_envio})")
-
-            tipo_contribuinte = 2
-
-            json_data = montar_json_gerardas(
-                numero_contribuinte,
-                tipo_contribuinte,
-                id_sistema,
-                id_servico,
-                parcela_para_emitir
-            )
-
-            resposta_pdf_b64, mensagem_erro = fazer_requisicao_serpro("/Emitir", method='POST', data=json_data)
-
-            if resposta_pdf_b64:
-                nova_requisicao = Requisicao(
-                    contribuinte=numero_contribuinte,
-                    tipo_contribuinte=tipo_contribuinte,
-                    id_sistema=id_sistema,
-                    id_servico=id_servico,
-                    data_envio=datetime.datetime.now(datetime.timezone.utc),
-                    status="Concluído",
-                    resposta_base64=resposta_pdf_b64
-                )
-                session.add(nova_requisicao)
-                session.commit()
-
-                resultados.append({
-                    "CNPJ": numero_contribuinte,
-                    "status": "Sucesso",
-                    "mensagem": "Documento DAS gerado com sucesso"
-                })
-
-                logging.info(f"Documento DAS gerado com sucesso para CNPJ: {numero_contribuinte}")
-
-            else:
-                resultados.append({
-                    "CNPJ": numero_contribuinte,
-                    "status": "Erro",
-                    "mensagem": mensagem_erro or "Erro ao gerar o documento DAS"
-                })
-
-                logging.error(f"Erro ao gerar o documento DAS para CNPJ: {numero_contribuinte} - {mensagem_erro}")
-
-        except Exception as e:
-            resultados.append({
-                "CNPJ": numero_contribuinte,
-                "status": "Erro",
-                "mensagem": f"Erro ao processar o CNPJ {numero_contribuinte}: {str(e)}"
-            })
-            logging.error(f"Erro ao processar o CNPJ {numero_contribuinte}: {str(e)}")
+        ingestao = IngestaoPlanilha(file.stream, file.filename)
+        forcar = request.form.get('forcar') in ('1', 'true', 'on')
+        # A planilha é lida e validada em blocos enquanto as linhas válidas são gravadas
+        lote_id = criar_lote(ingestao.linhas(), nome_arquivo=file.filename, forcar_emissao=forcar)
+    except ErroPlanilha as e:
+        logging.error(f"Erro ao ler o arquivo {file.filename}: {str(e)}")
+        return jsonify({'error': str(e)}), 400
+
+    rejeitadas = ingestao.erros
+    if rejeitadas:
+        logging.warning(f"{len(rejeitadas)} linhas rejeitadas na planilha {file.filename}.")
+
+    # Sem linhas válidas, o lote não é gravado (criar_lote retorna None)
+    if lote_id is None or not ingestao.total_validas:
+        return jsonify({
+            'error': 'Nenhuma linha válida na planilha.',
+            'rejeitadas': rejeitadas[:current_app.config['LIMITE_REJEITADAS']],
+            'total_rejeitadas': len(rejeitadas)
+        }), 400
+
+    iniciar_lote(lote_id)
+
+    return jsonify({
+        "message": "Lote recebido",
+        "lote_id": lote_id,
+        "progresso_url": url_for('rotas.progresso_lote_view', lote_id=lote_id),
+        "eventos_url": url_for('rotas.eventos_lote_view', lote_id=lote_id),
+        "total": ingestao.total_validas,
+        "rejeitadas": rejeitadas[:current_app.config['LIMITE_REJEITADAS']],
+        "total_rejeitadas": len(rejeitadas)
+    }), 202
+
+
+@rotas.route('/empresas/importar', methods=['POST'])
+@login_required
+def importar_empresas_view():
+    """
+    Recebe uma planilha (.xlsx ou .csv) com as colunas CNPJ, CODIGO e, opcionalmente, NOME,
+    e inclui ou atualiza as empresas no cadastro usado para nomear as guias exportadas.
+    """
+    if 'fileUpload' not in request.files:
+        return jsonify({'error': 'Nenhum arquivo enviado'}), 400
+
+    file = request.files['fileUpload']
+
+    if file.filename == '':
+        return jsonify({'error': 'Nenhum arquivo selecionado'}), 400
+
+    try:
+        resultado = importar_empresas(session, file.stream, file.filename)
+    except ErroPlanilha as e:
+        logging.error(f"Erro ao ler o arquivo {file.filename}: {str(e)}")
+        return jsonify({'error': str(e)}), 400
+
+    rejeitadas = resultado['rejeitadas']
+    logging.info("Cadastro de empresas importado de %s: %d incluídas, %d atualizadas, %d rejeitadas.",
+                 file.filename, resultado['incluidas'], resultado['atualizadas'], len(rejeitadas))
+
+    return jsonify({
+        "message": "Empresas importadas",
+        "incluidas": resultado['incluidas'],
+        "atualizadas": resultado['atualizadas'],
+        "rejeitadas": rejeitadas[:current_app.config['LIMITE_REJEITADAS']],
+        "total_rejeitadas": len(rejeitadas)
+    }), 200
+
+
+@rotas.route('/assinaturas/importar', methods=['POST'])
+@login_required
+def importar_assinaturas_view():
+    """
+    Recebe uma planilha (.xlsx ou .csv) com as colunas CNPJ, ID_SISTEMA e ID_SERVICO e inclui
+    as assinaturas cujas guias são emitidas todo mês pelo agendador.
+    """
+    if 'fileUpload' not in request.files:
+        return jsonify({'error': 'Nenhum arquivo enviado'}), 400
+
+    file = request.files['fileUpload']
+
+    if file.filename == '':
+        return jsonify({'error': 'Nenhum arquivo selecionado'}), 400
+
+    try:
+        resultado = importar_assinaturas(session, file.stream, file.filename)
+    except ErroPlanilha as e:
+        logging.error(f"Erro ao ler o arquivo {file.filename}: {str(e)}")
+        return jsonify({'error': str(e)}), 400
+
+    rejeitadas = resultado['rejeitadas']
+    logging.info("Assinaturas importadas de %s: %d incluídas, %d reativadas, %d rejeitadas.",
+                 file.filename, resultado['incluidas'], resultado['reativadas'], len(rejeitadas))
 
     return jsonify({
-        "message": "Envio em lote concluído",
-        "resultados": resultados
+        "message": "Assinaturas importadas",
+        "incluidas": resultado['incluidas'],
+        "reativadas": resultado['reativadas'],
+        "rejeitadas": rejeitadas[:current_app.config['LIMITE_REJEITADAS']],
+        "total_rejeitadas": len(rejeitadas)
     }), 200
 
 
-@app.route('/consultar_requisicoes', methods=['GET'])
+@rotas.route('/lotes/<lote_id>', methods=['GET'])
+@login_required
+def progresso_lote_view(lote_id):
+    """
+    Informa o progresso de um envio em lote. Com `detalhes=1`, inclui o resultado de cada linha processada.
+    """
+    detalhes = request.args.get('detalhes') in ('1', 'true')
+    progresso = progresso_lote(lote_id, detalhes=detalhes)
+
+    if progresso is None:
+        return jsonify({'error': 'Lote não encontrado'}), 404
+
+    return jsonify(progresso), 200
+
+
+def _evento_sse(evento, dados, identificador):
+    """
+    Formata um evento no protocolo Server-Sent Events. Sem evento, gera um comentário (sinal de vida).
+    """
+    if evento is None:
+        return ': ping\n\n'
+    return f"id: {identificador}\nevent: {evento}\ndata: {json.dumps(dados, ensure_ascii=False)}\n\n"
+
+
+@rotas.route('/lotes/<lote_id>/eventos', methods=['GET'])
+@login_required
+def eventos_lote_view(lote_id):
+    """
+    Transmite o progresso de um envio em lote como Server-Sent Events (text/event-stream):
+    eventos `linhas` com o resultado de cada linha assim que é gravado, `progresso` com os
+    contadores e `fim` na conclusão do lote.
+
+    O `id` de cada evento é a última linha já enviada em sequência; ao reconectar, o navegador
+    o devolve no cabeçalho `Last-Event-ID` e a transmissão continua a partir dele.
+    """
+    if progresso_lote(lote_id) is None:
+        return jsonify({'error': 'Lote não encontrado'}), 404
+
+    try:
+        apos_linha = int(request.headers.get('Last-Event-ID') or request.args.get('apos', -1))
+    except ValueError:
+        apos_linha = -1
+
+    def transmitir():
+        # Intervalo de reconexão do navegador, em milissegundos
+        yield 'retry: 3000\n\n'
+        for evento, dados, identificador in eventos_lote(lote_id, apos_linha):
+            yield _evento_sse(evento, dados, identificador)
+
+    return Response(
+        transmitir(),
+        mimetype='text/event-stream',
+        # Desativa o buffer de proxies (nginx), para que cada evento chegue assim que é gerado
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+@rotas.route('/consultar_requisicoes', methods=['GET'])
 @login_required
 def consultar_requisicoes():
     """
     Consulta as requisições enviadas e salvas no banco, exibe em lista e filtra por data de envio.
+    A listagem é paginada: passe `proximo_cursor` como `cursor` para obter a página seguinte.
     """
-    contribuinte = request.args.get('contribuinte', None)
-
-    if contribuinte:
-        requisicoes = session.query(Requisicao).filter(Requisicao.contribuinte == contribuinte).all()
-    else:
-        requisicoes = session.query(Requisicao).all()
+    pagina = listar_requisicoes(
+        session,
+        contribuinte=request.args.get('contribuinte', None),
+        mes=request.args.get('mes', None),
+        ano=request.args.get('ano', None),
+        cursor=request.args.get('cursor', None),
+        limite=request.args.get('limite', None)
+    )
 
     requisicoes_lista = []
-    for req in requisicoes:
+    for req in pagina['itens']:
         requisicoes_lista.append({
             'id': req.id,
             'contribuinte': req.contribuinte,
             'data_envio': req.data_envio.strftime('%d/%m/%Y %H:%M:%S') if req.data_envio else '',
             'status': req.status,
-            'resposta_base64': True if req.resposta_base64 else False
+            'resposta_base64': req.possui_pdf
         })
 
-    return jsonify(requisicoes_lista)
+    return jsonify({
+        'requisicoes': requisicoes_lista,
+        'total': pagina['total'],
+        'proximo_cursor': pagina['proximo_cursor'],
+        'limite': pagina['limite']
+    })
 
 
-@app.route('/baixar_recibo/<int:id>', methods=['GET'])
-def baixar_recibo(id):
+@rotas.route('/estatisticas/conexoes', methods=['GET'])
+@login_required
+def estatisticas_conexoes_view():
     """
-    Faz o download da Guia.
+    Exibe os contadores de conexões novas e reutilizadas dos clientes HTTP do SERPRO.
     """
-    requisicao = session.query(Requisicao).get(id)
+    return jsonify(estatisticas_conexoes())
 
-    if requisicao and requisicao.resposta_base64:
-        pdf_bytes = base64.b64decode(requisicao.resposta_base64)
-        pdf_file = io.BytesIO(pdf_bytes)
 
-        cnpj_contribuinte = requisicao.contribuinte
+@rotas.route('/metrics', methods=['GET'])
+def metricas_view():
+    """
+    Expõe as métricas da aplicação no formato de texto do Prometheus.
+    Com SERPRO_METRICS_TOKEN definido, exige o cabeçalho `Authorization: Bearer <token>`.
+    """
+    token = current_app.config['METRICS_TOKEN']
+    if token:
+        esperado = f"Bearer {token}"
+        if not hmac.compare_digest(request.headers.get('Authorization', ''), esperado):
+            return Response('Não autorizado\n', status=401, mimetype='text/plain')
 
-        codigo_empresa = CNPJ_CODIGO_EMPRESA.get(cnpj_contribuinte, "0000")
+    return Response(REGISTRO.exportar(), content_type=TIPO_CONTEUDO)
 
-        data_envio = requisicao.data_envio
-        mesano = data_envio.strftime('%m%Y')
 
-        nome_arquivo = f"{codigo_empresa}-PARC SN-{mesano}.pdf"
+@rotas.route('/estatisticas/resiliencia', methods=['GET'])
+@login_required
+def estatisticas_resiliencia_view():
+    """
+    Exibe os contadores de retentativas, timeouts e renovações de token, o estado do circuito do SERPRO
+    e, por contratante, o limite de taxa e o estado do seu circuito.
+    """
+    return jsonify(dict(estatisticas_resiliencia(), contratantes=estatisticas_contratantes()))
 
-        return send_file(pdf_file, mimetype='application/pdf', as_attachment=True, download_name=nome_arquivo)
+
+def _nome_arquivo_guia(codigo_empresa, data_envio):
+    """
+    Monta o nome do PDF de uma guia: "<código da empresa>-PARC SN-<MMAAAA>.pdf".
+    """
+    return f"{codigo_empresa}-PARC SN-{data_envio.strftime('%m%Y')}.pdf"
+
+
+@rotas.route('/baixar_recibo/<int:id>', methods=['GET'])
+def baixar_recibo(id):
+    """
+    Faz o download da Guia.
+
+    A resposta traz um ETag forte (o hash SHA-256 do PDF) e o Last-Modified da guia:
+    requisições condicionais (If-None-Match / If-Modified-Since) de uma guia inalterada
+    recebem 304 sem que o PDF seja lido do banco. Requisições com Range recebem apenas o
+    trecho pedido (206). O PDF é lido pelo cache em memória (cache_pdfs.py).
+    """
+    requisicao = session.query(
+        Requisicao.contribuinte, Requisicao.data_envio, Requisicao.data_resposta, Requisicao.pdf_sha256
+    ).filter(Requisicao.id == id, Requisicao.possui_pdf).first()
+
+    if requisicao:
+        ultima_alteracao = requisicao.data_resposta or requisicao.data_envio
+        if not is_resource_modified(request.environ, etag=requisicao.pdf_sha256, last_modified=ultima_alteracao):
+            resposta = Response(status=304)
+            resposta.set_etag(requisicao.pdf_sha256)
+            resposta.last_modified = ultima_alteracao
+            resposta.cache_control.private = True
+            resposta.cache_control.no_cache = True
+            return resposta
+
+        pdf = cache_pdfs.obter(
+            requisicao.pdf_sha256,
+            lambda: session.query(Requisicao.pdf).filter(Requisicao.id == id).scalar()
+        )
+
+        nome_arquivo = _nome_arquivo_guia(codigo_empresa(session, requisicao.contribuinte), requisicao.data_envio)
+
+        resposta = send_file(io.BytesIO(pdf), mimetype='application/pdf', as_attachment=True,
+                             download_name=nome_arquivo, conditional=True, etag=requisicao.pdf_sha256,
+                             last_modified=ultima_alteracao)
+        # A guia não muda, mas o navegador revalida a cada download (304 pelo ETag)
+        resposta.accept_ranges = 'bytes'
+        resposta.cache_control.private = True
+        resposta.cache_control.no_cache = True
+        return resposta
 
     else:
         return jsonify({'message': 'Recibo não encontrado ou ainda não disponível.'}), 404
 
 
-@app.route('/baixar_todos_recibos', methods=['GET'])
+@rotas.route('/baixar_todos_recibos', methods=['GET'])
 def baixar_todos_recibos():
     """
-    Faz o Download em lote de todas as guias retornadas.
+    Faz o Download em lote das guias retornadas, opcionalmente filtradas por contribuinte, mês e ano.
+    O ZIP é enviado em streaming (ver `_zip_recibos`).
+    """
+    query = filtrar_requisicoes(
+        session.query(Requisicao).filter(Requisicao.possui_pdf),
+        contribuinte=request.args.get('contribuinte', None),
+        mes=request.args.get('mes', None),
+        ano=request.args.get('ano', None)
+    )
+
+    return _zip_recibos(query, 'recibos_em_lote.zip')
+
+
+@rotas.route('/baixar_recibos_selecionados', methods=['GET', 'POST'])
+@login_required
+def baixar_recibos_selecionados():
     """
-    requisicoes = session.query(Requisicao).filter(Requisicao.resposta_base64.isnot(None)).all()
+    Faz o download, em um ZIP enviado em streaming, apenas das guias escolhidas: por `ids`
+    (lista JSON, campos `ids` repetidos ou separados por vírgula) e/ou pelos filtros
+    `contribuinte`, `de` e `ate` (meses de envio, "AAAA-MM" ou "MM/AAAA") e `status`.
+    As guias são lidas com uma única consulta (IN sobre os IDs e intervalo de datas).
+    """
+    if request.is_json:
+        dados = request.get_json(silent=True)
+        if not isinstance(dados, dict):
+            return jsonify({'message': 'IDs inválidos.'}), 400
+        ids = dados.get('ids')
+    else:
+        dados = request.values
+        ids = dados.getlist('ids')
+
+    if isinstance(ids, (str, int)):
+        ids = [ids]
+    try:
+        ids = [int(valor) for item in ids or [] for valor in str(item).split(',') if valor.strip()] or None
+    except ValueError:
+        return jsonify({'message': 'IDs inválidos.'}), 400
+
+    filtros = {chave: dados.get(chave) for chave in ('contribuinte', 'de', 'ate', 'status') if dados.get(chave)}
+    if not ids and not filtros:
+        return jsonify({'message': 'Informe os IDs das guias ou ao menos um filtro.'}), 400
 
-    if not requisicoes:
+    limite = current_app.config['LIMITE_SELECAO_RECIBOS']
+    if ids and len(ids) > limite:
+        return jsonify({'message': f'Selecione no máximo {limite} guias por download.'}), 400
+
+    try:
+        query = filtrar_requisicoes(session.query(Requisicao).filter(Requisicao.possui_pdf), ids=ids, **filtros)
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+
+    return _zip_recibos(query, 'recibos_selecionados.zip')
+
+
+def _zip_recibos(query, nome_arquivo):
+    """
+    Envia em streaming um ZIP com as guias da consulta, lidas do banco e escritas no
+    arquivo uma a uma. `nivel` (0 a 9) escolhe a compressão; o padrão, 0, grava os PDFs
+    sem compressão.
+
+    Parâmetros:
+        query: Consulta sobre `Requisicao`, já filtrada.
+        nome_arquivo (str): Nome do ZIP baixado.
+
+    Retorna:
+        Response: ZIP em streaming, ou 404 se a consulta não tiver guias.
+    """
+    if not session.query(query.exists()).scalar():
         return jsonify({'message': 'Nenhum recibo disponível para download.'}), 404
 
-    zip_buffer = io.BytesIO()
-    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-        for req in requisicoes:
-            pdf_bytes = base64.b64decode(req.resposta_base64)
+    # Códigos de todas as empresas da exportação, resolvidos de uma vez (cache + uma consulta IN)
+    codigos = codigos_empresas(session, [
+        contribuinte for (contribuinte,) in query.with_entities(Requisicao.contribuinte).distinct()
+    ])
+    nome_unico = NomesUnicos()
 
-            cnpj_contribuinte = req.contribuinte
-            codigo_empresa = CNPJ_CODIGO_EMPRESA.get(cnpj_contribuinte, "0000")
-            data_envio = req.data_envio
-            mesano = data_envio.strftime('%m%Y')
-            nome_arquivo = f"{codigo_empresa}-PARC SN-{mesano}.pdf"
-            zip_file.writestr(nome_arquivo, pdf_bytes)
+    def entradas():
+        for req in query.options(undefer(Requisicao.pdf)).order_by(Requisicao.id).yield_per(50):
+            codigo = codigos.get(normalizar_documento(req.contribuinte), CODIGO_PADRAO)
+            yield nome_unico(_nome_arquivo_guia(codigo, req.data_envio)), req.pdf
 
-    zip_buffer.seek(0)
+            # Libera o PDF já enviado para manter a memória constante
+            session.expunge(req)
 
-    return send_file(
-        zip_buffer,
+    return Response(
+        stream_with_context(gerar_zip_streaming(entradas(), nivel=request.values.get('nivel', None))),
         mimetype='application/zip',
-        as_attachment=True,
-        download_name='recibos_em_lote.zip'
+        headers={'Content-Disposition': f'attachment; filename={nome_arquivo}'}
     )
 
 
 if __name__ == "__main__":
-    app.run(debug=True)
+    criar_app('desenvolvimento').run(debug=True)
@@ -0,0 +1,125 @@
+"""
+Benchmark: latência das listagens de requisições com e sem índices.
+
+Cria um banco SQLite temporário com N requisições (com PDFs sintéticos) e mede:
+    - antes: sem índices secundários, filtro de mês com `extract('month', ...)`;
+    - depois: com os índices do modelo, filtro de mês por intervalo de datas.
+
+Uso:
+    python benchmarks/consulta_indices.py --linhas 100000 --tamanho-pdf 2048
+"""
+import argparse
+import datetime
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, extract, insert  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+from models import Base, Requisicao  # noqa: E402
+from consultas import filtrar_requisicoes  # noqa: E402
+
+
+def popular(engine, linhas, tamanho_pdf, contribuintes):
+    """
+    Insere `linhas` requisições distribuídas entre os contribuintes e os meses de 2023-2024.
+    """
+    pdf = os.urandom(tamanho_pdf)
+    inicio = datetime.datetime(2023, 1, 1)
+    with engine.begin() as conexao:
+        bloco = []
+        for i in range(linhas):
+            bloco.append({
+                'contribuinte': f"{i % contribuintes:014d}",
+                'tipo_contribuinte': 2,
+                'id_sistema': 'PARCSN',
+                'id_servico': 'GERARDAS161',
+                'pdf': pdf,
+                'pdf_sha256': '0' * 64,
+                'pdf_tamanho': tamanho_pdf,
+                'data_envio': inicio + datetime.timedelta(minutes=random.randrange(2 * 365 * 24 * 60)),
+                'status': 'Concluído' if i % 10 else 'Erro'
+            })
+            if len(bloco) == 5000:
+                conexao.execute(insert(Requisicao), bloco)
+                bloco = []
+        if bloco:
+            conexao.execute(insert(Requisicao), bloco)
+
+
+def medir(funcao, repeticoes):
+    """
+    Executa `funcao` várias vezes e retorna a mediana em milissegundos.
+    """
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        funcao()
+        tempos.append((time.perf_counter() - inicio) * 1000)
+    return statistics.median(tempos)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--linhas', type=int, default=100000)
+    parser.add_argument('--tamanho-pdf', type=int, default=2048)
+    parser.add_argument('--contribuintes', type=int, default=2000)
+    parser.add_argument('--repeticoes', type=int, default=20)
+    args = parser.parse_args()
+
+    caminho = os.path.join(tempfile.mkdtemp(), 'benchmark.db')
+    engine = create_engine(f'sqlite:///{caminho}')
+    Base.metadata.create_all(engine)
+    tabela = Requisicao.__table__
+
+    print(f"Populando {args.linhas} requisições em {caminho}...")
+    popular(engine, args.linhas, args.tamanho_pdf, args.contribuintes)
+
+    session = sessionmaker(bind=engine)()
+    contribuinte = f"{7:014d}"
+
+    # Antes: sem índices secundários e filtro de mês com extract()
+    for indice in tabela.indexes:
+        indice.drop(engine)
+
+    antes = {
+        'contribuinte': medir(lambda: session.query(Requisicao).filter(
+            Requisicao.contribuinte == contribuinte).all(), args.repeticoes),
+        'contribuinte + mês': medir(lambda: session.query(Requisicao).filter(
+            Requisicao.contribuinte == contribuinte,
+            extract('month', Requisicao.data_envio) == 3).all(), args.repeticoes),
+        'status': medir(lambda: session.query(Requisicao.id).filter(
+            Requisicao.status == 'Erro').count(), args.repeticoes),
+    }
+
+    # Depois: índices do modelo e filtro de mês por intervalo de datas
+    for indice in tabela.indexes:
+        indice.create(engine)
+    with engine.begin() as conexao:
+        conexao.exec_driver_sql('ANALYZE')
+
+    depois = {
+        'contribuinte': medir(lambda: filtrar_requisicoes(
+            session.query(Requisicao), contribuinte=contribuinte).all(), args.repeticoes),
+        'contribuinte + mês': medir(lambda: filtrar_requisicoes(
+            session.query(Requisicao), contribuinte=contribuinte, mes=3, ano=2024).all(), args.repeticoes),
+        'status': medir(lambda: session.query(Requisicao.id).filter(
+            Requisicao.status == 'Erro').count(), args.repeticoes),
+    }
+
+    print(f"\n{'consulta':<22}{'antes (ms)':>12}{'depois (ms)':>14}")
+    for nome in antes:
+        print(f"{nome:<22}{antes[nome]:>12.2f}{depois[nome]:>14.2f}")
+
+    session.close()
+    engine.dispose()
+    os.remove(caminho)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,207 @@
+"""
+Gerador de dados sintéticos para os benchmarks.
+
+    - requisicoes: popula a tabela com N requisições concluídas (com PDF) e com erro,
+      distribuídas entre contribuintes e meses;
+    - planilha: gera um .csv ou .xlsx no formato do envio em lote, com CNPJs válidos;
+    - certificado: gera um certificado PFX autoassinado, para que a autenticação
+      possa montar a sessão mTLS apontando para o servidor simulado.
+
+Uso:
+    python benchmarks/dados_sinteticos.py requisicoes --database-url sqlite:///bench.db --linhas 100000
+    python benchmarks/dados_sinteticos.py planilha --saida lote.csv --linhas 5000
+    python benchmarks/dados_sinteticos.py certificado --saida cert.pfx --senha 1234
+"""
+import argparse
+import datetime
+import hashlib
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, insert  # noqa: E402
+
+_PESOS_DV1 = (5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2)
+_PESOS_DV2 = (6, 5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2)
+
+
+def gerar_cnpj(raiz):
+    """
+    Gera um CNPJ válido (somente dígitos) para a matriz da raiz informada.
+    """
+    digitos = [int(d) for d in f"{raiz % 10 ** 8:08d}0001"]
+    for pesos in (_PESOS_DV1, _PESOS_DV2):
+        resto = sum(d * p for d, p in zip(digitos, pesos)) % 11
+        digitos.append(0 if resto < 2 else 11 - resto)
+    return ''.join(map(str, digitos))
+
+
+def formatar_cnpj(cnpj):
+    return f"{cnpj[:2]}.{cnpj[2:5]}.{cnpj[5:8]}/{cnpj[8:12]}-{cnpj[12:]}"
+
+
+# ===========================================
+# REQUISIÇÕES
+# ===========================================
+
+def popular_requisicoes(database_url, linhas, contribuintes=2000, tamanho_pdf=50000, meses=24,
+                        taxa_erro=0.1, tamanho_bloco=2000, semente=42):
+    """
+    Insere `linhas` requisições sintéticas no banco informado, criando as tabelas se preciso.
+
+    Parâmetros:
+        database_url (str): URL do banco (ex.: sqlite:///bench.db).
+        linhas (int): Quantidade de requisições.
+        contribuintes (int): Quantidade de CNPJs distintos.
+        tamanho_pdf (int): Tamanho do PDF das requisições concluídas, em bytes.
+        meses (int): Meses, contados para trás a partir do atual, em que as datas são distribuídas.
+        taxa_erro (float): Fração das requisições com status "Erro" (sem PDF).
+        tamanho_bloco (int): Linhas por INSERT.
+        semente (int): Semente do gerador aleatório, para execuções repetíveis.
+
+    Retorna:
+        list: CNPJs usados.
+    """
+    from models import Base, Requisicao
+    from cache_emissao import chave_emissao
+
+    aleatorio = random.Random(semente)
+    engine = create_engine(database_url)
+    Base.metadata.create_all(engine)
+
+    cnpjs = [gerar_cnpj(raiz) for raiz in range(1, contribuintes + 1)]
+    pdf = os.urandom(tamanho_pdf)
+    campos_pdf = {'pdf': pdf, 'pdf_sha256': hashlib.sha256(pdf).hexdigest(), 'pdf_tamanho': len(pdf)}
+    fim = datetime.datetime.now(datetime.timezone.utc)
+    intervalo_minutos = meses * 30 * 24 * 60
+
+    with engine.begin() as conexao:
+        bloco = []
+        for i in range(linhas):
+            cnpj = cnpjs[i % contribuintes]
+            data_envio = fim - datetime.timedelta(minutes=aleatorio.randrange(intervalo_minutos))
+            parcela = data_envio.strftime('%Y%m')
+            registro = {
+                'contribuinte': cnpj,
+                'tipo_contribuinte': 2,
+                'id_sistema': 'PARCSN',
+                'id_servico': 'GERARDAS161',
+                'data_envio': data_envio,
+                'data_resposta': data_envio,
+                'parcela': parcela,
+                'chave_emissao': chave_emissao(cnpj, 2, 'PARCSN', 'GERARDAS161', parcela),
+                'pdf': None, 'pdf_sha256': None, 'pdf_tamanho': None,
+            }
+            if aleatorio.random() < taxa_erro:
+                registro.update(status='Erro', response_message='Erro simulado')
+            else:
+                registro.update(campos_pdf, status='Concluído', response_message='Sucesso')
+            bloco.append(registro)
+
+            if len(bloco) >= tamanho_bloco:
+                conexao.execute(insert(Requisicao), bloco)
+                bloco = []
+        if bloco:
+            conexao.execute(insert(Requisicao), bloco)
+
+    engine.dispose()
+    return cnpjs
+
+
+# ===========================================
+# PLANILHA DO ENVIO EM LOTE
+# ===========================================
+
+def gerar_planilha(caminho, linhas, contribuintes=None, parcela='2024/01', semente=42):
+    """
+    Gera a planilha do envio em lote (.csv ou .xlsx, pela extensão de `caminho`).
+
+    Parâmetros:
+        caminho (str): Arquivo de saída.
+        linhas (int): Quantidade de linhas.
+        contribuintes (int): CNPJs distintos (padrão: um por linha, sem repetição de chave).
+        parcela (str): Valor da coluna DATA_ENVIO.
+        semente (int): Semente do gerador aleatório.
+    """
+    import pandas as pd
+
+    contribuintes = contribuintes or linhas
+    deslocamento = random.Random(semente).randrange(10 ** 6)
+    df = pd.DataFrame({
+        'CNPJ': [formatar_cnpj(gerar_cnpj(deslocamento + i % contribuintes)) for i in range(linhas)],
+        'ID_SISTEMA': 'PARCSN',
+        'ID_SERVICO': 'GERARDAS161',
+        'DATA_ENVIO': parcela,
+    })
+    if caminho.lower().endswith('.csv'):
+        df.to_csv(caminho, index=False)
+    else:
+        df.to_excel(caminho, index=False)
+
+
+# ===========================================
+# CERTIFICADO AUTOASSINADO
+# ===========================================
+
+def gerar_certificado_pfx(caminho, senha):
+    """
+    Gera um certificado PKCS#12 autoassinado (chave RSA de 2048 bits, validade de 1 ano).
+    """
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    from cryptography.hazmat.primitives.serialization import pkcs12
+    from cryptography.x509.oid import NameOID
+
+    chave = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    nome = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, 'BENCHMARK SERPRO:00000000000191')])
+    agora = datetime.datetime.now(datetime.timezone.utc)
+    certificado = (
+        x509.CertificateBuilder()
+        .subject_name(nome)
+        .issuer_name(nome)
+        .public_key(chave.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(agora - datetime.timedelta(days=1))
+        .not_valid_after(agora + datetime.timedelta(days=365))
+        .sign(chave, hashes.SHA256())
+    )
+    with open(caminho, 'wb') as arquivo:
+        arquivo.write(pkcs12.serialize_key_and_certificates(
+            b'benchmark', chave, certificado, None,
+            serialization.BestAvailableEncryption(senha.encode())
+        ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='comando', required=True)
+
+    requisicoes = subparsers.add_parser('requisicoes')
+    requisicoes.add_argument('--database-url', required=True)
+    requisicoes.add_argument('--linhas', type=int, default=100000)
+    requisicoes.add_argument('--contribuintes', type=int, default=2000)
+    requisicoes.add_argument('--tamanho-pdf', type=int, default=50000)
+
+    planilha = subparsers.add_parser('planilha')
+    planilha.add_argument('--saida', required=True)
+    planilha.add_argument('--linhas', type=int, default=1000)
+    planilha.add_argument('--contribuintes', type=int)
+
+    certificado = subparsers.add_parser('certificado')
+    certificado.add_argument('--saida', required=True)
+    certificado.add_argument('--senha', required=True)
+
+    args = parser.parse_args()
+    if args.comando == 'requisicoes':
+        popular_requisicoes(args.database_url, args.linhas, args.contribuintes, args.tamanho_pdf)
+    elif args.comando == 'planilha':
+        gerar_planilha(args.saida, args.linhas, args.contribuintes)
+    else:
+        gerar_certificado_pfx(args.saida, args.senha)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+"""
+Benchmark: vazão de emissão com o logging ligado e desligado.
+
+Mede o custo, no cliente, de `montar_json_gerardas` + `fazer_requisicao_serpro` com
+respostas simuladas por um adaptador HTTP em memória (sem rede), de modo que a
+diferença entre os cenários é apenas a serialização e a escrita dos logs:
+    - legado: despejo de cabeçalhos, payload indentado e corpo da resposta, como antes;
+    - desligado: nível WARNING;
+    - info: nível INFO (padrão da aplicação);
+    - debug amostrado: DEBUG com SERPRO_LOG_AMOSTRAGEM = --amostragem;
+    - debug: DEBUG em todas as chamadas.
+
+Os logs vão para um arquivo temporário, como em um pipeline de logs.
+
+Uso:
+    python benchmarks/emissao_logging.py --emissoes 500 --tamanho-pdf 300000
+"""
+import argparse
+import base64
+import contextlib
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests  # noqa: E402
+from requests.adapters import BaseAdapter  # noqa: E402
+import contratantes  # noqa: E402
+import registro  # noqa: E402
+import utils  # noqa: E402
+
+
+class AdaptadorSimulado(BaseAdapter):
+    """
+    Responde a qualquer requisição com o JSON de emissão do SERPRO contendo um PDF em base64.
+    """
+
+    def __init__(self, tamanho_pdf, legado=False):
+        super().__init__()
+        pdf_b64 = base64.b64encode(os.urandom(tamanho_pdf)).decode()
+        self.corpo = json.dumps({
+            "dados": json.dumps({"docArrecadacaoPdfB64": pdf_b64}),
+            "mensagens": [{"codigo": "Sucesso", "texto": "Requisição efetuada com sucesso."}]
+        }).encode()
+        self.legado = legado
+
+    def send(self, request, **kwargs):
+        resposta = requests.Response()
+        resposta.status_code = 200
+        resposta._content = self.corpo
+        resposta.headers['Content-Type'] = 'application/json'
+        resposta.request = request
+        resposta.url = request.url
+
+        if self.legado:
+            # Reproduz os prints removidos: JSON montado, cabeçalhos, payload e corpo da resposta
+            payload = json.loads(request.body)
+            print(f"JSON montado para envio: {json.dumps(payload, indent=2)}")
+            print(f"Fazendo requisição para {request.url}")
+            print(f"Headers: {dict(request.headers)}")
+            print(f"Payload de Dados: {json.dumps(payload, indent=2)}")
+            print(f"Status da resposta: {resposta.status_code}")
+            print(f"Corpo da resposta: {resposta.text}")
+        return resposta
+
+    def close(self):
+        pass
+
+
+def medir(emissoes, tamanho_pdf, nivel, amostragem=1.0, legado=False):
+    """
+    Executa `emissoes` emissões simuladas e retorna (emissões/s, bytes de log escritos).
+    """
+    sessao = requests.Session()
+    sessao.mount('https://', AdaptadorSimulado(tamanho_pdf, legado=legado))
+    contratantes.obter_sessao_gateway = lambda contratante=None: sessao
+    utils.obter_token_autenticacao = lambda contratante=None: ('access-token-secreto', 'jwt-token-secreto')
+    registro.LOG_AMOSTRAGEM = amostragem
+
+    with tempfile.NamedTemporaryFile('w', suffix='.log', delete=False) as arquivo:
+        caminho = arquivo.name
+
+    raiz = logging.getLogger()
+    handler = logging.FileHandler(caminho, encoding='utf8')
+    handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s [%(threadName)s] %(name)s: %(message)s'))
+    raiz.handlers = [handler]
+    raiz.setLevel(nivel)
+
+    with open(caminho, 'a', encoding='utf8') as saida, contextlib.redirect_stdout(saida):
+        inicio = time.perf_counter()
+        for i in range(emissoes):
+            json_data = utils.montar_json_gerardas(f"{i:014d}", 2, 'PARCSN', 'GERARDAS161', '202401')
+            pdf, _ = utils.fazer_requisicao_serpro('/Emitir', method='POST', data=json_data)
+            assert pdf
+        duracao = time.perf_counter() - inicio
+
+    handler.close()
+    tamanho_log = os.path.getsize(caminho)
+    os.remove(caminho)
+    return emissoes / duracao, tamanho_log
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--emissoes', type=int, default=500)
+    parser.add_argument('--tamanho-pdf', type=int, default=300000, help='Tamanho do PDF antes do base64, em bytes')
+    parser.add_argument('--amostragem', type=float, default=0.01)
+    args = parser.parse_args()
+
+    cenarios = [
+        ('legado', dict(nivel=logging.INFO, legado=True)),
+        ('desligado', dict(nivel=logging.WARNING)),
+        ('info', dict(nivel=logging.INFO)),
+        (f'debug amostrado ({args.amostragem:.0%})', dict(nivel=logging.DEBUG, amostragem=args.amostragem)),
+        ('debug', dict(nivel=logging.DEBUG)),
+    ]
+
+    # Aquecimento: importações preguiçosas, pools e caches do interpretador
+    medir(min(args.emissoes, 50), args.tamanho_pdf, logging.WARNING)
+
+    print(f"{args.emissoes} emissões, PDF de {args.tamanho_pdf} bytes\n")
+    print(f"{'cenário':<24}{'emissões/s':>12}{'log (KB)':>12}")
+    for nome, parametros in cenarios:
+        vazao, tamanho_log = medir(args.emissoes, args.tamanho_pdf, **parametros)
+        print(f"{nome:<24}{vazao:>12.1f}{tamanho_log / 1024:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
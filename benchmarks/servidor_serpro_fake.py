@@ -0,0 +1,189 @@
+"""
+Servidor local que simula os endpoints do SERPRO usados pela aplicação:
+    - POST /authenticate: devolve access_token, jwt_token e expires_in;
+    - POST /integra-contador/v1/Emitir: devolve o PDF da guia em base64.
+
+Latência, taxa de erro e tamanho do PDF são configuráveis, para medir a vazão da
+aplicação sem o gateway real nem um certificado válido. A aplicação é apontada para
+o servidor pelas variáveis SERPRO_AUTH_URL e SERPRO_GATEWAY_URL.
+
+Uso:
+    python benchmarks/servidor_serpro_fake.py --porta 8085 --latencia-ms 150 --taxa-erro 0.02
+"""
+import argparse
+import base64
+import json
+import os
+import random
+import secrets
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+def gerar_pdf(tamanho):
+    """
+    Monta um PDF sintético com aproximadamente `tamanho` bytes.
+    """
+    cabecalho = b"%PDF-1.4\n% guia sintetica\n"
+    rodape = b"\n%%EOF\n"
+    return cabecalho + os.urandom(max(0, tamanho - len(cabecalho) - len(rodape))) + rodape
+
+
+class ServidorSerproFake(ThreadingHTTPServer):
+    """
+    Servidor HTTP com o estado da simulação (tokens emitidos, parâmetros e contadores).
+    """
+
+    daemon_threads = True
+
+    def __init__(self, endereco, latencia_ms=100.0, variacao_ms=0.0, taxa_erro=0.0, status_erro=503,
+                 tamanho_pdf=50000, expira_em=3600, latencia_autenticacao_ms=200.0):
+        """
+        Parâmetros:
+            endereco (tuple): (host, porta); porta 0 escolhe uma porta livre.
+            latencia_ms (float): Latência média do /Emitir, em milissegundos.
+            variacao_ms (float): Variação uniforme (+/-) da latência, em milissegundos.
+            taxa_erro (float): Fração (0 a 1) das emissões que respondem `status_erro`.
+            status_erro (int): Status HTTP das emissões com erro (ex.: 503, 500, 429).
+            tamanho_pdf (int): Tamanho do PDF devolvido, em bytes (antes do base64).
+            expira_em (int): Validade dos tokens emitidos, em segundos.
+            latencia_autenticacao_ms (float): Latência do /authenticate, em milissegundos.
+        """
+        super().__init__(endereco, _Manipulador)
+        self.latencia_ms = latencia_ms
+        self.variacao_ms = variacao_ms
+        self.taxa_erro = taxa_erro
+        self.status_erro = status_erro
+        self.expira_em = expira_em
+        self.latencia_autenticacao_ms = latencia_autenticacao_ms
+        self.pdf_b64 = base64.b64encode(gerar_pdf(tamanho_pdf)).decode()
+
+        self.tokens = set()
+        self.contadores = {"autenticacoes": 0, "emissoes": 0, "erros": 0, "nao_autorizadas": 0}
+        self._lock = threading.Lock()
+
+    @property
+    def url_base(self):
+        host, porta = self.server_address[:2]
+        return f"http://{host}:{porta}"
+
+    def contar(self, nome):
+        with self._lock:
+            self.contadores[nome] += 1
+
+    def aguardar_latencia(self, media_ms):
+        atraso = media_ms + random.uniform(-self.variacao_ms, self.variacao_ms)
+        if atraso > 0:
+            time.sleep(atraso / 1000)
+
+
+class _Manipulador(BaseHTTPRequestHandler):
+    # Keep-alive, como o gateway real
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, formato, *args):
+        pass
+
+    def _responder(self, status, corpo, cabecalhos=None):
+        dados = json.dumps(corpo).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(dados)))
+        for nome, valor in (cabecalhos or {}).items():
+            self.send_header(nome, valor)
+        self.end_headers()
+        self.wfile.write(dados)
+
+    def do_POST(self):
+        tamanho = int(self.headers.get('Content-Length') or 0)
+        corpo = self.rfile.read(tamanho) if tamanho else b''
+        servidor = self.server
+
+        if self.path.rstrip('/').endswith('/authenticate'):
+            servidor.aguardar_latencia(servidor.latencia_autenticacao_ms)
+            if not self.headers.get('Authorization', '').startswith('Basic '):
+                return self._responder(401, {"error": "invalid_client"})
+            token = secrets.token_hex(16)
+            with servidor._lock:
+                servidor.tokens.add(token)
+            servidor.contar("autenticacoes")
+            return self._responder(200, {
+                "access_token": token,
+                "jwt_token": secrets.token_hex(32),
+                "expires_in": servidor.expira_em,
+                "token_type": "Bearer"
+            })
+
+        if self.path.rstrip('/').endswith('/Emitir'):
+            token = self.headers.get('Authorization', '').removeprefix('Bearer ')
+            if token not in servidor.tokens:
+                servidor.contar("nao_autorizadas")
+                return self._responder(401, {"mensagens": [{"codigo": "401", "texto": "Token inválido"}]})
+
+            servidor.aguardar_latencia(servidor.latencia_ms)
+            if random.random() < servidor.taxa_erro:
+                servidor.contar("erros")
+                return self._responder(
+                    servidor.status_erro,
+                    {"mensagens": [{"codigo": str(servidor.status_erro), "texto": "Erro simulado"}]},
+                    {"Retry-After": "1"} if servidor.status_erro in (429, 503) else None
+                )
+
+            try:
+                pedido = json.loads(corpo)
+                json.loads(pedido["pedidoDados"]["dados"])["parcelaParaEmitir"]
+            except (ValueError, KeyError, TypeError):
+                return self._responder(400, {"mensagens": [{"codigo": "400", "texto": "Pedido inválido"}]})
+
+            servidor.contar("emissoes")
+            return self._responder(200, {
+                "status": 200,
+                "dados": json.dumps({"docArrecadacaoPdfB64": servidor.pdf_b64}),
+                "mensagens": [{"codigo": "Sucesso-PARCSN", "texto": "Requisição efetuada com sucesso."}]
+            })
+
+        self._responder(404, {"mensagens": [{"codigo": "404", "texto": "Endpoint não encontrado"}]})
+
+
+def iniciar(host='127.0.0.1', porta=0, **parametros):
+    """
+    Inicia o servidor em uma thread de segundo plano.
+
+    Retorna:
+        ServidorSerproFake: Servidor em execução; use `url_base` para montar as URLs
+            e `shutdown()` para encerrá-lo.
+    """
+    servidor = ServidorSerproFake((host, porta), **parametros)
+    threading.Thread(target=servidor.serve_forever, name='serpro-fake', daemon=True).start()
+    return servidor
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--porta', type=int, default=8085)
+    parser.add_argument('--latencia-ms', type=float, default=100.0)
+    parser.add_argument('--variacao-ms', type=float, default=0.0)
+    parser.add_argument('--taxa-erro', type=float, default=0.0)
+    parser.add_argument('--status-erro', type=int, default=503)
+    parser.add_argument('--tamanho-pdf', type=int, default=50000)
+    parser.add_argument('--expira-em', type=int, default=3600)
+    args = parser.parse_args()
+
+    servidor = ServidorSerproFake(
+        (args.host, args.porta), latencia_ms=args.latencia_ms, variacao_ms=args.variacao_ms,
+        taxa_erro=args.taxa_erro, status_erro=args.status_erro, tamanho_pdf=args.tamanho_pdf,
+        expira_em=args.expira_em
+    )
+    print(f"Servidor SERPRO simulado em {servidor.url_base}")
+    print(f"    SERPRO_AUTH_URL={servidor.url_base}/authenticate")
+    print(f"    SERPRO_GATEWAY_URL={servidor.url_base}/integra-contador/v1")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
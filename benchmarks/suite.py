@@ -0,0 +1,362 @@
+"""
+Suíte de benchmarks offline: mede a vazão das rotas principais contra o servidor SERPRO simulado.
+
+Cenários:
+    - gerar_das: emissões avulsas concorrentes em /gerar_das;
+    - enviar_em_lote: upload de uma planilha e processamento completo do lote;
+    - consulta: paginação e filtros em /consultar_requisicoes sobre N requisições;
+    - baixar_todos_recibos: download do ZIP em streaming com N guias.
+
+Cada cenário roda em um subprocesso próprio, com banco SQLite temporário, para que o
+pico de memória (RSS) e os caches sejam medidos de forma isolada. O relatório traz
+operações por segundo, latências p50/p99 e pico de RSS.
+
+Com --comparar, os resultados são comparados a uma execução anterior (--saida) e o
+processo termina com código 1 se algum cenário piorar além da tolerância.
+
+Uso:
+    python benchmarks/suite.py
+    python benchmarks/suite.py --cenarios gerar_das enviar_em_lote --latencia-ms 50 --saida base.json
+    python benchmarks/suite.py --comparar base.json --tolerancia 0.15
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+DIRETORIO = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, DIRETORIO)
+sys.path.insert(0, os.path.dirname(DIRETORIO))
+
+import dados_sinteticos  # noqa: E402
+import servidor_serpro_fake  # noqa: E402
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+CENARIOS = ('gerar_das', 'enviar_em_lote', 'consulta', 'baixar_todos_recibos')
+MARCADOR_RESULTADO = 'RESULTADO_BENCHMARK '
+
+
+# ===========================================
+# MEDIÇÕES
+# ===========================================
+
+def percentil(valores, fracao):
+    """
+    Percentil por posição mais próxima, em uma lista de valores.
+    """
+    if not valores:
+        return None
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, max(0, round(fracao * len(ordenados)) - 1))]
+
+
+def pico_rss_mb():
+    if resource is None:
+        return None
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def resultado(cenario, operacoes, duracao, latencias=None, **extra):
+    latencias = latencias or []
+    return {
+        "cenario": cenario,
+        "operacoes": operacoes,
+        "duracao_s": round(duracao, 3),
+        "por_segundo": round(operacoes / duracao, 2) if duracao else None,
+        "p50_ms": round(percentil(latencias, 0.50) * 1000, 2) if latencias else None,
+        "p99_ms": round(percentil(latencias, 0.99) * 1000, 2) if latencias else None,
+        "pico_rss_mb": pico_rss_mb(),
+        **extra
+    }
+
+
+def cliente_autenticado(app):
+    cliente = app.test_client()
+    with cliente.session_transaction() as sessao:
+        sessao['_user_id'] = 'admin'
+        sessao['_fresh'] = True
+    return cliente
+
+
+# ===========================================
+# CENÁRIOS (executados no subprocesso)
+# ===========================================
+
+def cenario_gerar_das(args):
+    from app import criar_app
+    app = criar_app()
+
+    cnpjs = [dados_sinteticos.gerar_cnpj(raiz) for raiz in range(1, args.operacoes + 1)]
+    locais = threading.local()
+
+    def emitir(cnpj):
+        if not hasattr(locais, 'cliente'):
+            locais.cliente = cliente_autenticado(app)
+        inicio = time.perf_counter()
+        resposta = locais.cliente.post('/gerar_das', data={
+            'contribuinte': cnpj, 'tipo_contribuinte': '2', 'id_sistema': 'PARCSN',
+            'id_servico': 'GERARDAS161', 'parcela_para_emitir': '202401'
+        })
+        return time.perf_counter() - inicio, resposta.status_code == 200
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concorrencia) as executor:
+        medicoes = list(executor.map(emitir, cnpjs))
+    duracao = time.perf_counter() - inicio
+
+    return resultado('gerar_das', len(cnpjs), duracao, [latencia for latencia, _ in medicoes],
+                     erros=sum(1 for _, ok in medicoes if not ok), concorrencia=args.concorrencia)
+
+
+def cenario_enviar_em_lote(args):
+    from app import criar_app
+    app = criar_app()
+
+    caminho = os.path.join(args.diretorio, 'lote.csv')
+    dados_sinteticos.gerar_planilha(caminho, args.operacoes)
+    cliente = cliente_autenticado(app)
+
+    inicio = time.perf_counter()
+    with open(caminho, 'rb') as arquivo:
+        resposta = cliente.post('/enviar_em_lote', data={'fileUpload': (arquivo, 'lote.csv')},
+                                content_type='multipart/form-data')
+    upload = time.perf_counter() - inicio
+    if resposta.status_code != 202:
+        raise RuntimeError(f"Upload recusado: {resposta.status_code} {resposta.get_data(as_text=True)}")
+
+    progresso_url = resposta.json['progresso_url']
+    latencias_progresso = []
+    while True:
+        consulta = time.perf_counter()
+        progresso = cliente.get(progresso_url).json
+        latencias_progresso.append(time.perf_counter() - consulta)
+        if progresso['status'] == 'Concluído':
+            break
+        time.sleep(0.05)
+    duracao = time.perf_counter() - inicio
+
+    return resultado('enviar_em_lote', progresso['total'], duracao, latencias_progresso,
+                     erros=progresso['erros'], upload_ms=round(upload * 1000, 1))
+
+
+def cenario_consulta(args):
+    dados_sinteticos.popular_requisicoes(os.environ['DATABASE_URL'], args.linhas, args.contribuintes,
+                                         tamanho_pdf=2048)
+    from app import criar_app
+    app = criar_app()
+    cliente = cliente_autenticado(app)
+    cnpjs = [dados_sinteticos.gerar_cnpj(raiz) for raiz in range(1, args.contribuintes + 1)]
+
+    latencias = []
+    linhas = 0
+
+    def consultar(url):
+        nonlocal linhas
+        inicio = time.perf_counter()
+        dados = cliente.get(url).json
+        latencias.append(time.perf_counter() - inicio)
+        linhas += len(dados['requisicoes'])
+        return dados
+
+    inicio = time.perf_counter()
+    # Paginação completa das primeiras páginas, sem filtros
+    cursor = ''
+    for _ in range(args.operacoes // 2):
+        dados = consultar(f'/consultar_requisicoes?limite=100&cursor={cursor}')
+        cursor = dados['proximo_cursor']
+        if not cursor:
+            break
+    # Filtros por contribuinte e mês
+    for i in range(args.operacoes - len(latencias)):
+        consultar(f'/consultar_requisicoes?contribuinte={cnpjs[i % len(cnpjs)]}&mes={i % 12 + 1}&limite=100')
+    duracao = time.perf_counter() - inicio
+
+    return resultado('consulta', len(latencias), duracao, latencias, linhas_por_segundo=round(linhas / duracao, 1))
+
+
+def cenario_baixar_todos_recibos(args):
+    dados_sinteticos.popular_requisicoes(os.environ['DATABASE_URL'], args.linhas_zip, args.contribuintes,
+                                         tamanho_pdf=args.tamanho_pdf, taxa_erro=0)
+    from app import criar_app
+    app = criar_app()
+    cliente = cliente_autenticado(app)
+
+    inicio = time.perf_counter()
+    resposta = cliente.get('/baixar_todos_recibos', buffered=False)
+    primeiro_byte = None
+    total_bytes = 0
+    for parte in resposta.response:
+        if primeiro_byte is None:
+            primeiro_byte = time.perf_counter() - inicio
+        total_bytes += len(parte)
+    resposta.close()
+    duracao = time.perf_counter() - inicio
+
+    return resultado('baixar_todos_recibos', args.linhas_zip, duracao,
+                     primeiro_byte_ms=round((primeiro_byte or duracao) * 1000, 1), mb=round(total_bytes / 2 ** 20, 1), mb_por_segundo=round(total_bytes / 2 ** 20 / duracao, 1))
+
+
+def executar_cenario(args):
+    """
+    Executa um cenário no processo atual e imprime o resultado em JSON.
+    """
+    funcoes = {
+        'gerar_das': cenario_gerar_das,
+        'enviar_em_lote': cenario_enviar_em_lote,
+        'consulta': cenario_consulta,
+        'baixar_todos_recibos': cenario_baixar_todos_recibos,
+    }
+    saida = funcoes[args.executar_cenario](args)
+    print(MARCADOR_RESULTADO + json.dumps(saida), flush=True)
+    # Encerra sem aguardar as threads de segundo plano da aplicação (supervisor, renovação de token)
+    os._exit(0)
+
+
+# ===========================================
+# ORQUESTRAÇÃO
+# ===========================================
+
+def ambiente_cenario(args, diretorio, servidor):
+    """
+    Variáveis de ambiente do subprocesso: banco temporário, servidor simulado e certificado gerado.
+    """
+    ambiente = dict(os.environ)
+    ambiente.update({
+        'DATABASE_URL': f"sqlite:///{os.path.join(diretorio, 'benchmark.db')}",
+        'SERPRO_AUTH_URL': f"{servidor.url_base}/authenticate",
+        'SERPRO_GATEWAY_URL': f"{servidor.url_base}/integra-contador/v1",
+        'CAMINHO_CERTIFICADO': args.diretorio_certificado,
+        'NOME_CERTIFICADO': 'benchmark.pfx',
+        'SENHA_CERTIFICADO': 'benchmark',
+        'CONSUMER_KEY': 'benchmark',
+        'CONSUMER_SECRET': 'benchmark',
+        'SERPRO_LIMITE_POR_SEGUNDO': str(args.limite_por_segundo),
+        'SERPRO_LOTE_WORKERS': str(args.workers),
+        'SERPRO_LOG_NIVEL': 'WARNING',
+        'SERPRO_TOKEN_ARQUIVO': '',
+        'SECRET_KEY': 'benchmark',
+    })
+    return ambiente
+
+
+def executar_suite(args):
+    args.diretorio_certificado = tempfile.mkdtemp(prefix='serpro-bench-cert-')
+    dados_sinteticos.gerar_certificado_pfx(os.path.join(args.diretorio_certificado, 'benchmark.pfx'), 'benchmark')
+
+    servidor = servidor_serpro_fake.iniciar(
+        latencia_ms=args.latencia_ms, variacao_ms=args.variacao_ms, taxa_erro=args.taxa_erro,
+        tamanho_pdf=args.tamanho_pdf
+    )
+
+    resultados = []
+    for cenario in args.cenarios:
+        diretorio = tempfile.mkdtemp(prefix=f'serpro-bench-{cenario}-')
+        comando = [sys.executable, os.path.abspath(__file__), '--executar-cenario', cenario,
+                   '--diretorio', diretorio] + args.repassar
+        processo = subprocess.run(comando, env=ambiente_cenario(args, diretorio, servidor),
+                                  capture_output=True, text=True)
+        linhas = [linha for linha in processo.stdout.splitlines() if linha.startswith(MARCADOR_RESULTADO)]
+        if processo.returncode != 0 or not linhas:
+            print(f"Cenário {cenario} falhou:\n{processo.stderr[-3000:]}", file=sys.stderr)
+            resultados.append({"cenario": cenario, "falhou": True})
+            continue
+        resultados.append(json.loads(linhas[-1][len(MARCADOR_RESULTADO):]))
+
+    servidor.shutdown()
+    return resultados, servidor.contadores
+
+
+def imprimir(resultados):
+    print(f"\n{'cenário':<22}{'operações':>10}{'ops/s':>10}{'p50 (ms)':>10}{'p99 (ms)':>10}{'RSS (MB)':>10}  extra")
+    for item in resultados:
+        if item.get('falhou'):
+            print(f"{item['cenario']:<22}{'FALHOU':>10}")
+            continue
+        fixos = {'cenario', 'operacoes', 'duracao_s', 'por_segundo', 'p50_ms', 'p99_ms', 'pico_rss_mb'}
+        extra = ', '.join(f"{chave}={valor}" for chave, valor in item.items() if chave not in fixos)
+        print(f"{item['cenario']:<22}{item['operacoes']:>10}{item['por_segundo'] or '-':>10}"
+              f"{item['p50_ms'] or '-':>10}{item['p99_ms'] or '-':>10}{item['pico_rss_mb'] or '-':>10}  {extra}")
+
+
+def comparar(resultados, caminho_base, tolerancia):
+    """
+    Compara com uma execução anterior. Retorna a lista de regressões encontradas.
+    """
+    with open(caminho_base, encoding='utf8') as arquivo:
+        base = {item['cenario']: item for item in json.load(arquivo)['resultados']}
+
+    regressoes = []
+    for item in resultados:
+        anterior = base.get(item['cenario'])
+        if not anterior or item.get('falhou') or anterior.get('falhou'):
+            continue
+        if anterior['por_segundo'] and item['por_segundo'] < anterior['por_segundo'] * (1 - tolerancia):
+            regressoes.append(f"{item['cenario']}: vazão {item['por_segundo']} ops/s (antes {anterior['por_segundo']})")
+        if anterior['p99_ms'] and item['p99_ms'] and item['p99_ms'] > anterior['p99_ms'] * (1 + tolerancia):
+            regressoes.append(f"{item['cenario']}: p99 {item['p99_ms']} ms (antes {anterior['p99_ms']})")
+    return regressoes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cenarios', nargs='+', choices=CENARIOS, default=list(CENARIOS))
+    parser.add_argument('--operacoes', type=int, default=200, help='Emissões, linhas do lote ou consultas')
+    parser.add_argument('--concorrencia', type=int, default=4, help='Clientes simultâneos em gerar_das')
+    parser.add_argument('--linhas', type=int, default=100000, help='Requisições no banco do cenário consulta')
+    parser.add_argument('--linhas-zip', type=int, default=2000, help='Guias no cenário baixar_todos_recibos')
+    parser.add_argument('--contribuintes', type=int, default=2000)
+    parser.add_argument('--latencia-ms', type=float, default=50.0, help='Latência simulada do /Emitir')
+    parser.add_argument('--variacao-ms', type=float, default=10.0)
+    parser.add_argument('--taxa-erro', type=float, default=0.0)
+    parser.add_argument('--tamanho-pdf', type=int, default=50000)
+    parser.add_argument('--workers', type=int, default=4, help='SERPRO_LOTE_WORKERS')
+    parser.add_argument('--limite-por-segundo', type=float, default=0,
+                        help='SERPRO_LIMITE_POR_SEGUNDO (0 desativa o limite e mede a capacidade do motor)')
+    parser.add_argument('--saida', help='Grava os resultados em JSON')
+    parser.add_argument('--comparar', help='JSON de uma execução anterior para detectar regressões')
+    parser.add_argument('--tolerancia', type=float, default=0.15)
+    parser.add_argument('--executar-cenario', choices=CENARIOS, help=argparse.SUPPRESS)
+    parser.add_argument('--diretorio', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.executar_cenario:
+        return executar_cenario(args)
+
+    # Parâmetros repassados aos subprocessos
+    args.repassar = [
+        '--operacoes', str(args.operacoes), '--concorrencia', str(args.concorrencia),
+        '--linhas', str(args.linhas), '--linhas-zip', str(args.linhas_zip),
+        '--contribuintes', str(args.contribuintes), '--tamanho-pdf', str(args.tamanho_pdf),
+    ]
+
+    resultados, contadores_servidor = executar_suite(args)
+    imprimir(resultados)
+    print(f"\nServidor simulado: {contadores_servidor}")
+
+    if args.saida:
+        with open(args.saida, 'w', encoding='utf8') as arquivo:
+            json.dump({"parametros": {k: v for k, v in vars(args).items() if k not in ('repassar',)},
+                       "resultados": resultados}, arquivo, indent=2, ensure_ascii=False)
+
+    if args.comparar:
+        regressoes = comparar(resultados, args.comparar, args.tolerancia)
+        for regressao in regressoes:
+            print(f"REGRESSÃO: {regressao}")
+        if regressoes:
+            sys.exit(1)
+
+    if any(item.get('falhou') for item in resultados):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,248 @@
+"""
+Módulo: cache_emissao.py
+
+Descrição:
+    Camada de deduplicação em frente a `fazer_requisicao_serpro`.
+
+    Cada emissão é identificada pela chave normalizada (contribuinte, tipo,
+    sistema, serviço, parcela). Se já existe uma guia concluída para a chave,
+    emitida há menos de SERPRO_CACHE_EMISSAO_TTL segundos, o PDF gravado é
+    reaproveitado sem nova chamada ao SERPRO.
+
+    Pedidos simultâneos da mesma chave são colapsados em uma única chamada:
+    dentro do processo, as threads aguardam a emissão em voo; entre processos,
+    a tabela `emissoes_em_andamento` (chave primária) funciona como reserva.
+    A reserva é liberada por quem grava a guia (`liberar_reservas`), na mesma
+    transação, para que quem aguarda encontre o PDF ao consultar o cache.
+
+Configuração (.env):
+    SERPRO_CACHE_EMISSAO_TTL: validade, em segundos, de uma guia emitida (padrão: 86400).
+    SERPRO_CACHE_RESERVA_EXPIRACAO: segundos após os quais uma reserva abandonada
+        é descartada (padrão: 120).
+"""
+import base64
+import datetime
+import logging
+import re
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import Future
+from decouple import config
+from sqlalchemy import delete
+from sqlalchemy.exc import IntegrityError
+from models import Session, Requisicao, EmissaoEmAndamento
+from utils import montar_json_gerardas, fazer_requisicao_serpro
+
+# ===========================================
+# CONFIGURAÇÃO
+# ===========================================
+
+CACHE_TTL = config('SERPRO_CACHE_EMISSAO_TTL', default=86400, cast=int)
+RESERVA_EXPIRACAO = config('SERPRO_CACHE_RESERVA_EXPIRACAO', default=120, cast=int)
+
+# Emissões em andamento neste processo, por chave
+_em_voo = {}
+_em_voo_lock = threading.Lock()
+
+"""
+Resultado de uma emissão.
+    pdf (bytes): PDF da guia, ou None em caso de erro.
+    mensagem (str): Mensagem do SERPRO ou de erro.
+    chave (str): Chave de emissão normalizada.
+    em_cache (bool): True se o PDF foi reaproveitado de uma emissão anterior.
+    reservada (bool): True se quem recebeu o resultado deve liberar a reserva da chave
+        com `liberar_reservas` ao gravar a guia.
+"""
+ResultadoEmissao = namedtuple('ResultadoEmissao', ['pdf', 'mensagem', 'chave', 'em_cache', 'reservada'])
+
+
+def _agora():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+# ===========================================
+# CHAVE DE EMISSÃO
+# ===========================================
+
+def chave_emissao(numero_contribuinte, tipo_contribuinte, id_sistema, id_servico, parcela_para_emitir):
+    """
+    Monta a chave normalizada de uma emissão a partir das entradas de `montar_json_gerardas`.
+
+    Retorna:
+        str: Chave no formato "documento|tipo|SISTEMA|SERVICO|AAAAMM".
+    """
+    return "|".join([
+        re.sub(r'\D', '', str(numero_contribuinte)),
+        str(int(tipo_contribuinte)),
+        str(id_sistema).strip().upper(),
+        str(id_servico).strip().upper(),
+        re.sub(r'\D', '', str(parcela_para_emitir))
+    ])
+
+
+# ===========================================
+# CONSULTA AO CACHE
+# ===========================================
+
+def _buscar_em_cache(db, chave, limite):
+    """
+    Retorna (pdf, mensagem) da guia mais recente da chave emitida a partir de `limite`, ou None.
+    """
+    return (
+        db.query(Requisicao.pdf, Requisicao.response_message)
+        .filter(
+            Requisicao.chave_emissao == chave,
+            Requisicao.status == "Concluído",
+            Requisicao.possui_pdf,
+            Requisicao.data_resposta >= limite
+        )
+        .order_by(Requisicao.data_resposta.desc())
+        .first()
+    )
+
+
+# ===========================================
+# RESERVA DA CHAVE ENTRE PROCESSOS
+# ===========================================
+
+def _reservar(db, chave):
+    """
+    Tenta reservar a chave. Reservas mais antigas que SERPRO_CACHE_RESERVA_EXPIRACAO são descartadas.
+
+    Retorna:
+        bool: True se a reserva foi obtida.
+    """
+    limite = _agora() - datetime.timedelta(seconds=RESERVA_EXPIRACAO)
+    db.execute(delete(EmissaoEmAndamento).where(
+        EmissaoEmAndamento.chave == chave, EmissaoEmAndamento.data_inicio < limite
+    ))
+    db.add(EmissaoEmAndamento(chave=chave, data_inicio=_agora()))
+    try:
+        db.commit()
+        return True
+    except IntegrityError:
+        db.rollback()
+        return False
+
+
+def liberar_reservas(db, chaves):
+    """
+    Libera as reservas das chaves informadas, sem fazer commit.
+
+    Deve ser chamada na mesma transação que grava as guias emitidas.
+
+    Parâmetros:
+        db: Sessão do SQLAlchemy.
+        chaves (iterable): Chaves de emissão a liberar.
+    """
+    chaves = list(chaves)
+    if chaves:
+        db.execute(delete(EmissaoEmAndamento).where(EmissaoEmAndamento.chave.in_(chaves)))
+
+
+# ===========================================
+# EMISSÃO COM CACHE
+# ===========================================
+
+def _emitir_no_serpro(numero_contribuinte, tipo_contribuinte, id_sistema, id_servico, parcela_para_emitir,
+                      contratante=None):
+    json_data = montar_json_gerardas(
+        numero_contribuinte,
+        tipo_contribuinte,
+        id_sistema,
+        id_servico,
+        parcela_para_emitir,
+        contratante=contratante
+    )
+    resposta_pdf_b64, mensagem = fazer_requisicao_serpro("/Emitir", method='POST', data=json_data,
+                                                         contratante=contratante)
+    return (base64.b64decode(resposta_pdf_b64) if resposta_pdf_b64 else None), mensagem
+
+
+def emitir_guia(numero_contribuinte, tipo_contribuinte, id_sistema, id_servico, parcela_para_emitir,
+                forcar=False, forcar_desde=None, ttl=None, contratante=None):
+    """
+    Emite a guia DAS, reaproveitando uma emissão recente da mesma chave quando houver.
+
+    Parâmetros:
+        numero_contribuinte (str): Número do contribuinte (CPF/CNPJ).
+        tipo_contribuinte (int): Tipo do contribuinte (1 para CPF, 2 para CNPJ).
+        id_sistema (str): ID do sistema solicitado.
+        id_servico (str): ID do serviço solicitado.
+        parcela_para_emitir (str): Parcela (AAAAMM).
+        forcar (bool): Ignora as guias emitidas antes de `forcar_desde` e solicita a guia
+            novamente ao SERPRO. Guias emitidas depois (ex.: por outra linha do mesmo lote)
+            continuam sendo reaproveitadas.
+        forcar_desde (datetime): Início da validade quando `forcar` é True (padrão: agora).
+        ttl (int): Validade da guia em cache, em segundos (padrão: SERPRO_CACHE_EMISSAO_TTL).
+        contratante (Contratante | str): Contratante que solicita a guia ao SERPRO (padrão: contratante
+            padrão). A chave de emissão não inclui o contratante: a guia é a mesma para qualquer um.
+
+    Retorna:
+        ResultadoEmissao: PDF, mensagem e origem da guia.
+    """
+    chave = chave_emissao(numero_contribuinte, tipo_contribuinte, id_sistema, id_servico, parcela_para_emitir)
+    ttl = CACHE_TTL if ttl is None else ttl
+    limite = _agora() - datetime.timedelta(seconds=ttl)
+    if forcar:
+        forcar_desde = forcar_desde or _agora()
+        if forcar_desde.tzinfo is None:
+            # Datas lidas do SQLite voltam sem fuso; são gravadas em UTC
+            forcar_desde = forcar_desde.replace(tzinfo=datetime.timezone.utc)
+        limite = max(limite, forcar_desde)
+
+    # Colapsa pedidos simultâneos da mesma chave dentro do processo
+    with _em_voo_lock:
+        futuro = _em_voo.get(chave)
+        dono = futuro is None
+        if dono:
+            futuro = _em_voo[chave] = Future()
+
+    if not dono:
+        pdf, mensagem = futuro.result()
+        return ResultadoEmissao(pdf, mensagem, chave, pdf is not None, False)
+
+    db = Session()
+    resultado = ResultadoEmissao(None, None, chave, False, False)
+    try:
+        limite_espera = time.monotonic() + RESERVA_EXPIRACAO
+        reservada = False
+
+        while True:
+            em_cache = _buscar_em_cache(db, chave, limite)
+            if em_cache:
+                logging.debug("Guia reaproveitada do cache para a chave %s", chave)
+                resultado = ResultadoEmissao(
+                    em_cache.pdf, em_cache.response_message or "Guia reaproveitada de emissão anterior",
+                    chave, True, False
+                )
+                return resultado
+
+            # Outro processo está emitindo a mesma guia: aguarda a gravação e consulta o cache de novo.
+            # Esgotada a espera, emite sem a reserva, que continua sendo do outro processo.
+            reservada = _reservar(db, chave)
+            if reservada or time.monotonic() > limite_espera:
+                break
+            time.sleep(0.2)
+
+        try:
+            pdf, mensagem = _emitir_no_serpro(
+                numero_contribuinte, tipo_contribuinte, id_sistema, id_servico, parcela_para_emitir, contratante
+            )
+        except Exception as e:
+            pdf, mensagem = None, f"Erro ao processar o CNPJ {numero_contribuinte}: {str(e)}"
+
+        if pdf is None and reservada:
+            # Nada a gravar no cache: libera a reserva imediatamente
+            liberar_reservas(db, [chave])
+            db.commit()
+
+        resultado = ResultadoEmissao(pdf, mensagem, chave, False, reservada and pdf is not None)
+        return resultado
+
+    finally:
+        db.close()
+        with _em_voo_lock:
+            _em_voo.pop(chave, None)
+        futuro.set_result((resultado.pdf, resultado.mensagem))
@@ -0,0 +1,96 @@
+"""
+Módulo: cache_pdfs.py
+
+Descrição:
+    Cache em memória, LRU e limitado em bytes, dos PDFs servidos em /baixar_recibo.
+
+    Os PDFs são indexados pelo hash SHA-256 do conteúdo (`Requisicao.pdf_sha256`): como
+    a chave muda junto com o conteúdo, o cache nunca precisa ser invalidado, e guias
+    idênticas de requisições diferentes ocupam uma única entrada. Downloads repetidos
+    da mesma guia não voltam a ler a coluna `pdf` do banco.
+
+    O cache é por processo: com vários workers (gunicorn), cada um mantém o seu.
+
+Configuração (.env):
+    SERPRO_CACHE_PDFS_BYTES: memória máxima ocupada pelos PDFs em cache (padrão: 32 MB; 0 desativa).
+"""
+import threading
+from collections import OrderedDict
+from decouple import config
+from metricas import CACHE_PDFS  # Métricas expostas em /metrics
+
+# ===========================================
+# CONFIGURAÇÃO
+# ===========================================
+
+LIMITE_BYTES = config('SERPRO_CACHE_PDFS_BYTES', default=32 * 1024 * 1024, cast=int)
+
+
+# ===========================================
+# CACHE LRU
+# ===========================================
+
+class CachePdfs:
+    """
+    Cache LRU de PDFs por hash do conteúdo, seguro para uso entre threads.
+    """
+
+    def __init__(self, limite_bytes=LIMITE_BYTES):
+        """
+        Parâmetros:
+            limite_bytes (int): Soma máxima do tamanho dos PDFs em cache. PDFs maiores que
+                um quarto do limite não são guardados, para não esvaziar o cache sozinhos.
+        """
+        self.limite_bytes = limite_bytes
+        self._itens = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def obter(self, sha256, carregar):
+        """
+        Retorna o PDF do hash informado, lendo-o com `carregar` se não estiver em cache.
+
+        Parâmetros:
+            sha256 (str): Hash SHA-256 do PDF.
+            carregar (callable): Função sem argumentos que lê o PDF do banco.
+
+        Retorna:
+            bytes: Conteúdo do PDF, ou None se `carregar` não o encontrar.
+        """
+        with self._lock:
+            pdf = self._itens.get(sha256)
+            if pdf is not None:
+                self._itens.move_to_end(sha256)
+        if pdf is not None:
+            CACHE_PDFS.inc(resultado='hit')
+            return pdf
+
+        CACHE_PDFS.inc(resultado='miss')
+        pdf = carregar()
+        if pdf is not None:
+            self._guardar(sha256, pdf)
+        return pdf
+
+    def _guardar(self, sha256, pdf):
+        if len(pdf) > self.limite_bytes // 4:
+            return
+        with self._lock:
+            if sha256 in self._itens:
+                return
+            self._itens[sha256] = pdf
+            self._bytes += len(pdf)
+            while self._bytes > self.limite_bytes:
+                _, removido = self._itens.popitem(last=False)
+                self._bytes -= len(removido)
+
+    def limpar(self):
+        with self._lock:
+            self._itens.clear()
+            self._bytes = 0
+
+    def estatisticas(self):
+        with self._lock:
+            return {"itens": len(self._itens), "bytes": self._bytes, "limite_bytes": self.limite_bytes}
+
+
+cache_pdfs = CachePdfs()
@@ -0,0 +1,139 @@
+"""
+Módulo: clientes_http.py
+
+Descrição:
+    Camada de clientes HTTP compartilhados para as chamadas ao SERPRO.
+
+    - Gateway (gateway.apiserpro.serpro.gov.br): uma `requests.Session` por contratante,
+      com pool de conexões keep-alive, reaproveitando as conexões TLS entre as emissões.
+      Pools separados evitam que as chamadas de um contratante ocupem as conexões dos demais.
+    - Autenticação (autenticacao.sapi.serpro.gov.br): uma sessão por certificado, com o
+      adaptador PKCS#12, de modo que cada PFX é lido e o contexto mTLS é montado uma única
+      vez por processo.
+
+Configuração (.env):
+    SERPRO_POOL_TAMANHO: conexões mantidas por host no pool (padrão: 10).
+"""
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from requests_pkcs12 import Pkcs12Adapter
+from decouple import config
+
+# ===========================================
+# CONFIGURAÇÃO DOS POOLS
+# ===========================================
+
+POOL_TAMANHO = config('SERPRO_POOL_TAMANHO', default=10, cast=int)
+
+_lock = threading.Lock()
+_sessoes_gateway = {}
+_sessoes_autenticacao = {}
+
+
+# ===========================================
+# SESSÕES COMPARTILHADAS
+# ===========================================
+
+def obter_sessao_gateway(contratante=None):
+    """
+    Retorna a sessão HTTP usada nas chamadas de um contratante ao gateway do SERPRO.
+
+    Parâmetros:
+        contratante (str): CNPJ do contratante; cada um tem o seu próprio pool de conexões.
+
+    Retorna:
+        requests.Session: Sessão com pool de conexões keep-alive.
+    """
+    sessao = _sessoes_gateway.get(contratante)
+
+    if sessao is None:
+        with _lock:
+            sessao = _sessoes_gateway.get(contratante)
+            if sessao is None:
+                sessao = requests.Session()
+                sessao.mount('https://', HTTPAdapter(pool_connections=2, pool_maxsize=POOL_TAMANHO))
+                # HTTP sem TLS só é usado com SERPRO_GATEWAY_URL apontando para um servidor local de testes
+                sessao.mount('http://', HTTPAdapter(pool_connections=2, pool_maxsize=POOL_TAMANHO))
+                _sessoes_gateway[contratante] = sessao
+
+    return sessao
+
+
+def obter_sessao_autenticacao(certificado, senha_certificado):
+    """
+    Retorna a sessão HTTP com autenticação mútua (mTLS) para o certificado informado.
+
+    O certificado é carregado apenas na primeira chamada; as seguintes reaproveitam
+    o mesmo contexto SSL e as conexões abertas.
+
+    Parâmetros:
+        certificado (str): Caminho do arquivo PFX.
+        senha_certificado (str): Senha do certificado.
+
+    Retorna:
+        requests.Session: Sessão com o adaptador PKCS#12 montado.
+    """
+    sessao = _sessoes_autenticacao.get(certificado)
+
+    if sessao is None:
+        with _lock:
+            sessao = _sessoes_autenticacao.get(certificado)
+            if sessao is None:
+                sessao = requests.Session()
+                sessao.mount('https://', Pkcs12Adapter(
+                    pkcs12_filename=certificado,
+                    pkcs12_password=senha_certificado,
+                    pool_connections=1,
+                    pool_maxsize=POOL_TAMANHO
+                ))
+                _sessoes_autenticacao[certificado] = sessao
+
+    return sessao
+
+
+# ===========================================
+# ESTATÍSTICAS DE CONEXÃO
+# ===========================================
+
+def _estatisticas_sessao(sessao):
+    """
+    Soma os contadores dos pools de conexão do urllib3 de uma sessão, agrupados por host.
+    """
+    estatisticas = {}
+    for adaptador in sessao.adapters.values():
+        gerenciador = getattr(adaptador, 'poolmanager', None)
+        if gerenciador is None:
+            continue
+
+        for chave in list(gerenciador.pools.keys()):
+            pool = gerenciador.pools.get(chave)
+            if pool is None:
+                continue
+
+            host = estatisticas.setdefault(pool.host, {"requisicoes": 0, "conexoes_novas": 0})
+            host["requisicoes"] += pool.num_requests
+            host["conexoes_novas"] += pool.num_connections
+
+    for host in estatisticas.values():
+        host["conexoes_reutilizadas"] = max(0, host["requisicoes"] - host["conexoes_novas"])
+
+    return estatisticas
+
+
+def estatisticas_conexoes():
+    """
+    Retorna os contadores de reaproveitamento de conexões dos clientes compartilhados.
+
+    Retorna:
+        dict: Por host, o total de requisições, de conexões novas e de conexões reutilizadas.
+    """
+    estatisticas = {}
+    sessoes = list(_sessoes_gateway.values()) + list(_sessoes_autenticacao.values())
+    for sessao in sessoes:
+        for host, contadores in _estatisticas_sessao(sessao).items():
+            total = estatisticas.setdefault(host, {"requisicoes": 0, "conexoes_novas": 0, "conexoes_reutilizadas": 0})
+            for nome, valor in contadores.items():
+                total[nome] += valor
+
+    return estatisticas
@@ -0,0 +1,126 @@
+"""
+Módulo: config.py
+
+Descrição:
+    Classes de configuração da aplicação Flask, escolhidas pela variável APP_AMBIENTE.
+
+    A chave secreta das sessões precisa ser a mesma em todos os processos (workers do
+    gunicorn, reinícios do servidor); caso contrário, o usuário perde o login sempre
+    que uma requisição cai em outro worker. Ela vem, nesta ordem:
+        1. da variável SECRET_KEY;
+        2. do arquivo SECRET_KEY_ARQUIVO (padrão: instance/secret_key), gerado na
+           primeira inicialização e reaproveitado pelos demais processos.
+
+Configuração (.env):
+    APP_AMBIENTE: desenvolvimento ou producao (padrão: producao).
+    SECRET_KEY: chave secreta das sessões.
+    SECRET_KEY_ARQUIVO: arquivo da chave secreta gerada automaticamente.
+    SESSION_COOKIE_SECURE: envia o cookie de sessão apenas por HTTPS (padrão: False).
+    SERPRO_INICIAR_SUPERVISOR: inicia o supervisor de lotes junto com o app (padrão: True).
+    SERPRO_AGENDADOR_ATIVO: executa o agendador de emissões mensais junto com o app (padrão: False).
+    SERPRO_METRICS_TOKEN: token exigido pelo coletor do Prometheus em /metrics.
+"""
+import os
+import secrets
+from decouple import config
+
+# ===========================================
+# CLASSES DE CONFIGURAÇÃO
+# ===========================================
+
+
+class Config:
+    """
+    Configuração comum a todos os ambientes.
+    """
+    SECRET_KEY = config('SECRET_KEY', default='')
+    SECRET_KEY_ARQUIVO = config('SECRET_KEY_ARQUIVO', default='')
+
+    SESSION_COOKIE_HTTPONLY = True
+    SESSION_COOKIE_SAMESITE = 'Lax'
+    SESSION_COOKIE_SECURE = config('SESSION_COOKIE_SECURE', default=False, cast=bool)
+
+    # Máximo de linhas rejeitadas devolvidas na resposta do envio em lote
+    LIMITE_REJEITADAS = 1000
+    # Máximo de IDs aceitos por download de guias selecionadas (/baixar_recibos_selecionados)
+    LIMITE_SELECAO_RECIBOS = 5000
+    # Token opcional exigido pelo coletor do Prometheus em /metrics (Authorization: Bearer <token>)
+    METRICS_TOKEN = config('SERPRO_METRICS_TOKEN', default='')
+
+    # Cria/atualiza as tabelas na inicialização
+    INICIALIZAR_BANCO = True
+    # Inicia a thread que retoma lotes interrompidos. No gunicorn com `preload_app`,
+    # o processo principal não a inicia: cada worker a inicia após o fork (gunicorn.conf.py).
+    INICIAR_SUPERVISOR = config('SERPRO_INICIAR_SUPERVISOR', default=True, cast=bool)
+    # Executa as rodadas do agendador de emissões mensais (agendador.py) em uma thread do app.
+    # No gunicorn, é iniciado em cada worker após o fork, como o supervisor.
+    INICIAR_AGENDADOR = config('SERPRO_AGENDADOR_ATIVO', default=False, cast=bool)
+
+
+class DesenvolvimentoConfig(Config):
+    DEBUG = True
+
+
+class ProducaoConfig(Config):
+    DEBUG = False
+
+
+CONFIGURACOES = {
+    'desenvolvimento': DesenvolvimentoConfig,
+    'producao': ProducaoConfig,
+}
+
+
+def obter_configuracao(nome=None):
+    """
+    Retorna a classe de configuração do ambiente.
+
+    Parâmetros:
+        nome (str): Nome do ambiente (padrão: variável APP_AMBIENTE).
+
+    Retorna:
+        type: Classe de configuração.
+
+    Exceções:
+        ValueError: Se o ambiente não existir.
+    """
+    nome = nome or config('APP_AMBIENTE', default='producao')
+    try:
+        return CONFIGURACOES[nome]
+    except KeyError:
+        raise ValueError(f"Ambiente desconhecido: {nome}. Use um de: {', '.join(CONFIGURACOES)}")
+
+
+# ===========================================
+# CHAVE SECRETA
+# ===========================================
+
+def carregar_chave_secreta(caminho):
+    """
+    Lê a chave secreta do arquivo, gerando-o se ainda não existir.
+
+    A chave é escrita em um arquivo temporário e publicada com `os.link`, que falha se o
+    destino já existir: quando vários workers iniciam ao mesmo tempo, apenas um grava e
+    todos leem a mesma chave, sempre completa.
+
+    Parâmetros:
+        caminho (str): Arquivo da chave.
+
+    Retorna:
+        str: Chave secreta.
+    """
+    if not os.path.exists(caminho):
+        os.makedirs(os.path.dirname(caminho) or '.', exist_ok=True)
+        temporario = f"{caminho}.{os.getpid()}.tmp"
+        descritor = os.open(temporario, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(descritor, 'w') as arquivo:
+            arquivo.write(secrets.token_hex(32))
+        try:
+            os.link(temporario, caminho)
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(temporario)
+
+    with open(caminho) as arquivo:
+        return arquivo.read().strip()
@@ -0,0 +1,376 @@
+"""
+Módulo: consultas.py
+
+Descrição:
+    Filtros compartilhados pelas telas e endpoints de consulta de requisições.
+    Os filtros de data usam intervalos (>= início e < fim) sobre `data_envio`,
+    para que o SQLite aproveite o índice (contribuinte, data_envio).
+
+    Os resumos do painel não carregam as requisições: os totais por status e por
+    parcela vêm da tabela `resumo_parcelas` (mantida por gatilhos no SQLite), e os
+    resumos de uma parcela são agregações sobre o índice (parcela, status, contribuinte).
+"""
+import datetime
+import re
+from sqlalchemy import func, select
+from models import Requisicao, Empresa, ResumoParcela, resumo_mantido
+from empresas import normalizar_documento, codigos_empresas
+
+# ===========================================
+# CONFIGURAÇÃO DA PAGINAÇÃO
+# ===========================================
+
+TAMANHO_PAGINA_PADRAO = 50
+TAMANHO_PAGINA_MAXIMO = 500
+
+# Colunas carregadas nas listagens; o PDF nunca é lido
+COLUNAS_LISTAGEM = (
+    Requisicao.id,
+    Requisicao.contribuinte,
+    Requisicao.data_envio,
+    Requisicao.status,
+    Requisicao.possui_pdf.label('possui_pdf'),
+)
+
+
+# ===========================================
+# INTERVALOS DE DATA
+# ===========================================
+
+def intervalo_mes(mes, ano=None):
+    """
+    Retorna o intervalo [início, fim) de um mês.
+
+    Parâmetros:
+        mes (int): Mês (1 a 12).
+        ano (int): Ano (padrão: ano corrente).
+
+    Retorna:
+        tuple: (inicio, fim) como `datetime.datetime`.
+
+    Exceções:
+        ValueError: Se o mês for inválido.
+    """
+    ano = ano or datetime.date.today().year
+    inicio = datetime.datetime(ano, mes, 1)
+    fim = datetime.datetime(ano + 1, 1, 1) if mes == 12 else datetime.datetime(ano, mes + 1, 1)
+    return inicio, fim
+
+
+# ===========================================
+# FILTROS DE REQUISIÇÕES
+# ===========================================
+
+def _mes_ano(valor):
+    """
+    Converte "AAAA-MM" (campo <input type="month">) ou "MM/AAAA" em (ano, mes).
+
+    Exceções:
+        ValueError: Se o valor não estiver em nenhum dos formatos.
+    """
+    correspondencia = re.fullmatch(r'(\d{4})-(\d{1,2})', valor) or re.fullmatch(r'(\d{1,2})/(\d{4})', valor)
+    if not correspondencia:
+        raise ValueError(f"Mês inválido: {valor}")
+    primeiro, segundo = correspondencia.groups()
+    return (int(primeiro), int(segundo)) if len(primeiro) == 4 else (int(segundo), int(primeiro))
+
+
+def filtrar_requisicoes(query, contribuinte=None, mes=None, ano=None, de=None, ate=None, status=None, ids=None):
+    """
+    Aplica à consulta os filtros de contribuinte, mês e ano de envio.
+
+    Parâmetros:
+        query: Consulta SQLAlchemy sobre `Requisicao`.
+        contribuinte (str): CPF/CNPJ do contribuinte, com ou sem máscara.
+        mes (str | int): Mês de envio (1 a 12). Valores inválidos são ignorados.
+        ano (str | int): Ano de envio. Sem mês, filtra o ano inteiro; com mês e sem ano,
+            usa o ano corrente.
+        de (str): Primeiro mês de envio do intervalo, "AAAA-MM" ou "MM/AAAA".
+        ate (str): Último mês de envio do intervalo (inclusive), "AAAA-MM" ou "MM/AAAA".
+        status (str): Status da requisição.
+        ids (list): IDs das requisições, filtrados com um único IN.
+
+    Retorna:
+        Consulta com os filtros aplicados.
+
+    Exceções:
+        ValueError: Se `de` ou `ate` não forem meses válidos.
+    """
+    if ids is not None:
+        query = query.filter(Requisicao.id.in_(ids))
+
+    if status:
+        query = query.filter(Requisicao.status == status)
+
+    if de:
+        ano_de, mes_de = _mes_ano(de)
+        query = query.filter(Requisicao.data_envio >= intervalo_mes(mes_de, ano_de)[0])
+    if ate:
+        ano_ate, mes_ate = _mes_ano(ate)
+        query = query.filter(Requisicao.data_envio < intervalo_mes(mes_ate, ano_ate)[1])
+
+    if contribuinte:
+        # Os documentos são gravados somente com dígitos; a máscara digitada é ignorada
+        query = query.filter(Requisicao.contribuinte == normalizar_documento(contribuinte))
+
+    try:
+        ano = int(ano) if ano else None
+    except ValueError:
+        ano = None
+
+    if mes:
+        try:
+            inicio, fim = intervalo_mes(int(mes), ano)
+            query = query.filter(Requisicao.data_envio >= inicio, Requisicao.data_envio < fim)
+        except ValueError:
+            pass
+    elif ano:
+        query = query.filter(
+            Requisicao.data_envio >= datetime.datetime(ano, 1, 1),
+            Requisicao.data_envio < datetime.datetime(ano + 1, 1, 1)
+        )
+
+    return query
+
+
+# ===========================================
+# LISTAGEM PAGINADA
+# ===========================================
+
+def _inteiro(valor, padrao=None):
+    try:
+        return int(valor) if valor not in (None, '') else padrao
+    except (TypeError, ValueError):
+        return padrao
+
+
+def listar_requisicoes(db, contribuinte=None, mes=None, ano=None, cursor=None, limite=None):
+    """
+    Lista requisições com paginação por cursor (keyset), das mais recentes para as mais antigas.
+
+    Apenas as colunas de listagem são selecionadas, sem montar objetos ORM, e o total
+    vem de um COUNT sobre os mesmos filtros.
+
+    Parâmetros:
+        db: Sessão do SQLAlchemy.
+        contribuinte, mes, ano: Filtros repassados a `filtrar_requisicoes`.
+        cursor (str | int): `proximo_cursor` da página anterior; vazio para a primeira página.
+        limite (str | int): Itens por página (padrão: TAMANHO_PAGINA_PADRAO, máximo: TAMANHO_PAGINA_MAXIMO).
+
+    Retorna:
+        dict: {"itens": [Row], "total": int, "proximo_cursor": int | None, "limite": int}
+    """
+    limite = min(max(_inteiro(limite, TAMANHO_PAGINA_PADRAO), 1), TAMANHO_PAGINA_MAXIMO)
+    cursor = _inteiro(cursor)
+
+    total = filtrar_requisicoes(
+        db.query(func.count(Requisicao.id)), contribuinte=contribuinte, mes=mes, ano=ano
+    ).scalar()
+
+    query = filtrar_requisicoes(db.query(*COLUNAS_LISTAGEM), contribuinte=contribuinte, mes=mes, ano=ano)
+    if cursor:
+        query = query.filter(Requisicao.id < cursor)
+
+    # Busca um item a mais para saber se existe próxima página
+    linhas = query.order_by(Requisicao.id.desc()).limit(limite + 1).all()
+    proximo_cursor = linhas[limite - 1].id if len(linhas) > limite else None
+
+    return {
+        "itens": linhas[:limite],
+        "total": total,
+        "proximo_cursor": proximo_cursor,
+        "limite": limite
+    }
+
+
+# ===========================================
+# RESUMOS DO PAINEL
+# ===========================================
+
+STATUS_CONCLUIDO = "Concluído"
+
+
+def parcela_atual():
+    """
+    Retorna a parcela do mês corrente (AAAAMM).
+    """
+    return datetime.date.today().strftime('%Y%m')
+
+
+def _agrupar_por_status(linhas):
+    """
+    Converte linhas (grupo, status, quantidade) em {grupo: {"total": n, status: n, ...}}, mantendo a ordem.
+    """
+    grupos = {}
+    for grupo, status, quantidade in linhas:
+        contagens = grupos.setdefault(grupo, {"total": 0})
+        contagens["total"] += quantidade
+        contagens[status] = contagens.get(status, 0) + quantidade
+    return grupos
+
+
+def resumo_por_status(db):
+    """
+    Conta as requisições por status.
+
+    Retorna:
+        dict: {status: quantidade}
+    """
+    if resumo_mantido():
+        linhas = (
+            db.query(ResumoParcela.status, func.sum(ResumoParcela.quantidade))
+            .filter(ResumoParcela.quantidade > 0)
+            .group_by(ResumoParcela.status)
+        )
+    else:
+        linhas = db.query(Requisicao.status, func.count()).group_by(Requisicao.status)
+    return {status: int(quantidade) for status, quantidade in linhas}
+
+
+def resumo_por_parcela(db, quantidade=12):
+    """
+    Conta as requisições por parcela e status, das parcelas mais recentes para as mais antigas.
+
+    Parâmetros:
+        db: Sessão do SQLAlchemy.
+        quantidade (int): Número de parcelas retornadas.
+
+    Retorna:
+        list: [{"parcela": "AAAAMM", "total": n, "<status>": n, ...}]
+    """
+    if resumo_mantido():
+        parcelas = (
+            db.query(ResumoParcela.parcela)
+            .filter(ResumoParcela.parcela != '', ResumoParcela.quantidade > 0)
+            .group_by(ResumoParcela.parcela)
+            .order_by(ResumoParcela.parcela.desc())
+            .limit(quantidade)
+            .subquery()
+        )
+        linhas = (
+            db.query(ResumoParcela.parcela, ResumoParcela.status, ResumoParcela.quantidade)
+            .filter(ResumoParcela.parcela.in_(db.query(parcelas.c.parcela)), ResumoParcela.quantidade > 0)
+            .order_by(ResumoParcela.parcela.desc())
+        )
+    else:
+        parcelas = (
+            db.query(Requisicao.parcela)
+            .filter(Requisicao.parcela.isnot(None))
+            .group_by(Requisicao.parcela)
+            .order_by(Requisicao.parcela.desc())
+            .limit(quantidade)
+            .subquery()
+        )
+        linhas = (
+            db.query(Requisicao.parcela, Requisicao.status, func.count())
+            .filter(Requisicao.parcela.in_(db.query(parcelas.c.parcela)))
+            .group_by(Requisicao.parcela, Requisicao.status)
+            .order_by(Requisicao.parcela.desc())
+        )
+    return [{"parcela": parcela, **contagens} for parcela, contagens in _agrupar_por_status(linhas).items()]
+
+
+def resumo_por_contribuinte(db, parcela, limite=None):
+    """
+    Conta as requisições de uma parcela por contribuinte e status.
+
+    Parâmetros:
+        db: Sessão do SQLAlchemy.
+        parcela (str): Parcela (AAAAMM).
+        limite (str | int): Contribuintes retornados (padrão: TAMANHO_PAGINA_PADRAO, máximo: TAMANHO_PAGINA_MAXIMO).
+
+    Retorna:
+        dict: {"itens": [{"contribuinte", "total", "<status>": n, ...}], "total": int, "limite": int}
+    """
+    limite = min(max(_inteiro(limite, TAMANHO_PAGINA_PADRAO), 1), TAMANHO_PAGINA_MAXIMO)
+
+    # Apenas os `limite` primeiros contribuintes são agrupados; o total vem de um COUNT DISTINCT
+    primeiros = (
+        db.query(Requisicao.contribuinte)
+        .filter(Requisicao.parcela == parcela)
+        .distinct()
+        .order_by(Requisicao.contribuinte)
+        .limit(limite)
+        .subquery()
+    )
+    linhas = (
+        db.query(Requisicao.contribuinte, Requisicao.status, func.count())
+        .filter(Requisicao.parcela == parcela, Requisicao.contribuinte.in_(select(primeiros.c.contribuinte)))
+        .group_by(Requisicao.contribuinte, Requisicao.status)
+        .order_by(Requisicao.contribuinte)
+    )
+    total = (
+        db.query(func.count(func.distinct(Requisicao.contribuinte)))
+        .filter(Requisicao.parcela == parcela)
+        .scalar()
+    )
+    return {
+        "itens": [{"contribuinte": contribuinte, **contagens}
+                  for contribuinte, contagens in _agrupar_por_status(linhas).items()],
+        "total": total,
+        "limite": limite
+    }
+
+
+def empresas_sem_guia(db, parcela, limite=None):
+    """
+    Lista as empresas cadastradas que ainda não têm guia emitida (status "Concluído") para a parcela.
+
+    Parâmetros:
+        db: Sessão do SQLAlchemy.
+        parcela (str): Parcela (AAAAMM).
+        limite (str | int): Empresas retornadas (padrão: TAMANHO_PAGINA_PADRAO, máximo: TAMANHO_PAGINA_MAXIMO).
+
+    Retorna:
+        dict: {"itens": [Row(cnpj, codigo, nome)], "total": int, "total_empresas": int, "limite": int}
+    """
+    limite = min(max(_inteiro(limite, TAMANHO_PAGINA_PADRAO), 1), TAMANHO_PAGINA_MAXIMO)
+    # NOT EXISTS resolvido pelo índice (parcela, status, contribuinte), uma busca por empresa
+    possui_guia = (
+        db.query(Requisicao.id)
+        .filter(
+            Requisicao.parcela == parcela,
+            Requisicao.contribuinte == Empresa.cnpj,
+            Requisicao.status == STATUS_CONCLUIDO
+        )
+        .exists()
+    )
+    query = db.query(Empresa.cnpj, Empresa.codigo, Empresa.nome).filter(~possui_guia)
+
+    return {
+        "itens": query.order_by(Empresa.codigo, Empresa.cnpj).limit(limite).all(),
+        "total": query.order_by(None).count(),
+        "total_empresas": db.query(func.count(Empresa.cnpj)).scalar(),
+        "limite": limite
+    }
+
+
+def resumo_painel(db, parcela=None, limite=None):
+    """
+    Reúne os resumos exibidos no painel.
+
+    Parâmetros:
+        db: Sessão do SQLAlchemy.
+        parcela (str): Parcela (AAAAMM ou AAAA/MM) dos resumos por contribuinte e das
+            empresas sem guia (padrão: mês corrente).
+        limite (str | int): Itens das listas por contribuinte e sem guia.
+
+    Retorna:
+        dict: {"parcela", "por_status", "por_parcela", "por_contribuinte", "sem_guia"}
+    """
+    parcela = re.sub(r'\D', '', parcela or '') or parcela_atual()
+    por_contribuinte = resumo_por_contribuinte(db, parcela, limite)
+    codigos = codigos_empresas(db, [item["contribuinte"] for item in por_contribuinte["itens"]])
+    for item in por_contribuinte["itens"]:
+        item["codigo"] = codigos.get(item["contribuinte"])
+    sem_guia = empresas_sem_guia(db, parcela, limite)
+
+    return {
+        "parcela": parcela,
+        "por_status": resumo_por_status(db),
+        "por_parcela": resumo_por_parcela(db),
+        "por_contribuinte": por_contribuinte,
+        "sem_guia": dict(sem_guia, itens=[
+            {"cnpj": cnpj, "codigo": codigo, "nome": nome} for cnpj, codigo, nome in sem_guia["itens"]
+        ])
+    }
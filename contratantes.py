@@ -0,0 +1,288 @@
+"""
+Módulo: contratantes.py
+
+Descrição:
+    Cadastro dos contratantes (escritórios) que emitem as guias no SERPRO, cada um com
+    o seu próprio certificado digital e credenciais do Integra Contador.
+
+    Cada contratante mantém, isolados dos demais:
+        - o cache do token de autenticação (`GerenciadorToken`);
+        - a sessão mTLS da autenticação e o pool de conexões do gateway;
+        - o limite de chamadas por segundo e o disjuntor do SERPRO.
+    Assim, o throttling (429) ou uma falha de autenticação de um contratante não
+    pausa as emissões dos demais.
+
+    A guia de cada empresa é emitida pelo contratante informado no cadastro de empresas
+    (coluna `contratante`); empresas sem contratante usam o contratante padrão.
+
+    Os contratantes são lidos de SERPRO_CONTRATANTES_ARQUIVO, um JSON no formato abaixo.
+    Valores "env:NOME" são lidos da variável de ambiente NOME, para que as senhas fiquem
+    fora do arquivo. Sem o arquivo, há um único contratante, configurado pelas variáveis
+    CAMINHO_CERTIFICADO, NOME_CERTIFICADO, SENHA_CERTIFICADO, CONSUMER_KEY e CONSUMER_SECRET.
+
+        [
+            {"cnpj": "00000000000191", "nome": "Matriz", "padrao": true,
+             "certificado": "/certificados/matriz.pfx", "senha_certificado": "env:MATRIZ_SENHA",
+             "consumer_key": "...", "consumer_secret": "env:MATRIZ_SECRET",
+             "autor_pedido": "00000000000191", "limite_por_segundo": 5},
+            ...
+        ]
+
+Configuração (.env):
+    SERPRO_CONTRATANTES_ARQUIVO: arquivo JSON com os contratantes.
+    SERPRO_CONTRATANTE_CNPJ: CNPJ do contratante, sem o arquivo (padrão: 00000000000000).
+    SERPRO_AUTOR_PEDIDO_CNPJ: CNPJ do autor do pedido, sem o arquivo (padrão: o do contratante).
+
+Observação:
+    O limite de cada contratante vale para o servidor inteiro: com vários workers, os
+    processos compartilham o limitador pelo banco (`compartilhar_limites`, chamado pelo
+    gunicorn.conf.py).
+"""
+import json
+import logging
+import threading
+from decouple import config
+from serpro_auth import GerenciadorToken, ArmazenamentoTokenArquivo, autenticar, ARQUIVO_TOKEN
+from clientes_http import obter_sessao_gateway
+from resiliencia import DisjuntorCircuito, disjuntor
+from lote import LimitadorTaxa, LimitadorTaxaCompartilhado, LIMITE_POR_SEGUNDO
+from empresas import normalizar_documento
+
+# ===========================================
+# CONFIGURAÇÃO
+# ===========================================
+
+ARQUIVO_CONTRATANTES = config('SERPRO_CONTRATANTES_ARQUIVO', default='')
+
+_registro = None
+_registro_lock = threading.Lock()
+
+# Se os limitadores são compartilhados entre os processos do servidor (ver `compartilhar_limites`)
+_limites_compartilhados = False
+
+
+# ===========================================
+# CONTRATANTE
+# ===========================================
+
+class Contratante:
+    """
+    Credenciais e recursos de um contratante: token, conexões, limite de taxa e disjuntor.
+    """
+
+    def __init__(self, cnpj, certificado, senha_certificado, consumer_key, consumer_secret, nome=None,
+                 autor_pedido=None, limite_por_segundo=None, arquivo_token=None, disjuntor_circuito=None):
+        """
+        Parâmetros:
+            cnpj (str): CNPJ do contratante, enviado em `contratante.numero`.
+            certificado (str): Caminho do certificado PFX.
+            senha_certificado (str): Senha do certificado.
+            consumer_key (str): Chave do consumidor na API.
+            consumer_secret (str): Segredo do consumidor na API.
+            nome (str): Nome exibido nas estatísticas (padrão: o CNPJ).
+            autor_pedido (str): CNPJ enviado em `autorPedidoDados.numero` (padrão: o do contratante).
+            limite_por_segundo (float): Teto de chamadas por segundo nos lotes (padrão: SERPRO_LIMITE_POR_SEGUNDO),
+                somando todos os processos do servidor.
+            arquivo_token (str): Arquivo para compartilhar o token entre processos (opcional).
+            disjuntor_circuito (DisjuntorCircuito): Disjuntor das chamadas (padrão: um novo).
+        """
+        self.cnpj = normalizar_documento(cnpj)
+        self.nome = nome or self.cnpj
+        self.autor_pedido = normalizar_documento(autor_pedido) or self.cnpj
+        self.certificado = certificado
+        self.senha_certificado = senha_certificado
+        self.consumer_key = consumer_key
+        self.consumer_secret = consumer_secret
+
+        self.limite_por_segundo = LIMITE_POR_SEGUNDO if limite_por_segundo is None else limite_por_segundo
+        self.limitador = self._criar_limitador()
+        self.disjuntor = disjuntor_circuito or DisjuntorCircuito()
+        self.token = GerenciadorToken(
+            self._autenticar,
+            armazenamento=ArmazenamentoTokenArquivo(arquivo_token) if arquivo_token else None
+        )
+
+    def _criar_limitador(self):
+        if _limites_compartilhados:
+            return LimitadorTaxaCompartilhado(self.cnpj, self.limite_por_segundo)
+        return LimitadorTaxa(self.limite_por_segundo)
+
+    def _autenticar(self):
+        if not self.certificado:
+            raise ValueError(f"Certificado do contratante {self.nome} não configurado")
+        return autenticar(self.certificado, self.senha_certificado, self.consumer_key, self.consumer_secret)
+
+    def sessao_gateway(self):
+        """
+        Retorna a sessão HTTP do contratante para o gateway do SERPRO.
+        """
+        return obter_sessao_gateway(self.cnpj)
+
+    def estatisticas(self):
+        return {
+            "nome": self.nome,
+            "limite_por_segundo": self.limitador.max_por_segundo,
+            "circuito": self.disjuntor.estatisticas()
+        }
+
+
+# ===========================================
+# REGISTRO DE CONTRATANTES
+# ===========================================
+
+class RegistroContratantes:
+    """
+    Contratantes configurados, por CNPJ.
+    """
+
+    def __init__(self, contratantes, padrao):
+        """
+        Parâmetros:
+            contratantes (list): Contratantes configurados.
+            padrao (Contratante): Contratante das empresas sem contratante no cadastro.
+        """
+        self.contratantes = {contratante.cnpj: contratante for contratante in contratantes}
+        self.padrao = padrao
+
+    def obter(self, contratante=None):
+        """
+        Retorna o contratante pelo CNPJ.
+
+        Parâmetros:
+            contratante (Contratante | str): Contratante ou CNPJ, com ou sem máscara (padrão: o padrão).
+
+        Retorna:
+            Contratante: Contratante configurado.
+
+        Exceções:
+            ValueError: Se o CNPJ não for de um contratante configurado.
+        """
+        if isinstance(contratante, Contratante):
+            return contratante
+        cnpj = normalizar_documento(contratante)
+        if not cnpj:
+            return self.padrao
+        try:
+            return self.contratantes[cnpj]
+        except KeyError:
+            raise ValueError(f"Contratante {cnpj} não configurado")
+
+
+def _valor(valor):
+    """
+    Resolve os valores "env:NOME" do arquivo de contratantes.
+    """
+    if isinstance(valor, str) and valor.startswith('env:'):
+        return config(valor[4:])
+    return valor
+
+
+def _registro_do_ambiente():
+    """
+    Contratante único configurado pelas variáveis de ambiente da autenticação.
+    """
+    caminho = config('CAMINHO_CERTIFICADO', default='')
+    nome_certificado = config('NOME_CERTIFICADO', default='')
+    contratante = Contratante(
+        config('SERPRO_CONTRATANTE_CNPJ', default='00000000000000'),
+        certificado=f"{caminho}/{nome_certificado}" if nome_certificado else '',
+        senha_certificado=config('SENHA_CERTIFICADO', default=''),
+        consumer_key=config('CONSUMER_KEY', default=''),
+        consumer_secret=config('CONSUMER_SECRET', default=''),
+        autor_pedido=config('SERPRO_AUTOR_PEDIDO_CNPJ', default=''),
+        arquivo_token=ARQUIVO_TOKEN,
+        disjuntor_circuito=disjuntor
+    )
+    return RegistroContratantes([contratante], contratante)
+
+
+def carregar_contratantes(caminho):
+    """
+    Lê os contratantes de um arquivo JSON.
+
+    O contratante padrão é o marcado com "padrao": true, ou o primeiro da lista. Ele usa o
+    disjuntor global e o arquivo SERPRO_TOKEN_ARQUIVO; os demais usam o arquivo com o CNPJ
+    como sufixo.
+
+    Parâmetros:
+        caminho (str): Arquivo JSON.
+
+    Retorna:
+        RegistroContratantes: Contratantes configurados.
+
+    Exceções:
+        ValueError: Se o arquivo não tiver contratantes ou repetir um CNPJ.
+    """
+    with open(caminho, encoding='utf8') as arquivo:
+        itens = json.load(arquivo)
+    if not itens:
+        raise ValueError(f"Nenhum contratante em {caminho}")
+
+    indice_padrao = next((indice for indice, item in enumerate(itens) if item.get('padrao')), 0)
+    contratantes = []
+    for indice, item in enumerate(itens):
+        padrao = indice == indice_padrao
+        cnpj = normalizar_documento(item['cnpj'])
+        arquivo_token = (ARQUIVO_TOKEN if padrao else f"{ARQUIVO_TOKEN}.{cnpj}") if ARQUIVO_TOKEN else None
+        contratantes.append(Contratante(
+            cnpj,
+            certificado=_valor(item['certificado']),
+            senha_certificado=_valor(item.get('senha_certificado', '')),
+            consumer_key=_valor(item.get('consumer_key', '')),
+            consumer_secret=_valor(item.get('consumer_secret', '')),
+            nome=item.get('nome'),
+            autor_pedido=item.get('autor_pedido'),
+            limite_por_segundo=item.get('limite_por_segundo'),
+            arquivo_token=arquivo_token,
+            disjuntor_circuito=disjuntor if padrao else None
+        ))
+
+    if len({contratante.cnpj for contratante in contratantes}) != len(contratantes):
+        raise ValueError(f"CNPJ de contratante repetido em {caminho}")
+
+    logging.info("%d contratantes carregados de %s.", len(contratantes), caminho)
+    return RegistroContratantes(contratantes, contratantes[indice_padrao])
+
+
+def registro_contratantes():
+    """
+    Retorna o registro de contratantes do processo, carregado na primeira chamada.
+    """
+    global _registro
+
+    if _registro is None:
+        with _registro_lock:
+            if _registro is None:
+                _registro = carregar_contratantes(ARQUIVO_CONTRATANTES) if ARQUIVO_CONTRATANTES \
+                    else _registro_do_ambiente()
+
+    return _registro
+
+
+def obter_contratante(contratante=None):
+    """
+    Retorna um contratante configurado (ver `RegistroContratantes.obter`).
+    """
+    return registro_contratantes().obter(contratante)
+
+
+def compartilhar_limites():
+    """
+    Passa os contratantes a usar limitadores de taxa compartilhados pelo banco, para que
+    a soma das chamadas ao SERPRO de todos os processos do servidor (workers do gunicorn)
+    respeite o limite configurado, qualquer que seja o processo que executa os lotes.
+    """
+    global _limites_compartilhados
+
+    with _registro_lock:
+        _limites_compartilhados = True
+        if _registro is not None:
+            for contratante in _registro.contratantes.values():
+                contratante.limitador = contratante._criar_limitador()
+
+
+def estatisticas_contratantes():
+    """
+    Retorna, por CNPJ, o limite de taxa e o estado do circuito de cada contratante.
+    """
+    return {cnpj: contratante.estatisticas() for cnpj, contratante in registro_contratantes().contratantes.items()}
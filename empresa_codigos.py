@@ -6,16 +6,16 @@ Descrição:
     Esses códigos são usados para nomear documentos gerados pela aplicação.
 
 Uso:
-    Este dicionário é acessado diretamente pelo código para associar
-    cada CNPJ ao código correspondente da empresa.
+    Carga inicial do cadastro de empresas (tabela `empresas`): `models.init_db()`
+    copia estes pares, com o CNPJ somente com dígitos, quando a tabela está vazia.
+    Depois disso, o cadastro é mantido pela importação de planilha em
+    `/empresas/importar` e consultado pelo módulo `empresas.py`.
 
 Exemplo:
     CNPJ_CODIGO_EMPRESA["00.000.000/0001-00"] -> "1234"
 
 Observação:
-    - Substitua os exemplos abaixo pelos valores reais em produção.
-    - Caso o número de empresas cresça, recomenda-se armazenar esses
-      dados em um banco de dados em vez de um dicionário fixo.
+    - Alterações neste dicionário não afetam um cadastro já populado.
 """
 
 # ===========================================
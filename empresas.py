@@ -0,0 +1,288 @@
+"""
+Módulo: empresas.py
+
+Descrição:
+    Cadastro das empresas clientes (tabela `empresas`), que associa o CNPJ ao código
+    usado para nomear as guias exportadas.
+
+    - Os CNPJs são sempre normalizados para somente dígitos, no cadastro e na busca,
+      de modo que "00.000.000/0001-00" e "00000000000100" resolvem o mesmo código.
+    - Os códigos ficam em um cache em memória do processo; uma exportação resolve os
+      códigos de todas as guias com uma única consulta (`IN`) para os CNPJs fora do cache.
+    - O cache é invalidado após cada importação e expira após um intervalo, para que
+      alterações feitas por outros processos também sejam vistas.
+    - A importação em massa lê uma planilha (.xlsx ou .csv) com as colunas CNPJ e
+      CODIGO (NOME e CONTRATANTE opcionais) e grava as empresas novas ou alteradas em blocos.
+    - O contratante da empresa define com qual certificado as suas guias são emitidas
+      (ver `contratantes.py`).
+
+Configuração (.env):
+    SERPRO_EMPRESAS_CACHE_VALIDADE: segundos até o cache de códigos expirar (padrão: 300).
+"""
+import re
+import threading
+import time
+import datetime
+import pandas as pd
+from decouple import config
+from sqlalchemy import insert, update
+from models import Empresa
+from ingestao import ler_blocos, normalizar_cnpjs
+
+# ===========================================
+# CONFIGURAÇÃO
+# ===========================================
+
+CACHE_VALIDADE = config('SERPRO_EMPRESAS_CACHE_VALIDADE', default=300.0, cast=float)
+
+# Código usado quando o CNPJ não está cadastrado
+CODIGO_PADRAO = "0000"
+
+COLUNAS_IMPORTACAO = ['CNPJ', 'CODIGO']
+
+# CNPJs por consulta `IN`, abaixo do limite de parâmetros do SQLite
+_TAMANHO_CONSULTA = 500
+
+
+def normalizar_documento(numero):
+    """
+    Remove a máscara de um CPF/CNPJ.
+
+    Parâmetros:
+        numero (str): Documento com ou sem pontuação.
+
+    Retorna:
+        str: Somente os dígitos do documento ('' se não informado).
+    """
+    return re.sub(r'\D', '', str(numero)) if numero is not None else ''
+
+
+# ===========================================
+# CACHE DE CÓDIGOS
+# ===========================================
+
+class CacheCodigos:
+    """
+    Cache em memória dos códigos por CNPJ, seguro para uso entre threads.
+
+    CNPJs não cadastrados também são guardados (com valor None), para que exportações
+    repetidas não consultem o banco novamente por eles.
+    """
+
+    def __init__(self, validade=CACHE_VALIDADE):
+        """
+        Parâmetros:
+            validade (float): Segundos até o conteúdo do cache ser descartado.
+        """
+        self.validade = validade
+        self._codigos = {}
+        self._expira_em = time.monotonic() + validade
+        self._lock = threading.Lock()
+
+    def obter(self, cnpjs):
+        """
+        Separa os CNPJs em conhecidos pelo cache e faltantes.
+
+        Retorna:
+            tuple: ({cnpj: codigo ou None}, lista de CNPJs fora do cache)
+        """
+        with self._lock:
+            if time.monotonic() >= self._expira_em:
+                self._limpar()
+            conhecidos = {cnpj: self._codigos[cnpj] for cnpj in cnpjs if cnpj in self._codigos}
+        return conhecidos, [cnpj for cnpj in cnpjs if cnpj not in conhecidos]
+
+    def guardar(self, codigos):
+        with self._lock:
+            self._codigos.update(codigos)
+
+    def invalidar(self):
+        """
+        Descarta todo o conteúdo do cache.
+        """
+        with self._lock:
+            self._limpar()
+
+    def _limpar(self):
+        self._codigos = {}
+        self._expira_em = time.monotonic() + self.validade
+
+
+cache_codigos = CacheCodigos()
+
+
+def invalidar_cache():
+    """
+    Descarta os códigos em cache; deve ser chamada após alterações no cadastro.
+    """
+    cache_codigos.invalidar()
+
+
+# ===========================================
+# RESOLUÇÃO DE CÓDIGOS
+# ===========================================
+
+def codigos_empresas(db, cnpjs):
+    """
+    Resolve os códigos de um conjunto de CNPJs, consultando o banco apenas pelos que
+    não estão no cache (uma consulta `IN` a cada 500 CNPJs).
+
+    Parâmetros:
+        db: Sessão SQLAlchemy.
+        cnpjs (iterable): CNPJs, com ou sem máscara.
+
+    Retorna:
+        dict: {cnpj somente com dígitos: código}, apenas para os CNPJs cadastrados.
+    """
+    normalizados = list(dict.fromkeys(normalizar_documento(cnpj) for cnpj in cnpjs))
+    conhecidos, faltando = cache_codigos.obter(normalizados)
+
+    for inicio in range(0, len(faltando), _TAMANHO_CONSULTA):
+        parte = faltando[inicio:inicio + _TAMANHO_CONSULTA]
+        encontrados = dict(db.query(Empresa.cnpj, Empresa.codigo).filter(Empresa.cnpj.in_(parte)))
+        resolvidos = {cnpj: encontrados.get(cnpj) for cnpj in parte}
+        cache_codigos.guardar(resolvidos)
+        conhecidos.update(resolvidos)
+
+    return {cnpj: codigo for cnpj, codigo in conhecidos.items() if codigo is not None}
+
+
+def contratantes_empresas(db, cnpjs):
+    """
+    Resolve o contratante de um conjunto de CNPJs (uma consulta `IN` a cada 500 CNPJs).
+
+    Parâmetros:
+        db: Sessão SQLAlchemy.
+        cnpjs (iterable): CNPJs, com ou sem máscara.
+
+    Retorna:
+        dict: {cnpj somente com dígitos: CNPJ do contratante}, apenas para as empresas com contratante.
+    """
+    normalizados = list(dict.fromkeys(normalizar_documento(cnpj) for cnpj in cnpjs))
+    contratantes = {}
+    for inicio in range(0, len(normalizados), _TAMANHO_CONSULTA):
+        parte = normalizados[inicio:inicio + _TAMANHO_CONSULTA]
+        contratantes.update(
+            db.query(Empresa.cnpj, Empresa.contratante)
+            .filter(Empresa.cnpj.in_(parte), Empresa.contratante.isnot(None))
+        )
+    return contratantes
+
+
+def codigo_empresa(db, cnpj, padrao=CODIGO_PADRAO):
+    """
+    Retorna o código da empresa de um CNPJ.
+
+    Parâmetros:
+        db: Sessão SQLAlchemy.
+        cnpj (str): CNPJ, com ou sem máscara.
+        padrao (str): Código retornado quando o CNPJ não está cadastrado.
+
+    Retorna:
+        str: Código da empresa.
+    """
+    return codigos_empresas(db, [cnpj]).get(normalizar_documento(cnpj), padrao)
+
+
+# ===========================================
+# IMPORTAÇÃO EM MASSA
+# ===========================================
+
+def _normalizar_codigo(coluna):
+    """
+    Converte os códigos para texto. Códigos lidos como número perdem o ".0" do Excel.
+    """
+    texto = coluna.astype(str).str.strip().str.replace(r'\.0$', '', regex=True)
+    return texto.where(coluna.notna(), '')
+
+
+def importar_empresas(db, arquivo, nome_arquivo, tamanho_bloco=1000):
+    """
+    Importa as empresas de uma planilha, incluindo as novas e atualizando as já cadastradas.
+
+    Parâmetros:
+        db: Sessão SQLAlchemy.
+        arquivo: Arquivo binário (ex.: `FileStorage` do Flask).
+        nome_arquivo (str): Nome do arquivo (.xlsx ou .csv).
+        tamanho_bloco (int): Linhas lidas e gravadas por bloco.
+
+    Retorna:
+        dict: {"incluidas": int, "atualizadas": int, "rejeitadas": [{"linha", "CNPJ", "mensagem"}]}
+
+    Exceções:
+        ErroPlanilha: Se o arquivo não puder ser lido ou faltar alguma coluna obrigatória.
+    """
+    resultado = {"incluidas": 0, "atualizadas": 0, "rejeitadas": []}
+    # A linha 1 da planilha é o cabeçalho
+    primeira_linha = 2
+
+    try:
+        for bloco in ler_blocos(arquivo, nome_arquivo, COLUNAS_IMPORTACAO, tamanho_bloco):
+            bloco = bloco.reset_index(drop=True)
+            cnpjs, validos = normalizar_cnpjs(bloco['CNPJ'])
+            codigos = _normalizar_codigo(bloco['CODIGO'])
+            nomes = bloco['NOME'] if 'NOME' in bloco else pd.Series(None, index=bloco.index)
+            # Sem a coluna CONTRATANTE, o contratante das empresas já cadastradas é mantido
+            contratantes = normalizar_cnpjs(bloco['CONTRATANTE'])[0] if 'CONTRATANTE' in bloco else None
+
+            empresas = {}
+            for posicao in range(len(bloco)):
+                if pd.isna(bloco['CNPJ'].iat[posicao]) and pd.isna(bloco['CODIGO'].iat[posicao]):
+                    continue
+                if not validos[posicao] or not codigos.iat[posicao]:
+                    resultado["rejeitadas"].append({
+                        "linha": primeira_linha + posicao,
+                        "CNPJ": None if pd.isna(bloco['CNPJ'].iat[posicao]) else str(bloco['CNPJ'].iat[posicao]),
+                        "mensagem": "CNPJ inválido" if not validos[posicao] else "CODIGO não informado"
+                    })
+                    continue
+                nome = nomes.iat[posicao]
+                # Um CNPJ repetido na planilha fica com a última ocorrência
+                empresas[cnpjs.iat[posicao]] = {
+                    'cnpj': cnpjs.iat[posicao],
+                    'codigo': codigos.iat[posicao],
+                    'nome': None if pd.isna(nome) else str(nome).strip() or None
+                }
+                if contratantes is not None:
+                    empresas[cnpjs.iat[posicao]]['contratante'] = contratantes.iat[posicao] or None
+            primeira_linha += len(bloco)
+
+            if empresas:
+                incluidas, atualizadas = _gravar_empresas(db, empresas)
+                resultado["incluidas"] += incluidas
+                resultado["atualizadas"] += atualizadas
+
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        invalidar_cache()
+
+    return resultado
+
+
+def _gravar_empresas(db, empresas):
+    """
+    Grava um bloco de empresas: inclusões com um INSERT em massa e alterações com um UPDATE em massa.
+
+    Retorna:
+        tuple: (incluídas, atualizadas)
+    """
+    cnpjs = list(empresas)
+    existentes = set()
+    for inicio in range(0, len(cnpjs), _TAMANHO_CONSULTA):
+        parte = cnpjs[inicio:inicio + _TAMANHO_CONSULTA]
+        existentes.update(cnpj for (cnpj,) in db.query(Empresa.cnpj).filter(Empresa.cnpj.in_(parte)))
+    agora = datetime.datetime.now(datetime.timezone.utc)
+
+    novas = [dict(valores, data_atualizacao=agora) for cnpj, valores in empresas.items() if cnpj not in existentes]
+    alteradas = [dict(valores, data_atualizacao=agora) for cnpj, valores in empresas.items() if cnpj in existentes]
+
+    if novas:
+        db.execute(insert(Empresa), novas)
+    if alteradas:
+        # UPDATE em massa pela chave primária (executemany)
+        db.execute(update(Empresa), alteradas)
+
+    return len(novas), len(alteradas)
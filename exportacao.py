@@ -0,0 +1,315 @@
+"""
+Módulo: exportacao.py
+
+Descrição:
+    Geração de arquivos ZIP em streaming para o download em lote das guias.
+    Cada entrada é escrita e enviada ao cliente assim que fica pronta, de modo que
+    o uso de memória não depende do tamanho total do arquivo.
+
+    - Nível 0 (padrão): as guias são gravadas sem compressão (ZIP_STORED). Os PDFs
+      já são comprimidos internamente, então o DEFLATE gasta CPU quase sem reduzir
+      o tamanho; resta apenas o CRC-32 de cada arquivo.
+    - Níveis 1 a 9: as entradas são comprimidas (DEFLATE) em um pool de threads, que
+      usa todos os núcleos (o zlib libera o GIL durante a compressão), e escritas no
+      ZIP na ordem original. Entradas que não diminuem são gravadas sem compressão.
+
+    O ZIP é montado por `_EscritorZip`, pois o `zipfile` não aceita dados já
+    comprimidos; arquivos com mais de 4 GB ou 65535 entradas usam as extensões ZIP64.
+
+Configuração (.env):
+    SERPRO_EXPORTACAO_NIVEL: nível de compressão padrão, de 0 (sem compressão) a 9 (padrão: 0).
+    SERPRO_EXPORTACAO_WORKERS: threads de compressão (padrão: número de núcleos).
+"""
+import logging
+import os
+import struct
+import threading
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from decouple import config
+from metricas import EXPORTACAO_BYTES, EXPORTACAO_ARQUIVOS, EXPORTACAO_BYTES_POR_SEGUNDO
+
+# ===========================================
+# CONFIGURAÇÃO
+# ===========================================
+
+NIVEL_PADRAO = config('SERPRO_EXPORTACAO_NIVEL', default=0, cast=int)
+WORKERS = config('SERPRO_EXPORTACAO_WORKERS', default=os.cpu_count() or 1, cast=int)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _obter_pool():
+    """
+    Retorna o pool de compressão compartilhado pelas exportações do processo.
+    """
+    global _pool
+
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix='exportacao')
+    return _pool
+
+
+def nivel_compressao(valor, padrao=NIVEL_PADRAO):
+    """
+    Converte o nível de compressão informado pelo usuário.
+
+    Parâmetros:
+        valor (str | int): Nível de 0 a 9; vazio ou inválido usa o padrão.
+        padrao (int): Nível padrão.
+
+    Retorna:
+        int: Nível entre 0 e 9.
+    """
+    try:
+        nivel = int(valor) if valor not in (None, '') else padrao
+    except (TypeError, ValueError):
+        nivel = padrao
+    return min(max(nivel, 0), 9)
+
+
+# ===========================================
+# NOMES DAS ENTRADAS
+# ===========================================
+
+class NomesUnicos:
+    """
+    Garante nomes distintos para as entradas de um ZIP.
+
+    Um nome repetido recebe um sufixo numérico antes da extensão: "0000-PARC SN-012024.pdf",
+    "0000-PARC SN-012024 (2).pdf", ...
+    """
+
+    def __init__(self):
+        self._usados = set()
+        self._proximo = {}
+
+    def __call__(self, nome):
+        """
+        Retorna `nome`, ou uma variação com sufixo se ele já foi usado.
+        """
+        if nome not in self._usados:
+            self._usados.add(nome)
+            return nome
+
+        raiz, extensao = os.path.splitext(nome)
+        numero = self._proximo.get(nome, 2)
+        while f"{raiz} ({numero}){extensao}" in self._usados:
+            numero += 1
+        self._proximo[nome] = numero + 1
+
+        unico = f"{raiz} ({numero}){extensao}"
+        self._usados.add(unico)
+        return unico
+
+
+# ===========================================
+# ESCRITA DO ZIP
+# ===========================================
+
+ZIP_STORED = 0
+ZIP_DEFLATED = 8
+
+_CABECALHO_LOCAL = struct.Struct('<IHHHHHIIIHH')
+_CABECALHO_CENTRAL = struct.Struct('<IHHHHHHIIIHHHHHII')
+_FIM_DIRETORIO = struct.Struct('<IHHHHIIH')
+_FIM_DIRETORIO_ZIP64 = struct.Struct('<IQHHIIQQQQ')
+_LOCALIZADOR_ZIP64 = struct.Struct('<IIQI')
+_EXTRA_ZIP64 = struct.Struct('<HHQ')
+
+# Acima destes valores, os campos de 16/32 bits do ZIP recebem o marcador e o valor vai para o ZIP64
+_LIMITE_ENTRADAS = 0xFFFF
+_LIMITE_BYTES = 0xFFFFFFFF
+_MARCADOR_16 = 0xFFFF
+_MARCADOR_32 = 0xFFFFFFFF
+
+_VERSAO = 20
+_VERSAO_ZIP64 = 45
+_FLAG_UTF8 = 0x800
+
+
+def _data_hora_dos(instante):
+    """
+    Converte um `time.struct_time` para os campos de hora e data do formato MS-DOS.
+    """
+    ano = max(instante.tm_year, 1980)
+    hora = (instante.tm_hour << 11) | (instante.tm_min << 5) | (instante.tm_sec // 2)
+    data = ((ano - 1980) << 9) | (instante.tm_mon << 5) | instante.tm_mday
+    return hora, data
+
+
+class _EscritorZip:
+    """
+    Monta um ZIP sequencialmente a partir de entradas já comprimidas (com CRC e tamanhos conhecidos).
+
+    Como os tamanhos são conhecidos antes da escrita, cada entrada é emitida por inteiro
+    (cabeçalho local + dados) e só o diretório central fica para o final.
+    """
+
+    def __init__(self, instante=None):
+        self._hora, self._data = _data_hora_dos(instante or time.localtime())
+        self._posicao = 0
+        self._central = []
+        self.entradas = 0
+
+    def entrada(self, nome, dados, crc, tamanho, metodo):
+        """
+        Retorna os bytes de uma entrada (cabeçalho local + dados).
+
+        Parâmetros:
+            nome (str): Nome do arquivo dentro do ZIP.
+            dados (bytes): Conteúdo, já comprimido conforme `metodo`.
+            crc (int): CRC-32 do conteúdo original.
+            tamanho (int): Tamanho do conteúdo original.
+            metodo (int): ZIP_STORED ou ZIP_DEFLATED.
+        """
+        # O cabeçalho local guarda os tamanhos em 32 bits; guias nunca chegam perto disso
+        if max(tamanho, len(dados)) >= _MARCADOR_32:
+            raise ValueError(f"Arquivo grande demais para o ZIP: {nome}")
+
+        try:
+            nome_bytes, flags = nome.encode('ascii'), 0
+        except UnicodeEncodeError:
+            nome_bytes, flags = nome.encode('utf-8'), _FLAG_UTF8
+
+        cabecalho = _CABECALHO_LOCAL.pack(
+            0x04034b50, _VERSAO, flags, metodo, self._hora, self._data,
+            crc, len(dados), tamanho, len(nome_bytes), 0
+        )
+
+        extra = b''
+        deslocamento = self._posicao
+        versao = _VERSAO
+        if deslocamento >= _LIMITE_BYTES:
+            extra = _EXTRA_ZIP64.pack(0x0001, 8, deslocamento)
+            deslocamento = _MARCADOR_32
+            versao = _VERSAO_ZIP64
+        self._central.append(_CABECALHO_CENTRAL.pack(
+            0x02014b50, versao, versao, flags, metodo, self._hora, self._data,
+            crc, len(dados), tamanho, len(nome_bytes), len(extra), 0, 0, 0, 0, deslocamento
+        ) + nome_bytes + extra)
+
+        self._posicao += len(cabecalho) + len(nome_bytes) + len(dados)
+        self.entradas += 1
+        return cabecalho + nome_bytes + dados
+
+    def finalizar(self):
+        """
+        Retorna o diretório central e os registros de fim de arquivo.
+        """
+        central = b''.join(self._central)
+        inicio_central = self._posicao
+        partes = [central]
+
+        if (self.entradas >= _LIMITE_ENTRADAS or len(central) >= _LIMITE_BYTES
+                or inicio_central >= _LIMITE_BYTES):
+            fim_zip64 = self._posicao + len(central)
+            partes.append(_FIM_DIRETORIO_ZIP64.pack(
+                0x06064b50, _FIM_DIRETORIO_ZIP64.size - 12, _VERSAO_ZIP64, _VERSAO_ZIP64, 0, 0,
+                self.entradas, self.entradas, len(central), inicio_central
+            ))
+            partes.append(_LOCALIZADOR_ZIP64.pack(0x07064b50, 0, fim_zip64, 1))
+            partes.append(_FIM_DIRETORIO.pack(
+                0x06054b50, 0, 0, _MARCADOR_16, _MARCADOR_16, _MARCADOR_32, _MARCADOR_32, 0
+            ))
+        else:
+            partes.append(_FIM_DIRETORIO.pack(
+                0x06054b50, 0, 0, self.entradas, self.entradas, len(central), inicio_central, 0
+            ))
+
+        dados = b''.join(partes)
+        self._posicao += len(dados)
+        return dados
+
+
+# ===========================================
+# COMPRESSÃO
+# ===========================================
+
+def _preparar_entrada(dados, nivel):
+    """
+    Calcula o CRC-32 e, com nível maior que 0, comprime os dados (DEFLATE bruto).
+
+    Retorna:
+        tuple: (dados gravados, crc, tamanho original, método)
+    """
+    crc = zlib.crc32(dados)
+    if nivel > 0:
+        compressor = zlib.compressobj(nivel, zlib.DEFLATED, -zlib.MAX_WBITS)
+        comprimido = compressor.compress(dados) + compressor.flush()
+        # PDFs já comprimidos podem crescer; nesse caso a entrada é gravada sem compressão
+        if len(comprimido) < len(dados):
+            return comprimido, crc, len(dados), ZIP_DEFLATED
+    return dados, crc, len(dados), ZIP_STORED
+
+
+def _entradas_preparadas(entradas, nivel, workers):
+    """
+    Gera (nome, dados, crc, tamanho, método) na ordem das entradas.
+
+    Com compressão, até `2 * workers` entradas ficam em processamento no pool enquanto
+    a seguinte é lida, o que limita a memória e mantém todos os núcleos ocupados.
+    """
+    if nivel == 0 or workers <= 1:
+        for nome, dados in entradas:
+            yield (nome, *_preparar_entrada(dados, nivel))
+        return
+
+    pool = _obter_pool()
+    pendentes = deque()
+    for nome, dados in entradas:
+        pendentes.append((nome, pool.submit(_preparar_entrada, dados, nivel)))
+        if len(pendentes) >= 2 * workers:
+            nome_pronto, futuro = pendentes.popleft()
+            yield (nome_pronto, *futuro.result())
+    while pendentes:
+        nome_pronto, futuro = pendentes.popleft()
+        yield (nome_pronto, *futuro.result())
+
+
+# ===========================================
+# GERAÇÃO DO ZIP
+# ===========================================
+
+def gerar_zip_streaming(entradas, nivel=None, workers=None):
+    """
+    Gera um arquivo ZIP em partes, à medida que as entradas são consumidas.
+
+    Parâmetros:
+        entradas (iterable): Pares (nome_arquivo, dados_bytes).
+        nivel (int): Nível de compressão, de 0 (ZIP_STORED) a 9 (padrão: SERPRO_EXPORTACAO_NIVEL).
+        workers (int): Threads de compressão (padrão: SERPRO_EXPORTACAO_WORKERS).
+
+    Retorna:
+        generator: Blocos de bytes do arquivo ZIP, prontos para uma resposta em streaming.
+    """
+    nivel = nivel_compressao(nivel)
+    workers = WORKERS if workers is None else workers
+    escritor = _EscritorZip()
+    inicio = time.perf_counter()
+    total_bytes = 0
+    bytes_originais = 0
+
+    for nome, dados, crc, tamanho, metodo in _entradas_preparadas(entradas, nivel, workers):
+        parte = escritor.entrada(nome, dados, crc, tamanho, metodo)
+        total_bytes += len(parte)
+        bytes_originais += tamanho
+        yield parte
+
+    # Diretório central, escrito ao final
+    parte = escritor.finalizar()
+    total_bytes += len(parte)
+
+    duracao = time.perf_counter() - inicio
+    vazao = total_bytes / duracao if duracao > 0 else 0.0
+    EXPORTACAO_BYTES.observar(total_bytes)
+    EXPORTACAO_ARQUIVOS.inc(escritor.entradas)
+    EXPORTACAO_BYTES_POR_SEGUNDO.definir(vazao)
+    logging.info("Exportação ZIP: %d arquivos, %.1f MB (%.1f MB originais, nível %d) em %.2fs, %.1f MB/s.",
+                 escritor.entradas, total_bytes / 1e6, bytes_originais / 1e6, nivel, duracao, vazao / 1e6)
+    yield parte
@@ -0,0 +1,53 @@
+"""
+Configuração do gunicorn: gunicorn -c gunicorn.conf.py wsgi:app
+
+Workers com threads (gthread): as chamadas ao SERPRO passam a maior parte do tempo
+aguardando a rede, então cada worker atende várias requisições ao mesmo tempo, e os
+workers distribuem o processamento entre os núcleos.
+
+Com `preload_app`, o app é criado uma única vez no processo principal (o banco é
+preparado antes do fork), sem as threads de segundo plano (wsgi.py); cada worker
+descarta as conexões herdadas e inicia o seu próprio supervisor de lotes e, se ativo,
+o agendador. Os lotes órfãos são reivindicados pelo heartbeat, então vários
+supervisores podem rodar ao mesmo tempo.
+
+Observação:
+    O limite de chamadas por segundo ao SERPRO (SERPRO_LIMITE_POR_SEGUNDO, ou o de cada
+    contratante) é compartilhado entre os workers pelo banco (tabela `limites_taxa`): a
+    soma respeita o configurado, e o worker que executa um lote pode usar o limite inteiro.
+    O cache de tokens continua por processo.
+
+Configuração (.env):
+    GUNICORN_BIND: endereço de escuta (padrão: 0.0.0.0:8000).
+    GUNICORN_WORKERS: processos (padrão: número de núcleos).
+    GUNICORN_THREADS: threads por processo (padrão: 8).
+    GUNICORN_TIMEOUT: segundos sem resposta do worker até reiniciá-lo (padrão: 120).
+"""
+import multiprocessing
+# `config` é o nome de uma opção do gunicorn; o leitor do .env é importado com outro nome
+from decouple import config as ler_env
+
+bind = ler_env('GUNICORN_BIND', default='0.0.0.0:8000')
+workers = ler_env('GUNICORN_WORKERS', default=multiprocessing.cpu_count(), cast=int)
+threads = ler_env('GUNICORN_THREADS', default=8, cast=int)
+worker_class = 'gthread'
+timeout = ler_env('GUNICORN_TIMEOUT', default=120, cast=int)
+graceful_timeout = 30
+keepalive = 5
+preload_app = True
+
+accesslog = '-'
+errorlog = '-'
+
+
+def post_fork(server, worker):
+    from models import engine
+    from contratantes import compartilhar_limites
+    from app import iniciar_segundo_plano
+
+    # Conexões abertas antes do fork não podem ser compartilhadas entre processos
+    engine.dispose(close=False)
+    if server.cfg.workers > 1:
+        compartilhar_limites()
+    # O app carregado pelo processo principal (preload_app)
+    iniciar_segundo_plano(server.app.wsgi())
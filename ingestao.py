@@ -0,0 +1,288 @@
+"""
+Módulo: ingestao.py
+
+Descrição:
+    Leitura e validação das planilhas do envio em lote.
+
+    A planilha é lida em streaming (openpyxl em modo `read_only` para .xlsx,
+    `pandas.read_csv` com `chunksize` para .csv) e validada em blocos, com
+    operações vetorizadas do pandas/numpy:
+        - CNPJ: remoção de caracteres não numéricos e validação dos dígitos verificadores;
+        - ID_SISTEMA / ID_SERVICO: obrigatórios, normalizados em maiúsculas;
+        - DATA_ENVIO: conversão para a parcela no formato AAAAMM.
+
+    As linhas válidas são entregues por um gerador, de modo que o uso de memória
+    não depende do tamanho da planilha; as inválidas são registradas com o número
+    da linha na planilha.
+
+Configuração (.env):
+    SERPRO_INGESTAO_BLOCO: linhas validadas por bloco (padrão: 5000).
+"""
+import itertools
+import numpy as np
+import pandas as pd
+from openpyxl import load_workbook
+from decouple import config
+
+# ===========================================
+# CONFIGURAÇÃO
+# ===========================================
+
+TAMANHO_BLOCO = config('SERPRO_INGESTAO_BLOCO', default=5000, cast=int)
+COLUNAS_OBRIGATORIAS = ['CNPJ', 'ID_SISTEMA', 'ID_SERVICO', 'DATA_ENVIO']
+
+# Pesos dos dígitos verificadores do CNPJ
+_PESOS_DV1 = np.array([5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2])
+_PESOS_DV2 = np.array([6, 5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2])
+
+
+class ErroPlanilha(ValueError):
+    """
+    Erro que impede a leitura da planilha inteira (formato inválido, colunas faltando).
+    """
+
+
+# ===========================================
+# LEITURA EM BLOCOS
+# ===========================================
+
+def _blocos_xlsx(arquivo, tamanho_bloco, colunas):
+    """
+    Lê a primeira aba do .xlsx em modo somente leitura, devolvendo DataFrames de `tamanho_bloco` linhas.
+    """
+    try:
+        workbook = load_workbook(arquivo, read_only=True, data_only=True)
+    except Exception as e:
+        raise ErroPlanilha(f"Erro ao ler o arquivo Excel: {str(e)}")
+
+    try:
+        linhas = workbook.active.iter_rows(values_only=True)
+        cabecalho = [str(coluna).strip() if coluna is not None else '' for coluna in next(linhas, ())]
+        _verificar_colunas(cabecalho, colunas)
+
+        while True:
+            bloco = list(itertools.islice(linhas, tamanho_bloco))
+            if not bloco:
+                break
+            yield pd.DataFrame(bloco, columns=cabecalho, dtype=object)
+    finally:
+        workbook.close()
+
+
+def _blocos_csv(arquivo, tamanho_bloco, colunas):
+    """
+    Lê o .csv em blocos de `tamanho_bloco` linhas, detectando o separador (vírgula ou ponto e vírgula).
+    """
+    try:
+        leitor = pd.read_csv(arquivo, sep=None, engine='python', dtype=str, chunksize=tamanho_bloco,
+                             encoding='utf-8-sig')
+        for indice, bloco in enumerate(leitor):
+            bloco.columns = [str(coluna).strip() for coluna in bloco.columns]
+            if indice == 0:
+                _verificar_colunas(bloco.columns, colunas)
+            yield bloco
+    except ErroPlanilha:
+        raise
+    except Exception as e:
+        raise ErroPlanilha(f"Erro ao ler o arquivo CSV: {str(e)}")
+
+
+def _verificar_colunas(colunas, obrigatorias):
+    faltando = [coluna for coluna in obrigatorias if coluna not in set(colunas)]
+    if faltando:
+        raise ErroPlanilha(
+            f"Arquivo inválido. Colunas faltando: {', '.join(faltando)}. "
+            f"Colunas encontradas: {', '.join(map(str, colunas))}"
+        )
+
+
+def ler_blocos(arquivo, nome_arquivo, colunas=COLUNAS_OBRIGATORIAS, tamanho_bloco=TAMANHO_BLOCO):
+    """
+    Lê uma planilha .xlsx ou .csv em blocos, verificando as colunas obrigatórias.
+
+    Parâmetros:
+        arquivo: Arquivo binário (ex.: `FileStorage` do Flask).
+        nome_arquivo (str): Nome do arquivo, usado para identificar o formato.
+        colunas (list): Colunas que a planilha deve conter.
+        tamanho_bloco (int): Linhas por bloco.
+
+    Retorna:
+        generator: DataFrames com até `tamanho_bloco` linhas (valores como texto ou objeto).
+
+    Exceções:
+        ErroPlanilha: Se o formato não for suportado, o arquivo não puder ser lido ou
+            faltar alguma coluna.
+    """
+    nome = (nome_arquivo or '').lower()
+    if nome.endswith('.csv'):
+        return _blocos_csv(arquivo, tamanho_bloco, colunas)
+    if nome.endswith(('.xlsx', '.xlsm')):
+        return _blocos_xlsx(arquivo, tamanho_bloco, colunas)
+    raise ErroPlanilha("Formato de arquivo não suportado. Envie uma planilha .xlsx ou .csv.")
+
+
+# ===========================================
+# VALIDAÇÃO VETORIZADA
+# ===========================================
+
+def _normalizar_cnpj(coluna):
+    """
+    Remove caracteres não numéricos. CNPJs lidos como número (sem zeros à esquerda) são completados.
+    """
+    texto = coluna.astype(str).str.strip().str.replace(r'\.0$', '', regex=True)
+    digitos = texto.str.replace(r'\D', '', regex=True)
+    return digitos.where(~coluna.isna(), '').str.zfill(14).where(digitos.str.len() > 0, '')
+
+
+def _cnpj_valido(digitos):
+    """
+    Valida os dígitos verificadores de uma série de CNPJs (somente dígitos) de forma vetorizada.
+    """
+    valido = (digitos.str.len() == 14).to_numpy()
+    if not valido.any():
+        return valido
+
+    candidatos = digitos[valido]
+    matriz = np.frombuffer(''.join(candidatos).encode('ascii'), dtype=np.uint8).reshape(-1, 14) - ord('0')
+
+    resto1 = (matriz[:, :12] * _PESOS_DV1).sum(axis=1) % 11
+    dv1 = np.where(resto1 < 2, 0, 11 - resto1)
+    resto2 = (matriz[:, :13] * _PESOS_DV2).sum(axis=1) % 11
+    dv2 = np.where(resto2 < 2, 0, 11 - resto2)
+
+    repetidos = (matriz == matriz[:, :1]).all(axis=1)
+    valido[valido] = (matriz[:, 12] == dv1) & (matriz[:, 13] == dv2) & ~repetidos
+    return valido
+
+
+def normalizar_cnpjs(coluna):
+    """
+    Normaliza uma coluna de CNPJs e valida os dígitos verificadores.
+
+    Parâmetros:
+        coluna (Series): CNPJs como lidos da planilha (com ou sem máscara).
+
+    Retorna:
+        tuple: (Series com os CNPJs somente com dígitos, array booleano dos válidos)
+    """
+    digitos = _normalizar_cnpj(coluna)
+    return digitos, _cnpj_valido(digitos)
+
+
+def _normalizar_parcela(coluna):
+    """
+    Converte DATA_ENVIO para AAAAMM. Aceita datas do Excel e os textos AAAAMM, AAAA/MM, AAAA-MM,
+    MM/AAAA e DD/MM/AAAA. Valores não reconhecidos resultam em texto vazio.
+    """
+    texto = coluna.map(lambda valor: valor.strftime('%Y-%m-%d') if hasattr(valor, 'strftime') else valor)
+    texto = texto.astype(str).str.strip()
+
+    parcela = pd.Series('', index=coluna.index)
+    formatos = [
+        (r'^(?P<ano>\d{4})[/-]?(?P<mes>\d{2})(?:[/-]\d{2})?(?:[ T].*)?$'),  # AAAAMM, AAAA/MM, AAAA-MM-DD
+        (r'^(?:\d{2}/)?(?P<mes>\d{2})/(?P<ano>\d{4})$'),  # MM/AAAA, DD/MM/AAAA
+    ]
+    for formato in formatos:
+        partes = texto.str.extract(formato)
+        encontrado = partes['ano'].notna() & (parcela == '')
+        parcela = parcela.mask(encontrado, partes['ano'] + partes['mes'])
+
+    mes = pd.to_numeric(parcela.str[4:], errors='coerce')
+    return parcela.where(mes.between(1, 12), '')
+
+
+def validar_bloco(bloco, primeira_linha):
+    """
+    Valida e normaliza um bloco da planilha.
+
+    Parâmetros:
+        bloco (DataFrame): Linhas com as colunas obrigatórias.
+        primeira_linha (int): Número, na planilha, da primeira linha do bloco.
+
+    Retorna:
+        tuple: (DataFrame das linhas válidas com CNPJ, ID_SISTEMA, ID_SERVICO, PARCELA e LINHA,
+                lista de erros {"linha", "CNPJ", "mensagem"})
+    """
+    bloco = bloco.reset_index(drop=True)
+    normalizado = pd.DataFrame({
+        'LINHA': np.arange(primeira_linha, primeira_linha + len(bloco)),
+        'CNPJ': _normalizar_cnpj(bloco['CNPJ']),
+        'ID_SISTEMA': bloco['ID_SISTEMA'].fillna('').astype(str).str.strip().str.upper(),
+        'ID_SERVICO': bloco['ID_SERVICO'].fillna('').astype(str).str.strip().str.upper(),
+        'PARCELA': _normalizar_parcela(bloco['DATA_ENVIO']),
+    })
+
+    # Linhas totalmente vazias no fim da planilha são ignoradas
+    vazia = bloco[COLUNAS_OBRIGATORIAS].isna().all(axis=1).to_numpy()
+
+    problemas = [
+        (~_cnpj_valido(normalizado['CNPJ']), "CNPJ inválido"),
+        ((normalizado['ID_SISTEMA'] == '').to_numpy(), "ID_SISTEMA não informado"),
+        ((normalizado['ID_SERVICO'] == '').to_numpy(), "ID_SERVICO não informado"),
+        ((normalizado['PARCELA'] == '').to_numpy(), "DATA_ENVIO em formato inválido"),
+    ]
+    invalida = np.zeros(len(bloco), dtype=bool)
+    for mascara, _ in problemas:
+        invalida |= mascara
+    invalida &= ~vazia
+
+    erros = []
+    for posicao in np.flatnonzero(invalida):
+        erros.append({
+            "linha": int(normalizado['LINHA'].iat[posicao]),
+            "CNPJ": None if pd.isna(bloco['CNPJ'].iat[posicao]) else str(bloco['CNPJ'].iat[posicao]),
+            "mensagem": "; ".join(mensagem for mascara, mensagem in problemas if mascara[posicao])
+        })
+
+    return normalizado[~invalida & ~vazia], erros
+
+
+# ===========================================
+# INGESTÃO DA PLANILHA
+# ===========================================
+
+class IngestaoPlanilha:
+    """
+    Lê uma planilha do envio em lote (.xlsx ou .csv) e entrega as linhas válidas por um gerador.
+
+    Uso:
+        ingestao = IngestaoPlanilha(arquivo, nome_arquivo)
+        for linha in ingestao.linhas():
+            ...
+        ingestao.erros  # linhas rejeitadas, disponível após consumir o gerador
+    """
+
+    def __init__(self, arquivo, nome_arquivo, tamanho_bloco=TAMANHO_BLOCO):
+        """
+        Parâmetros:
+            arquivo: Arquivo binário (ex.: `FileStorage` do Flask).
+            nome_arquivo (str): Nome do arquivo, usado para identificar o formato.
+            tamanho_bloco (int): Linhas validadas por bloco.
+
+        Exceções:
+            ErroPlanilha: Se a extensão não for suportada.
+        """
+        # Os geradores só leem o arquivo quando consumidos; a extensão é verificada já aqui
+        self._blocos = ler_blocos(arquivo, nome_arquivo, COLUNAS_OBRIGATORIAS, tamanho_bloco)
+        self.erros = []
+        self.total_validas = 0
+
+    def linhas(self):
+        """
+        Gera as linhas válidas da planilha.
+
+        Retorna:
+            generator: Dicionários com CNPJ (somente dígitos), ID_SISTEMA, ID_SERVICO,
+                PARCELA (AAAAMM) e LINHA (número da linha na planilha).
+
+        Exceções:
+            ErroPlanilha: Se o arquivo não puder ser lido ou faltar alguma coluna obrigatória.
+        """
+        # A linha 1 da planilha é o cabeçalho
+        primeira_linha = 2
+        for bloco in self._blocos:
+            validas, erros = validar_bloco(bloco, primeira_linha)
+            primeira_linha += len(bloco)
+            self.erros.extend(erros)
+            self.total_validas += len(validas)
+            yield from validas.to_dict('records')
@@ -0,0 +1,248 @@
+"""
+Módulo: lote.py
+
+Descrição:
+    Motor de envio em lote para a API do SERPRO.
+    As linhas da planilha são processadas por um pool limitado de threads,
+    respeitando um teto de requisições por segundo definido no contrato
+    com o SERPRO.
+
+Configuração (.env):
+    SERPRO_LOTE_WORKERS: quantidade máxima de threads simultâneas (padrão: 4).
+    SERPRO_LIMITE_POR_SEGUNDO: teto de requisições por segundo (padrão: 5).
+"""
+import threading
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from decouple import config
+from sqlalchemy import update, case
+from sqlalchemy.exc import IntegrityError, OperationalError
+from models import Session, LimiteTaxa
+from metricas import FILA_LOTE, LINHAS_POR_SEGUNDO
+
+# ===========================================
+# CONFIGURAÇÃO DO MOTOR DE LOTE
+# ===========================================
+
+LOTE_WORKERS = config('SERPRO_LOTE_WORKERS', default=4, cast=int)
+LIMITE_POR_SEGUNDO = config('SERPRO_LIMITE_POR_SEGUNDO', default=5.0, cast=float)
+
+
+# ===========================================
+# LIMITADOR DE TAXA
+# ===========================================
+
+class LimitadorTaxa:
+    """
+    Limitador de taxa do tipo "token bucket", seguro para uso entre threads.
+
+    Cada chamada a `aguardar()` consome uma permissão; quando o balde está vazio,
+    a thread chamadora dorme até que uma nova permissão seja liberada.
+    """
+
+    def __init__(self, max_por_segundo):
+        """
+        Parâmetros:
+            max_por_segundo (float): Teto de requisições por segundo. Valores
+                menores ou iguais a zero desativam o limite.
+        """
+        self.max_por_segundo = max_por_segundo
+        self._capacidade = max(1.0, max_por_segundo or 0)
+        self._permissoes = self._capacidade
+        self._ultimo = time.monotonic()
+        self._lock = threading.Lock()
+
+    def aguardar(self):
+        """
+        Bloqueia até que uma requisição possa ser feita dentro do limite configurado.
+        """
+        if not self.max_por_segundo or self.max_por_segundo <= 0:
+            return
+
+        while True:
+            with self._lock:
+                agora = time.monotonic()
+                decorrido = agora - self._ultimo
+                self._ultimo = agora
+                self._permissoes = min(self._capacidade, self._permissoes + decorrido * self.max_por_segundo)
+
+                if self._permissoes >= 1:
+                    self._permissoes -= 1
+                    return
+
+                espera = (1 - self._permissoes) / self.max_por_segundo
+
+            time.sleep(espera)
+
+
+class LimitadorTaxaCompartilhado:
+    """
+    Limitador de taxa compartilhado entre processos (ex.: workers do gunicorn) pelo banco.
+
+    O balde é guardado na tabela `limites_taxa` como o instante da próxima permissão livre
+    (GCRA): cada chamada a `aguardar()` reserva a sua permissão com um único UPDATE e dorme,
+    fora da transação, até o instante reservado. O limite vale para a soma dos processos,
+    e um único lote em andamento pode usar o limite inteiro.
+
+    Se o banco estiver indisponível, a chamada usa um limitador local do processo.
+    """
+
+    def __init__(self, chave, max_por_segundo):
+        """
+        Parâmetros:
+            chave (str): Identificador do limite no banco (ex.: CNPJ do contratante).
+            max_por_segundo (float): Teto de requisições por segundo, somando todos os
+                processos. Valores menores ou iguais a zero desativam o limite.
+        """
+        self.chave = chave
+        self.max_por_segundo = max_por_segundo
+        self._capacidade = max(1.0, max_por_segundo or 0)
+        self._criado = False
+        self._local = LimitadorTaxa(max_por_segundo)
+
+    def _reservar(self, db, agora):
+        """
+        Reserva a próxima permissão e retorna o instante (epoch) a partir do qual ela vale.
+        """
+        intervalo = 1 / self.max_por_segundo
+        # Permissões acumuladas enquanto ocioso, até a capacidade do balde
+        minimo = agora - (self._capacidade - 1) * intervalo
+        base = case((LimiteTaxa.proxima_permissao > minimo, LimiteTaxa.proxima_permissao), else_=minimo)
+        proxima = db.execute(
+            update(LimiteTaxa)
+            .where(LimiteTaxa.chave == self.chave)
+            .values(proxima_permissao=base + intervalo)
+            .returning(LimiteTaxa.proxima_permissao)
+        ).scalar()
+        return None if proxima is None else proxima - intervalo
+
+    def _criar(self, db):
+        db.add(LimiteTaxa(chave=self.chave, proxima_permissao=0.0))
+        try:
+            db.commit()
+        except IntegrityError:
+            # Outro processo criou o registro antes
+            db.rollback()
+        self._criado = True
+
+    def aguardar(self):
+        """
+        Bloqueia até que uma requisição possa ser feita dentro do limite configurado.
+        """
+        if not self.max_por_segundo or self.max_por_segundo <= 0:
+            return
+
+        agora = time.time()
+        try:
+            with Session() as db:
+                if not self._criado:
+                    self._criar(db)
+                permissao = self._reservar(db, agora)
+                db.commit()
+        except OperationalError as e:
+            logging.warning("Limite de taxa compartilhado %s indisponível, usando o do processo: %s", self.chave, e)
+            self._local.aguardar()
+            return
+
+        if permissao is None:
+            # Registro removido do banco: recria na próxima chamada
+            self._criado = False
+            self._local.aguardar()
+            return
+
+        espera = permissao - time.time()
+        if espera > 0:
+            time.sleep(espera)
+
+
+# ===========================================
+# EXECUÇÃO DO LOTE
+# ===========================================
+
+def executar_em_lote(itens, funcao, max_workers=None, max_por_segundo=None, ao_concluir=None,
+                     ao_ocioso=None, intervalo_ocioso=1.0, guardar_resultados=True, disjuntor=None,
+                     limitador=None):
+    """
+    Executa `funcao` para cada item usando um pool limitado de threads.
+
+    Parâmetros:
+        itens (iterable): Itens a processar (ex.: linhas da planilha).
+        funcao (callable): Função chamada com cada item; executada nas threads do pool.
+        max_workers (int): Quantidade máxima de threads (padrão: SERPRO_LOTE_WORKERS).
+        max_por_segundo (float): Teto de chamadas por segundo (padrão: SERPRO_LIMITE_POR_SEGUNDO).
+        ao_concluir (callable): Callback opcional `ao_concluir(indice, item, resultado)`,
+            chamado na thread de origem à medida que cada item termina. Útil para
+            gravar no banco sem compartilhar a sessão entre threads.
+        ao_ocioso (callable): Callback opcional sem argumentos, chamado na thread de origem
+            quando nenhum item termina em `intervalo_ocioso` segundos.
+        intervalo_ocioso (float): Intervalo, em segundos, entre chamadas de `ao_ocioso`.
+        guardar_resultados (bool): Se False, os resultados são descartados após `ao_concluir`,
+            mantendo a memória constante em lotes grandes.
+        disjuntor (DisjuntorCircuito): Disjuntor opcional (ver `resiliencia.py`). Enquanto
+            estiver aberto, as threads aguardam o fechamento antes de iniciar o próximo item.
+        limitador (LimitadorTaxa): Limitador compartilhado com outras execuções (ex.: o do
+            contratante); se informado, `max_por_segundo` é ignorado.
+
+    Retorna:
+        list: Resultados na mesma ordem dos itens de entrada (None se `guardar_resultados` for False).
+    """
+    itens = list(itens)
+    max_workers = max_workers or LOTE_WORKERS
+    if limitador is None:
+        limitador = LimitadorTaxa(LIMITE_POR_SEGUNDO if max_por_segundo is None else max_por_segundo)
+
+    def executar(item):
+        if disjuntor is None:
+            limitador.aguardar()
+            return funcao(item)
+
+        disjuntor.aguardar_fechamento()
+        try:
+            limitador.aguardar()
+            return funcao(item)
+        finally:
+            # No estado meio aberto, a chamada de teste é desta thread: se o item terminou sem
+            # chamar o SERPRO (ex.: guia em cache), ela é liberada para outra thread
+            disjuntor.registrar_indefinido()
+
+    resultados = [None] * len(itens)
+    if not itens:
+        return resultados
+
+    inicio = time.monotonic()
+    processados = 0
+    FILA_LOTE.inc(len(itens))
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='serpro-lote') as executor:
+            futuros = {executor.submit(executar, item): indice for indice, item in enumerate(itens)}
+            pendentes = set(futuros)
+
+            while pendentes:
+                concluidos, pendentes = wait(
+                    pendentes, timeout=intervalo_ocioso if ao_ocioso else None, return_when=FIRST_COMPLETED
+                )
+                if not concluidos:
+                    ao_ocioso()
+                    continue
+
+                for futuro in concluidos:
+                    indice = futuros.pop(futuro)
+                    resultado = futuro.result()
+                    processados += 1
+                    FILA_LOTE.dec()
+                    if guardar_resultados:
+                        resultados[indice] = resultado
+                    if ao_concluir:
+                        ao_concluir(indice, itens[indice], resultado)
+
+                LINHAS_POR_SEGUNDO.definir(processados / max(time.monotonic() - inicio, 1e-9))
+    finally:
+        # Itens não concluídos (ex.: exceção em um callback) deixam a fila
+        FILA_LOTE.dec(len(itens) - processados)
+
+    duracao = time.monotonic() - inicio
+    logging.info(f"Lote de {len(itens)} itens processado em {duracao:.2f}s "
+                 f"({len(itens) / duracao if duracao else 0:.2f} itens/s, {max_workers} workers)")
+
+    return resultados
@@ -0,0 +1,262 @@
+"""
+Módulo: metricas.py
+
+Descrição:
+    Métricas da aplicação no formato de texto do Prometheus, expostas em `/metrics`.
+
+    Implementa contadores, medidores (gauges) e histogramas com rótulos, seguros para
+    uso entre threads e sem dependências externas, além do decorador `cronometrar`
+    para medir a duração de funções.
+
+    As métricas são mantidas em memória por processo: com vários workers (gunicorn),
+    cada processo expõe os próprios valores.
+
+Uso:
+    from metricas import cronometrar, DURACAO_FUNCAO
+
+    @cronometrar(DURACAO_FUNCAO, funcao='emitir')
+    def emitir(...):
+        ...
+"""
+import functools
+import math
+import threading
+import time
+
+# Faixas padrão dos histogramas de latência, em segundos
+FAIXAS_LATENCIA = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Faixas dos histogramas de tamanho, em bytes (1 KB a 1 GB)
+FAIXAS_BYTES = tuple(1024 * 4 ** expoente for expoente in range(11))
+
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _formatar_rotulos(nomes, valores, extra=None):
+    pares = list(zip(nomes, valores)) + ([extra] if extra else [])
+    if not pares:
+        return ''
+    return '{' + ','.join(f'{nome}="{_escapar(valor)}"' for nome, valor in pares) + '}'
+
+
+def _formatar_numero(valor):
+    if valor == math.inf:
+        return '+Inf'
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+# ===========================================
+# TIPOS DE MÉTRICA
+# ===========================================
+
+class _Metrica:
+    """
+    Base das métricas: nome, ajuda, rótulos e registro no coletor.
+    """
+
+    tipo = None
+
+    def __init__(self, nome, ajuda, rotulos=(), registro=None):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.rotulos = tuple(rotulos)
+        self._valores = {}
+        self._lock = threading.Lock()
+        (registro or REGISTRO).registrar(self)
+
+    def _chave(self, rotulos):
+        if set(rotulos) != set(self.rotulos):
+            raise ValueError(f"A métrica {self.nome} exige os rótulos {self.rotulos}, recebeu {tuple(rotulos)}")
+        return tuple(str(rotulos[nome]) for nome in self.rotulos)
+
+    def exportar(self):
+        """
+        Retorna as linhas da métrica no formato de texto do Prometheus.
+        """
+        linhas = [f"# HELP {self.nome} {self.ajuda}", f"# TYPE {self.nome} {self.tipo}"]
+        with self._lock:
+            itens = list(self._valores.items())
+        for chave, valor in sorted(itens):
+            linhas.extend(self._amostras(chave, valor))
+        return linhas
+
+    def _amostras(self, chave, valor):
+        return [f"{self.nome}{_formatar_rotulos(self.rotulos, chave)} {_formatar_numero(valor)}"]
+
+
+class Contador(_Metrica):
+    """
+    Valor que só aumenta (ex.: total de requisições).
+    """
+
+    tipo = 'counter'
+
+    def inc(self, quantidade=1, **rotulos):
+        chave = self._chave(rotulos)
+        with self._lock:
+            self._valores[chave] = self._valores.get(chave, 0) + quantidade
+
+
+class Medidor(_Metrica):
+    """
+    Valor que sobe e desce (ex.: itens na fila).
+    """
+
+    tipo = 'gauge'
+
+    def definir(self, valor, **rotulos):
+        chave = self._chave(rotulos)
+        with self._lock:
+            self._valores[chave] = valor
+
+    def inc(self, quantidade=1, **rotulos):
+        chave = self._chave(rotulos)
+        with self._lock:
+            self._valores[chave] = self._valores.get(chave, 0) + quantidade
+
+    def dec(self, quantidade=1, **rotulos):
+        self.inc(-quantidade, **rotulos)
+
+
+class Histograma(_Metrica):
+    """
+    Distribuição de observações em faixas cumulativas, com soma e contagem.
+    """
+
+    tipo = 'histogram'
+
+    def __init__(self, nome, ajuda, rotulos=(), faixas=FAIXAS_LATENCIA, registro=None):
+        self.faixas = tuple(sorted(faixas))
+        super().__init__(nome, ajuda, rotulos, registro)
+
+    def observar(self, valor, **rotulos):
+        chave = self._chave(rotulos)
+        with self._lock:
+            estado = self._valores.get(chave)
+            if estado is None:
+                # [contagens por faixa..., soma, contagem]
+                estado = self._valores[chave] = [0] * len(self.faixas) + [0.0, 0]
+            for indice, limite in enumerate(self.faixas):
+                if valor <= limite:
+                    estado[indice] += 1
+                    break
+            estado[-2] += valor
+            estado[-1] += 1
+
+    def _amostras(self, chave, estado):
+        linhas = []
+        acumulado = 0
+        for limite, quantidade in zip(self.faixas, estado):
+            acumulado += quantidade
+            rotulos = _formatar_rotulos(self.rotulos, chave, ('le', _formatar_numero(float(limite))))
+            linhas.append(f"{self.nome}_bucket{rotulos} {acumulado}")
+        linhas.append(f"{self.nome}_bucket{_formatar_rotulos(self.rotulos, chave, ('le', '+Inf'))} {estado[-1]}")
+        linhas.append(f"{self.nome}_sum{_formatar_rotulos(self.rotulos, chave)} {_formatar_numero(estado[-2])}")
+        linhas.append(f"{self.nome}_count{_formatar_rotulos(self.rotulos, chave)} {estado[-1]}")
+        return linhas
+
+
+# ===========================================
+# REGISTRO E EXPORTAÇÃO
+# ===========================================
+
+class RegistroMetricas:
+    """
+    Conjunto das métricas exportadas e das funções coletoras chamadas a cada leitura.
+    """
+
+    def __init__(self):
+        self._metricas = []
+        self._coletores = []
+        self._lock = threading.Lock()
+
+    def registrar(self, metrica):
+        with self._lock:
+            self._metricas.append(metrica)
+
+    def registrar_coletor(self, coletor):
+        """
+        Registra uma função chamada antes de cada exportação, para atualizar medidores
+        a partir de estado mantido em outros módulos (ex.: contadores de resiliência).
+        """
+        with self._lock:
+            self._coletores.append(coletor)
+
+    def exportar(self):
+        """
+        Retorna todas as métricas no formato de texto do Prometheus (versão 0.0.4).
+        """
+        with self._lock:
+            coletores = list(self._coletores)
+            metricas = list(self._metricas)
+        for coletor in coletores:
+            coletor()
+        linhas = []
+        for metrica in metricas:
+            linhas.extend(metrica.exportar())
+        return '\n'.join(linhas) + '\n'
+
+
+REGISTRO = RegistroMetricas()
+TIPO_CONTEUDO = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+# ===========================================
+# DECORADOR DE TEMPO
+# ===========================================
+
+def cronometrar(histograma, **rotulos):
+    """
+    Decorador que registra no histograma a duração de cada chamada da função.
+
+    Parâmetros:
+        histograma (Histograma): Histograma de destino.
+        **rotulos: Valores fixos dos rótulos do histograma.
+    """
+    def decorador(funcao):
+        @functools.wraps(funcao)
+        def envoltorio(*args, **kwargs):
+            inicio = time.perf_counter()
+            try:
+                return funcao(*args, **kwargs)
+            finally:
+                histograma.observar(time.perf_counter() - inicio, **rotulos)
+        return envoltorio
+    return decorador
+
+
+# ===========================================
+# MÉTRICAS DA APLICAÇÃO
+# ===========================================
+
+DURACAO_FUNCAO = Histograma(
+    'serpro_funcao_duracao_segundos', 'Duração das funções instrumentadas com cronometrar.', ['funcao']
+)
+DURACAO_SERPRO = Histograma(
+    'serpro_requisicao_duracao_segundos', 'Latência de cada tentativa de chamada ao gateway do SERPRO.',
+    ['endpoint', 'status']
+)
+TOKEN_CACHE = Contador(
+    'serpro_token_cache_total', 'Obtenções do token de autenticação, por resultado do cache.', ['resultado']
+)
+CACHE_PDFS = Contador(
+    'recibos_cache_pdfs_total', 'Leituras de PDFs em /baixar_recibo, por resultado do cache em memória.', ['resultado']
+)
+LINHAS_LOTE = Contador('lote_linhas_processadas_total', 'Linhas de lote processadas, por status.', ['status'])
+LINHAS_POR_SEGUNDO = Medidor('lote_linhas_por_segundo', 'Vazão do lote em execução mais recente.')
+FILA_LOTE = Medidor('lote_fila_itens', 'Itens de lote aguardando ou em emissão neste processo.')
+DURACAO_GRAVACAO = Histograma(
+    'db_gravacao_duracao_segundos', 'Duração das gravações no banco (UPDATE em massa + commit).', ['operacao']
+)
+EXPORTACAO_BYTES = Histograma(
+    'exportacao_zip_bytes', 'Tamanho dos ZIPs de exportação gerados.', faixas=FAIXAS_BYTES
+)
+EXPORTACAO_ARQUIVOS = Contador('exportacao_arquivos_total', 'Guias incluídas nos ZIPs de exportação.')
+EXPORTACAO_BYTES_POR_SEGUNDO = Medidor(
+    'exportacao_bytes_por_segundo', 'Vazão da exportação ZIP concluída mais recente.'
+)
+DURACAO_HTTP = Histograma(
+    'http_requisicao_duracao_segundos', 'Duração das requisições às rotas Flask.', ['rota', 'metodo', 'status']
+)
@@ -1,7 +1,13 @@
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Text
+from sqlalchemy import create_engine, event, Column, Integer, Float, String, DateTime, Boolean, LargeBinary, ForeignKey, Index, inspect, text
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy.orm import sessionmaker, scoped_session, deferred
+from sqlalchemy.exc import IntegrityError, OperationalError
+import base64
 import datetime
+import hashlib
+import re
+from decouple import config
 
 # ===========================================
 # CONFIGURAÇÃO DO BANCO DE DADOS
@@ -25,6 +31,20 @@ class Requisicao(Base):
     Tabela: requisicoes
     """
     __tablename__ = 'requisicoes'
+    __table_args__ = (
+        # Consultas por contribuinte e período de envio (/consulta, /consultar_requisicoes)
+        Index('ix_requisicoes_contribuinte_data_envio', 'contribuinte', 'data_envio'),
+        # Filtros e contagens por status
+        Index('ix_requisicoes_status', 'status'),
+        # Linhas pendentes e progresso de um lote
+        Index('ix_requisicoes_lote_id_status', 'lote_id', 'status'),
+        # Leitura incremental das linhas de um lote, na ordem da planilha (eventos de progresso)
+        Index('ix_requisicoes_lote_id_linha', 'lote_id', 'linha'),
+        # Busca de guias já emitidas para a mesma chave (cache de emissão)
+        Index('ix_requisicoes_chave_emissao_data_resposta', 'chave_emissao', 'data_resposta'),
+        # Resumos por parcela e contribuinte (/painel); cobre os agrupamentos sem ler a tabela
+        Index('ix_requisicoes_parcela_status_contribuinte', 'parcela', 'status', 'contribuinte'),
+    )
 
     # Identificador único da requisição
     id = Column(Integer, primary_key=True, autoincrement=True)
@@ -38,29 +58,297 @@ class Requisicao(Base):
     id_servico = Column(String, nullable=False)  # Identificador do serviço
 
     # Resposta e Status
-    resposta_base64 = Column(Text, nullable=True)  # Resposta em PDF codificada em Base64
+    # O PDF é carregado apenas quando acessado; listagens usam pdf_tamanho/possui_pdf
+    pdf = deferred(Column(LargeBinary, nullable=True))  # PDF da guia (bytes)
+    pdf_sha256 = Column(String(64), nullable=True)  # Hash SHA-256 do PDF
+    pdf_tamanho = Column(Integer, nullable=True)  # Tamanho do PDF em bytes
     data_envio = Column(DateTime, default=lambda: datetime.datetime.now(datetime.timezone.utc))  # Data de envio
     data_resposta = Column(DateTime, nullable=True)  # Data de resposta (opcional)
     status = Column(String, default="Pendente")  # Status inicial é "Pendente"
     response_message = Column(String, nullable=True)  # Mensagem de resposta (opcional)
 
+    # Informações do envio em lote (opcionais)
+    parcela = Column(String, nullable=True)  # Parcela solicitada (AAAAMM)
+    lote_id = Column(String, ForeignKey('lotes.id'), nullable=True)  # Lote de origem
+    linha = Column(Integer, nullable=True)  # Posição da linha na planilha do lote
+
+    # CNPJ do contratante (escritório) que emite a guia; vazio usa o contratante padrão (contratantes.py)
+    contratante = Column(String(14), nullable=True)
+
+    # Chave normalizada (contribuinte, tipo, sistema, serviço, parcela) usada pelo cache de emissão
+    chave_emissao = Column(String, nullable=True)
+
+    @hybrid_property
+    def possui_pdf(self):
+        """
+        Indica se a requisição possui PDF, sem carregar o documento.
+        """
+        return self.pdf_tamanho is not None
+
+    @possui_pdf.expression
+    def possui_pdf(cls):
+        return cls.pdf_tamanho.isnot(None)
+
+    def definir_pdf_base64(self, resposta_base64):
+        """
+        Decodifica o PDF retornado pelo SERPRO (Base64) e grava os bytes com hash e tamanho.
+
+        Parâmetros:
+            resposta_base64 (str): PDF codificado em Base64.
+        """
+        self.definir_pdf(base64.b64decode(resposta_base64))
+
+    def definir_pdf(self, pdf_bytes):
+        """
+        Grava os bytes do PDF com hash e tamanho.
+
+        Parâmetros:
+            pdf_bytes (bytes): Conteúdo do PDF.
+        """
+        for campo, valor in self.campos_pdf(pdf_bytes).items():
+            setattr(self, campo, valor)
+
+    @staticmethod
+    def campos_pdf(pdf_bytes):
+        """
+        Retorna os valores das colunas do PDF (bytes, hash e tamanho), para uso em gravações em massa.
+
+        Parâmetros:
+            pdf_bytes (bytes): Conteúdo do PDF.
+
+        Retorna:
+            dict: {"pdf": bytes, "pdf_sha256": str, "pdf_tamanho": int}
+        """
+        return {
+            'pdf': pdf_bytes,
+            'pdf_sha256': hashlib.sha256(pdf_bytes).hexdigest(),
+            'pdf_tamanho': len(pdf_bytes)
+        }
+
+
+# ===========================================
+# MODELO: LOTE
+# ===========================================
+
+class Lote(Base):
+    """
+    Modelo para acompanhar os envios em lote processados em segundo plano.
+
+    Tabela: lotes
+    """
+    __tablename__ = 'lotes'
+
+    # Identificador público do lote (UUID em hexadecimal)
+    id = Column(String(32), primary_key=True)
+
+    nome_arquivo = Column(String, nullable=True)  # Nome da planilha enviada
+    total = Column(Integer, nullable=False, default=0)  # Quantidade de linhas do lote
+    status = Column(String, default="Pendente")  # Recebendo, Pendente, Processando ou Concluído
+    data_criacao = Column(DateTime, default=lambda: datetime.datetime.now(datetime.timezone.utc))
+    data_conclusao = Column(DateTime, nullable=True)
+
+    # Última sinalização do worker que processa o lote; usada para retomar lotes órfãos
+    heartbeat = Column(DateTime, nullable=True)
+
+    # Ignora o cache de emissão e solicita todas as guias novamente ao SERPRO
+    forcar_emissao = Column(Boolean, nullable=True, default=False)
+
+
+# ===========================================
+# MODELO: EMPRESA
+# ===========================================
+
+class Empresa(Base):
+    """
+    Cadastro das empresas clientes, com o código usado para nomear as guias exportadas.
+    Tabela: empresas
+    """
+    __tablename__ = 'empresas'
+
+    # CNPJ somente com dígitos (mesmo formato de `Requisicao.contribuinte`)
+    cnpj = Column(String(14), primary_key=True)
+    codigo = Column(String, nullable=False)  # Código interno da empresa
+    nome = Column(String, nullable=True)  # Razão social (opcional)
+    # CNPJ do contratante (escritório) que atende a empresa; vazio usa o contratante padrão
+    contratante = Column(String(14), nullable=True)
+    data_atualizacao = Column(DateTime, default=lambda: datetime.datetime.now(datetime.timezone.utc),
+                              onupdate=lambda: datetime.datetime.now(datetime.timezone.utc))
+
+
+# ===========================================
+# MODELO: ASSINATURA
+# ===========================================
+
+class Assinatura(Base):
+    """
+    Clientes com emissão mensal recorrente: o agendador (agendador.py) emite, a cada mês,
+    a guia da parcela corrente de cada assinatura ativa.
+    Tabela: assinaturas
+    """
+    __tablename__ = 'assinaturas'
+    __table_args__ = (
+        Index('ix_assinaturas_contribuinte_sistema_servico', 'contribuinte', 'id_sistema', 'id_servico',
+              unique=True),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    contribuinte = Column(String(14), nullable=False)  # CNPJ somente com dígitos
+    tipo_contribuinte = Column(Integer, nullable=False, default=2)
+    id_sistema = Column(String, nullable=False)
+    id_servico = Column(String, nullable=False)
+    ativa = Column(Boolean, nullable=False, default=True)
+
+    # Última parcela (AAAAMM) incluída em um lote pelo agendador e o momento da inclusão
+    ultima_parcela = Column(String, nullable=True)
+    data_agendamento = Column(DateTime, nullable=True)
+    data_criacao = Column(DateTime, default=lambda: datetime.datetime.now(datetime.timezone.utc))
+
+
+# ===========================================
+# MODELO: RESUMO POR PARCELA
+# ===========================================
+
+class ResumoParcela(Base):
+    """
+    Quantidade de requisições por parcela e status, mantida por gatilhos do SQLite
+    a cada inclusão, alteração ou exclusão em `requisicoes` (ver `_criar_gatilhos_resumo`).
+    Permite montar os totais do painel sem agregar a tabela de requisições.
+    Tabela: resumo_parcelas
+    """
+    __tablename__ = 'resumo_parcelas'
+
+    parcela = Column(String, primary_key=True)  # AAAAMM; '' para requisições sem parcela
+    status = Column(String, primary_key=True)
+    quantidade = Column(Integer, nullable=False, default=0)
+
+
+# ===========================================
+# MODELO: EMISSAO EM ANDAMENTO
+# ===========================================
+
+class EmissaoEmAndamento(Base):
+    """
+    Reserva de uma chave de emissão enquanto a guia é solicitada ao SERPRO.
+
+    A chave primária garante que apenas um worker (de qualquer processo) emita
+    a mesma guia por vez; os demais aguardam e reaproveitam o resultado gravado.
+
+    Tabela: emissoes_em_andamento
+    """
+    __tablename__ = 'emissoes_em_andamento'
+
+    chave = Column(String, primary_key=True)  # Chave de emissão reservada
+    data_inicio = Column(DateTime, default=lambda: datetime.datetime.now(datetime.timezone.utc))
+
+
+# ===========================================
+# MODELO: LIMITE DE TAXA
+# ===========================================
+
+class LimiteTaxa(Base):
+    """
+    Estado dos limitadores de taxa compartilhados entre processos (ver `lote.LimitadorTaxaCompartilhado`).
+
+    Cada chamada reserva o próximo instante livre com um único UPDATE, de modo que os
+    workers do servidor somados respeitam o limite de chamadas por segundo.
+
+    Tabela: limites_taxa
+    """
+    __tablename__ = 'limites_taxa'
+
+    chave = Column(String, primary_key=True)  # Ex.: CNPJ do contratante
+    proxima_permissao = Column(Float, nullable=False, default=0.0)  # Epoch (segundos) da próxima permissão livre
+
+
+# ===========================================
+# MODELO: MIGRAÇÃO APLICADA
+# ===========================================
+
+class MigracaoAplicada(Base):
+    """
+    Migrações de dados executadas uma única vez, registradas por nome.
+
+    Tabela: migracoes_aplicadas
+    """
+    __tablename__ = 'migracoes_aplicadas'
+
+    nome = Column(String, primary_key=True)
+    data_aplicacao = Column(DateTime, default=lambda: datetime.datetime.now(datetime.timezone.utc))
+
 
 # ===========================================
 # CONFIGURAÇÃO DA CONEXÃO COM O BANCO DE DADOS
 # ===========================================
 
 """
-Cria a conexão com o banco de dados SQLite.
-O parâmetro 'echo=True' exibe as operações SQL no console para depuração.
+Parâmetros da conexão, lidos do .env:
+    DATABASE_URL: URL do banco (padrão: sqlite:///serpro_app.db).
+    SQL_ECHO: exibe as operações SQL no console para depuração (padrão: False).
+    SQLITE_BUSY_TIMEOUT: milissegundos de espera por uma trava do SQLite (padrão: 5000).
+    DB_POOL_TAMANHO: conexões mantidas no pool (padrão: 10).
 """
-engine = create_engine('sqlite:///serpro_app.db', echo=True)
+DATABASE_URL = config('DATABASE_URL', default='sqlite:///serpro_app.db')
+SQL_ECHO = config('SQL_ECHO', default=False, cast=bool)
+SQLITE_BUSY_TIMEOUT = config('SQLITE_BUSY_TIMEOUT', default=5000, cast=int)
+DB_POOL_TAMANHO = config('DB_POOL_TAMANHO', default=10, cast=int)
+
+
+def _configurar_sqlite(conexao_dbapi, registro_conexao):
+    """
+    Ajusta cada nova conexão SQLite para uso concorrente.
+
+    - WAL: leitores não bloqueiam o escritor (e vice-versa).
+    - synchronous=NORMAL: seguro em WAL, com menos fsyncs por commit.
+    - busy_timeout: aguarda a trava em vez de falhar com "database is locked".
+    """
+    cursor = conexao_dbapi.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.execute(f'PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT}')
+    cursor.close()
+
+
+def criar_engine(url=DATABASE_URL, echo=SQL_ECHO):
+    """
+    Cria o engine do SQLAlchemy com as configurações de pool e, no SQLite, os PRAGMAs de concorrência.
+
+    Parâmetros:
+        url (str): URL do banco de dados.
+        echo (bool): Exibe as operações SQL no console.
+
+    Retorna:
+        Engine: Engine configurado.
+    """
+    if not url.startswith('sqlite'):
+        return create_engine(url, echo=echo, pool_size=DB_POOL_TAMANHO, pool_pre_ping=True)
+
+    if ':memory:' in url or url in ('sqlite://', 'sqlite:///'):
+        return create_engine(url, echo=echo)
+
+    novo_engine = create_engine(
+        url,
+        echo=echo,
+        pool_size=DB_POOL_TAMANHO,
+        max_overflow=DB_POOL_TAMANHO,
+        # As conexões do pool circulam entre as threads do Flask e dos workers de lote
+        connect_args={'check_same_thread': False, 'timeout': SQLITE_BUSY_TIMEOUT / 1000}
+    )
+    event.listen(novo_engine, 'connect', _configurar_sqlite)
+    return novo_engine
+
+
+engine = criar_engine()
 
 """
 Cria uma fábrica de sessões para interagir com o banco de dados.
-Cada instância de 'session' é usada para realizar operações no banco.
+Workers em segundo plano criam suas próprias sessões com `Session()`.
+
+'session' é uma sessão com escopo de thread: cada thread (requisição do Flask)
+recebe a sua própria sessão, que deve ser descartada com `session.remove()`
+ao final da requisição.
 """
 Session = sessionmaker(bind=engine)
-session = Session()
+session = scoped_session(Session)
 
 
 # ===========================================
@@ -75,6 +363,194 @@ def init_db():
         Esta função deve ser executada na primeira inicialização ou após alterações no modelo.
     """
     Base.metadata.create_all(engine)
+    _adicionar_colunas_faltantes()
+    _criar_indices_faltantes()
+    _migrar_pdfs_base64()
+    _normalizar_contribuintes()
+    _popular_empresas()
+    _criar_gatilhos_resumo()
+
+
+def _adicionar_colunas_faltantes():
+    """
+    Adiciona às tabelas existentes as colunas novas do modelo.
+
+    O `create_all` só cria tabelas inexistentes; bancos criados por versões anteriores
+    recebem aqui as colunas opcionais acrescentadas depois.
+    """
+    inspetor = inspect(engine)
+    with engine.begin() as conexao:
+        for tabela in Base.metadata.sorted_tables:
+            existentes = {coluna['name'] for coluna in inspetor.get_columns(tabela.name)}
+            for coluna in tabela.columns:
+                if coluna.name not in existentes:
+                    tipo = coluna.type.compile(dialect=engine.dialect)
+                    conexao.execute(text(f'ALTER TABLE {tabela.name} ADD COLUMN {coluna.name} {tipo}'))
+
+
+def _criar_indices_faltantes():
+    """
+    Cria nas tabelas existentes os índices declarados no modelo.
+
+    O `create_all` só cria os índices junto com tabelas novas.
+    """
+    for tabela in Base.metadata.sorted_tables:
+        for indice in tabela.indexes:
+            indice.create(engine, checkfirst=True)
+
+
+def _migrar_pdfs_base64(tamanho_bloco=200):
+    """
+    Converte os PDFs gravados na antiga coluna `resposta_base64` para a coluna binária `pdf`.
+
+    A conversão é feita em blocos para não carregar todos os documentos na memória. Ao final,
+    a coluna antiga é removida (SQLite 3.35+); execute `VACUUM` para devolver o espaço ao disco.
+    """
+    colunas = {coluna['name'] for coluna in inspect(engine).get_columns(Requisicao.__tablename__)}
+    if 'resposta_base64' not in colunas:
+        return
+
+    while True:
+        with engine.begin() as conexao:
+            linhas = conexao.execute(text(
+                'SELECT id, resposta_base64 FROM requisicoes WHERE resposta_base64 IS NOT NULL LIMIT :limite'
+            ), {'limite': tamanho_bloco}).fetchall()
+
+            for requisicao_id, resposta_base64 in linhas:
+                pdf_bytes = base64.b64decode(resposta_base64)
+                conexao.execute(text(
+                    'UPDATE requisicoes SET pdf = :pdf, pdf_sha256 = :sha, pdf_tamanho = :tamanho, '
+                    'resposta_base64 = NULL WHERE id = :id'
+                ), {
+                    'pdf': pdf_bytes,
+                    'sha': hashlib.sha256(pdf_bytes).hexdigest(),
+                    'tamanho': len(pdf_bytes),
+                    'id': requisicao_id
+                })
+
+        if len(linhas) < tamanho_bloco:
+            break
+
+    try:
+        with engine.begin() as conexao:
+            conexao.execute(text('ALTER TABLE requisicoes DROP COLUMN resposta_base64'))
+    except OperationalError:
+        # Versões antigas do SQLite não removem colunas; a coluna fica vazia e sem uso
+        pass
+
+
+def _normalizar_contribuintes():
+    """
+    Remove a pontuação dos CPFs/CNPJs gravados com máscara ("00.000.000/0001-00").
+
+    Versões anteriores gravavam o documento como digitado; as consultas, o cadastro de
+    empresas e a chave de emissão usam somente os dígitos. Como a gravação já normaliza
+    o documento, a varredura é executada uma única vez (tabela `migracoes_aplicadas`).
+    """
+    nome = 'normalizar_contribuintes'
+    try:
+        with engine.begin() as conexao:
+            if conexao.execute(
+                text('SELECT 1 FROM migracoes_aplicadas WHERE nome = :nome'), {'nome': nome}
+            ).first():
+                return
+            conexao.execute(text(
+                "UPDATE requisicoes SET contribuinte = "
+                "REPLACE(REPLACE(REPLACE(REPLACE(contribuinte, '.', ''), '/', ''), '-', ''), ' ', '') "
+                "WHERE contribuinte LIKE '%.%' OR contribuinte LIKE '%/%' "
+                "OR contribuinte LIKE '%-%' OR contribuinte LIKE '% %'"
+            ))
+            conexao.execute(MigracaoAplicada.__table__.insert(), {'nome': nome})
+    except IntegrityError:
+        # Outro processo aplicou e registrou a migração ao mesmo tempo
+        pass
+
+
+def _popular_empresas():
+    """
+    Carrega no cadastro vazio as empresas do antigo dicionário `empresa_codigos.CNPJ_CODIGO_EMPRESA`.
+    """
+    from empresa_codigos import CNPJ_CODIGO_EMPRESA
+
+    with engine.begin() as conexao:
+        if conexao.execute(text('SELECT 1 FROM empresas LIMIT 1')).first():
+            return
+        codigos = {re.sub(r'\D', '', cnpj): codigo for cnpj, codigo in CNPJ_CODIGO_EMPRESA.items()}
+        if codigos:
+            conexao.execute(Empresa.__table__.insert(), [
+                {'cnpj': cnpj, 'codigo': codigo} for cnpj, codigo in codigos.items()
+            ])
+
+
+def resumo_mantido():
+    """
+    Indica se `resumo_parcelas` é mantida pelo banco (apenas no SQLite).
+    Nos demais bancos, os totais são agregados diretamente de `requisicoes`.
+    """
+    return engine.dialect.name == 'sqlite'
+
+
+_GATILHOS_RESUMO = {
+    'trg_resumo_parcelas_insert': """
+        CREATE TRIGGER trg_resumo_parcelas_insert AFTER INSERT ON requisicoes
+        BEGIN
+            INSERT INTO resumo_parcelas (parcela, status, quantidade)
+            VALUES (COALESCE(NEW.parcela, ''), COALESCE(NEW.status, ''), 1)
+            ON CONFLICT (parcela, status) DO UPDATE SET quantidade = quantidade + 1;
+        END
+    """,
+    'trg_resumo_parcelas_update': """
+        CREATE TRIGGER trg_resumo_parcelas_update AFTER UPDATE OF parcela, status ON requisicoes
+        WHEN OLD.parcela IS NOT NEW.parcela OR OLD.status IS NOT NEW.status
+        BEGIN
+            UPDATE resumo_parcelas SET quantidade = quantidade - 1
+            WHERE parcela = COALESCE(OLD.parcela, '') AND status = COALESCE(OLD.status, '');
+            INSERT INTO resumo_parcelas (parcela, status, quantidade)
+            VALUES (COALESCE(NEW.parcela, ''), COALESCE(NEW.status, ''), 1)
+            ON CONFLICT (parcela, status) DO UPDATE SET quantidade = quantidade + 1;
+        END
+    """,
+    'trg_resumo_parcelas_delete': """
+        CREATE TRIGGER trg_resumo_parcelas_delete AFTER DELETE ON requisicoes
+        BEGIN
+            UPDATE resumo_parcelas SET quantidade = quantidade - 1
+            WHERE parcela = COALESCE(OLD.parcela, '') AND status = COALESCE(OLD.status, '');
+        END
+    """,
+}
+
+
+def _criar_gatilhos_resumo():
+    """
+    Cria os gatilhos que mantêm `resumo_parcelas` e, na primeira vez, monta o resumo
+    a partir das requisições já gravadas.
+    """
+    if not resumo_mantido():
+        return
+
+    with engine.begin() as conexao:
+        existentes = {nome for (nome,) in conexao.execute(text(
+            "SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'requisicoes'"
+        ))}
+        if set(_GATILHOS_RESUMO) <= existentes:
+            return
+
+        for nome, ddl in _GATILHOS_RESUMO.items():
+            conexao.execute(text(f'DROP TRIGGER IF EXISTS {nome}'))
+            conexao.execute(text(ddl))
+        _reconstruir_resumo(conexao)
+
+
+def _reconstruir_resumo(conexao):
+    """
+    Recalcula `resumo_parcelas` a partir de `requisicoes`.
+    """
+    conexao.execute(text('DELETE FROM resumo_parcelas'))
+    conexao.execute(text(
+        "INSERT INTO resumo_parcelas (parcela, status, quantidade) "
+        "SELECT COALESCE(parcela, ''), COALESCE(status, ''), COUNT(*) FROM requisicoes "
+        "GROUP BY COALESCE(parcela, ''), COALESCE(status, '')"
+    ))
 
 
 # ===========================================
@@ -0,0 +1,135 @@
+"""
+Módulo: registro.py
+
+Descrição:
+    Configuração de logging da aplicação e utilitários para registrar as chamadas
+    ao SERPRO sem custo no caminho quente.
+
+    - Níveis: o detalhe de cada chamada é registrado em DEBUG; INFO fica para eventos
+      de lote e de token; falhas em WARNING/ERROR.
+    - Formatação preguiçosa: as mensagens usam `%s` e os objetos `Resumo` e
+      `CabecalhosMascarados` só calculam o texto se o registro for de fato emitido.
+    - Corpos nunca são registrados: apenas tamanho e hash SHA-256 (o PDF em base64
+      da resposta tem centenas de KB).
+    - Segredos (Authorization, jwt_token, cookies) são mascarados.
+    - Amostragem: com SERPRO_LOG_AMOSTRAGEM < 1, apenas essa fração das chamadas
+      registra os detalhes em DEBUG.
+
+Configuração (.env):
+    SERPRO_LOG_NIVEL: nível do logging (padrão: INFO).
+    SERPRO_LOG_FORMATO: "texto" ou "json" (uma linha JSON por registro) (padrão: texto).
+    SERPRO_LOG_AMOSTRAGEM: fração (0 a 1) das chamadas com detalhes em DEBUG (padrão: 1).
+"""
+import hashlib
+import json
+import logging
+import random
+from decouple import config
+
+# ===========================================
+# CONFIGURAÇÃO
+# ===========================================
+
+LOG_NIVEL = config('SERPRO_LOG_NIVEL', default='INFO').upper()
+LOG_FORMATO = config('SERPRO_LOG_FORMATO', default='texto').lower()
+LOG_AMOSTRAGEM = config('SERPRO_LOG_AMOSTRAGEM', default=1.0, cast=float)
+
+# Cabeçalhos cujo valor nunca é registrado
+CABECALHOS_SENSIVEIS = frozenset({'authorization', 'jwt_token', 'cookie', 'set-cookie', 'proxy-authorization'})
+
+logger = logging.getLogger('serpro')
+
+
+class FormatadorJson(logging.Formatter):
+    """
+    Formata cada registro como uma linha JSON, para consumo pelo pipeline de logs.
+    """
+
+    def format(self, record):
+        registro = {
+            "data": self.formatTime(record),
+            "nivel": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "mensagem": record.getMessage()
+        }
+        if record.exc_info:
+            registro["excecao"] = self.formatException(record.exc_info)
+        return json.dumps(registro, ensure_ascii=False)
+
+
+def configurar_logging(nivel=None, formato=None):
+    """
+    Configura o logger raiz da aplicação. Chamadas repetidas não duplicam os handlers.
+
+    Parâmetros:
+        nivel (str): Nível do logging (padrão: SERPRO_LOG_NIVEL).
+        formato (str): "texto" ou "json" (padrão: SERPRO_LOG_FORMATO).
+    """
+    raiz = logging.getLogger()
+    raiz.setLevel(nivel or LOG_NIVEL)
+    if getattr(configurar_logging, '_handler', None) in raiz.handlers:
+        return
+
+    handler = logging.StreamHandler()
+    if (formato or LOG_FORMATO) == 'json':
+        handler.setFormatter(FormatadorJson())
+    else:
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s [%(threadName)s] %(name)s: %(message)s'))
+    raiz.addHandler(handler)
+    configurar_logging._handler = handler
+
+
+# ===========================================
+# RESUMOS PREGUIÇOSOS
+# ===========================================
+
+class Resumo:
+    """
+    Representa um corpo (bytes, texto ou JSON) pelo tamanho e pelo início do SHA-256.
+    O cálculo só acontece quando o registro é formatado.
+    """
+
+    __slots__ = ('conteudo',)
+
+    def __init__(self, conteudo):
+        self.conteudo = conteudo
+
+    def __str__(self):
+        conteudo = self.conteudo
+        if conteudo is None:
+            return "vazio"
+        if isinstance(conteudo, (dict, list)):
+            conteudo = json.dumps(conteudo, separators=(',', ':'))
+        if isinstance(conteudo, str):
+            conteudo = conteudo.encode('utf8')
+        return f"{len(conteudo)} bytes sha256={hashlib.sha256(conteudo).hexdigest()[:16]}"
+
+
+class CabecalhosMascarados:
+    """
+    Representa os cabeçalhos HTTP com os valores sensíveis mascarados.
+    """
+
+    __slots__ = ('cabecalhos',)
+
+    def __init__(self, cabecalhos):
+        self.cabecalhos = cabecalhos
+
+    def __str__(self):
+        return str({
+            nome: ('***' if nome.lower() in CABECALHOS_SENSIVEIS else valor)
+            for nome, valor in (self.cabecalhos or {}).items()
+        })
+
+
+def amostrar():
+    """
+    Decide se a chamada atual deve registrar os detalhes em DEBUG.
+
+    Retorna:
+        bool: False se o DEBUG estiver desligado ou se a chamada ficar fora da amostra.
+    """
+    if not logger.isEnabledFor(logging.DEBUG):
+        return False
+    return LOG_AMOSTRAGEM >= 1 or random.random() < LOG_AMOSTRAGEM
@@ -0,0 +1,360 @@
+"""
+Módulo: resiliencia.py
+
+Descrição:
+    Políticas de resiliência das chamadas ao gateway do SERPRO.
+
+    - Timeouts de conexão e de leitura, para que nenhuma chamada fique presa
+      indefinidamente em um socket.
+    - Retentativa com backoff exponencial e jitter para respostas 429/5xx e erros
+      de conexão, respeitando o cabeçalho Retry-After.
+    - Disjuntor (circuit breaker): quando a taxa de erros ultrapassa o limiar, as
+      chamadas são suspensas por um intervalo; o motor de lote aguarda o
+      fechamento do circuito em vez de transformar cada linha em erro.
+    - Contadores de tentativas, retentativas, timeouts, renovações de token e
+      aberturas do circuito, expostos por `estatisticas_resiliencia()`.
+
+Configuração (.env):
+    SERPRO_TIMEOUT_CONEXAO: timeout de conexão, em segundos (padrão: 5).
+    SERPRO_TIMEOUT_LEITURA: timeout de leitura, em segundos (padrão: 60).
+    SERPRO_TENTATIVAS: tentativas por chamada, incluindo a primeira (padrão: 4).
+    SERPRO_BACKOFF_BASE: espera base do backoff exponencial, em segundos (padrão: 0.5).
+    SERPRO_BACKOFF_MAXIMO: espera máxima entre tentativas, em segundos (padrão: 30).
+    SERPRO_CIRCUITO_LIMIAR: fração de falhas que abre o circuito (padrão: 0.5).
+    SERPRO_CIRCUITO_MINIMO: chamadas mínimas na janela para avaliar o limiar (padrão: 10).
+    SERPRO_CIRCUITO_JANELA: janela de avaliação, em segundos (padrão: 60).
+    SERPRO_CIRCUITO_PAUSA: tempo, em segundos, que o circuito fica aberto (padrão: 30).
+"""
+import email.utils
+import random
+import threading
+import time
+import logging
+from collections import deque
+from decouple import config
+from metricas import REGISTRO, Contador, Medidor
+
+# ===========================================
+# CONFIGURAÇÃO
+# ===========================================
+
+TIMEOUT_CONEXAO = config('SERPRO_TIMEOUT_CONEXAO', default=5.0, cast=float)
+TIMEOUT_LEITURA = config('SERPRO_TIMEOUT_LEITURA', default=60.0, cast=float)
+TENTATIVAS = config('SERPRO_TENTATIVAS', default=4, cast=int)
+BACKOFF_BASE = config('SERPRO_BACKOFF_BASE', default=0.5, cast=float)
+BACKOFF_MAXIMO = config('SERPRO_BACKOFF_MAXIMO', default=30.0, cast=float)
+
+CIRCUITO_LIMIAR = config('SERPRO_CIRCUITO_LIMIAR', default=0.5, cast=float)
+CIRCUITO_MINIMO = config('SERPRO_CIRCUITO_MINIMO', default=10, cast=int)
+CIRCUITO_JANELA = config('SERPRO_CIRCUITO_JANELA', default=60.0, cast=float)
+CIRCUITO_PAUSA = config('SERPRO_CIRCUITO_PAUSA', default=30.0, cast=float)
+
+# Timeout no formato aceito pelo requests: (conexão, leitura)
+TIMEOUT = (TIMEOUT_CONEXAO, TIMEOUT_LEITURA)
+
+# Respostas do gateway que indicam falha transitória
+STATUS_RETENTAVEIS = frozenset({429, 500, 502, 503, 504})
+
+
+# ===========================================
+# CONTADORES
+# ===========================================
+
+class Contadores:
+    """
+    Conjunto de contadores nomeados, seguro para uso entre threads.
+    Com `metrica`, cada incremento também é exportado em `/metrics`, com o nome no rótulo "evento".
+    """
+
+    def __init__(self, nomes=(), metrica=None):
+        self._valores = {nome: 0 for nome in nomes}
+        self._lock = threading.Lock()
+        self.metrica = metrica
+
+    def incrementar(self, nome, quantidade=1):
+        with self._lock:
+            self._valores[nome] = self._valores.get(nome, 0) + quantidade
+        if self.metrica is not None:
+            self.metrica.inc(quantidade, evento=nome)
+
+    def valores(self):
+        """
+        Retorna uma cópia dos contadores.
+        """
+        with self._lock:
+            return dict(self._valores)
+
+
+contadores = Contadores([
+    'chamadas', 'tentativas', 'retentativas', 'sucessos', 'falhas',
+    'timeouts', 'erros_conexao', 'respostas_429', 'respostas_5xx',
+    'renovacoes_token_401', 'rejeitadas_circuito_aberto'
+], metrica=Contador('serpro_resiliencia_eventos_total', 'Eventos de resiliência das chamadas ao SERPRO.', ['evento']))
+
+
+# ===========================================
+# BACKOFF
+# ===========================================
+
+def ler_retry_after(valor):
+    """
+    Interpreta o cabeçalho Retry-After (segundos ou data HTTP).
+
+    Retorna:
+        float | None: Segundos a aguardar, ou None se o valor for ausente ou inválido.
+    """
+    if not valor:
+        return None
+    try:
+        return max(0.0, float(valor))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(valor).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def calcular_espera(tentativa, retry_after=None, base=None, maximo=None):
+    """
+    Calcula a espera antes da próxima tentativa (backoff exponencial com "full jitter").
+
+    Parâmetros:
+        tentativa (int): Número da tentativa que falhou (0 para a primeira).
+        retry_after (float): Espera pedida pelo servidor; quando informada, é respeitada
+            como mínimo.
+        base (float): Espera base (padrão: SERPRO_BACKOFF_BASE).
+        maximo (float): Espera máxima (padrão: SERPRO_BACKOFF_MAXIMO).
+
+    Retorna:
+        float: Segundos a aguardar.
+    """
+    base = BACKOFF_BASE if base is None else base
+    maximo = BACKOFF_MAXIMO if maximo is None else maximo
+    espera = random.uniform(0, min(maximo, base * (2 ** tentativa)))
+    if retry_after is not None:
+        espera = max(espera, min(retry_after, maximo))
+    return espera
+
+
+# ===========================================
+# DISJUNTOR (CIRCUIT BREAKER)
+# ===========================================
+
+class DisjuntorCircuito:
+    """
+    Disjuntor por taxa de erros em uma janela deslizante de tempo.
+
+    Estados:
+        - "fechado": chamadas liberadas; falhas e sucessos são registrados na janela.
+        - "aberto": a taxa de falhas atingiu o limiar; chamadas são recusadas por `pausa` segundos.
+        - "meio_aberto": terminada a pausa, uma única chamada de teste (a sonda) é liberada e o
+          seu resultado decide: sucesso fecha o circuito, falha o abre novamente. As demais
+          chamadas são recusadas (ou aguardam, em `aguardar_fechamento`) até a decisão.
+    """
+
+    FECHADO = "fechado"
+    ABERTO = "aberto"
+    MEIO_ABERTO = "meio_aberto"
+
+    def __init__(self, limiar=CIRCUITO_LIMIAR, minimo=CIRCUITO_MINIMO, janela=CIRCUITO_JANELA,
+                 pausa=CIRCUITO_PAUSA):
+        """
+        Parâmetros:
+            limiar (float): Fração de falhas (0 a 1) que abre o circuito.
+            minimo (int): Chamadas mínimas na janela para avaliar o limiar.
+            janela (float): Janela de avaliação, em segundos.
+            pausa (float): Tempo, em segundos, que o circuito fica aberto.
+        """
+        self.limiar = limiar
+        self.minimo = minimo
+        self.janela = janela
+        self.pausa = pausa
+
+        self._estado = self.FECHADO
+        self._aberto_ate = 0.0
+        self._resultados = deque()
+        self._aberturas = 0
+        # Thread que faz a chamada de teste no estado meio aberto e o início dela
+        self._sonda = None
+        self._sonda_desde = 0.0
+        self._condicao = threading.Condition()
+
+    # -------------------------------------------
+    # Estado
+    # -------------------------------------------
+
+    def _atualizar(self, agora):
+        if self._estado == self.ABERTO and agora >= self._aberto_ate:
+            self._estado = self.MEIO_ABERTO
+            self._sonda = None
+            logging.info("Circuito do SERPRO meio aberto: liberando uma chamada de teste.")
+        if self._sonda is not None and agora - self._sonda_desde > self.pausa:
+            # A sonda não registrou resultado (ex.: thread interrompida): libera outra
+            self._sonda = None
+        while self._resultados and self._resultados[0][0] < agora - self.janela:
+            self._resultados.popleft()
+
+    @property
+    def estado(self):
+        with self._condicao:
+            self._atualizar(time.monotonic())
+            return self._estado
+
+    def _reservar_sonda(self, agora):
+        """
+        No estado meio aberto, reserva a chamada de teste para a thread atual.
+
+        Retorna:
+            bool: True se a thread atual pode fazer a chamada.
+        """
+        if self._estado != self.MEIO_ABERTO:
+            return self._estado == self.FECHADO
+        if self._sonda is None:
+            self._sonda = threading.get_ident()
+            self._sonda_desde = agora
+        return self._sonda == threading.get_ident()
+
+    def _abrir(self, agora):
+        self._estado = self.ABERTO
+        self._aberto_ate = agora + self.pausa
+        self._resultados.clear()
+        self._aberturas += 1
+        logging.warning(f"Circuito do SERPRO aberto por {self.pausa:.0f}s: taxa de erros acima de "
+                        f"{self.limiar:.0%}.")
+
+    # -------------------------------------------
+    # Uso pelas chamadas
+    # -------------------------------------------
+
+    def permitir(self):
+        """
+        Informa se uma chamada pode ser feita agora.
+
+        Retorna:
+            bool: False enquanto o circuito estiver aberto ou, no estado meio aberto,
+                se a chamada de teste já pertencer a outra thread.
+        """
+        with self._condicao:
+            agora = time.monotonic()
+            self._atualizar(agora)
+            if not self._reservar_sonda(agora):
+                contadores.incrementar('rejeitadas_circuito_aberto')
+                return False
+            return True
+
+    def aguardar_fechamento(self, timeout=None):
+        """
+        Bloqueia enquanto o circuito estiver aberto. No estado meio aberto, apenas a thread
+        que obtém a chamada de teste é liberada; as demais aguardam o resultado dela.
+
+        Parâmetros:
+            timeout (float): Espera máxima, em segundos (padrão: sem limite).
+
+        Retorna:
+            bool: True se o circuito permite chamadas ao retornar.
+        """
+        limite = None if timeout is None else time.monotonic() + timeout
+        with self._condicao:
+            while True:
+                agora = time.monotonic()
+                self._atualizar(agora)
+                if self._reservar_sonda(agora):
+                    return True
+                if self._estado == self.ABERTO:
+                    espera = self._aberto_ate - agora
+                else:
+                    espera = self._sonda_desde + self.pausa - agora
+                if limite is not None:
+                    if agora >= limite:
+                        return False
+                    espera = min(espera, limite - agora)
+                self._condicao.wait(espera)
+
+    def registrar_sucesso(self):
+        with self._condicao:
+            agora = time.monotonic()
+            self._atualizar(agora)
+            if self._estado == self.MEIO_ABERTO:
+                self._estado = self.FECHADO
+                self._sonda = None
+                logging.info("Circuito do SERPRO fechado.")
+            self._resultados.append((agora, True))
+            self._condicao.notify_all()
+
+    def registrar_falha(self):
+        with self._condicao:
+            agora = time.monotonic()
+            self._atualizar(agora)
+            if self._estado == self.MEIO_ABERTO:
+                self._sonda = None
+                self._abrir(agora)
+                self._condicao.notify_all()
+                return
+            if self._estado == self.ABERTO:
+                return
+
+            self._resultados.append((agora, False))
+            falhas = sum(1 for _, sucesso in self._resultados if not sucesso)
+            if len(self._resultados) >= self.minimo and falhas / len(self._resultados) >= self.limiar:
+                self._abrir(agora)
+
+    def registrar_indefinido(self):
+        """
+        Encerra uma chamada sem resultado que indique a saúde do SERPRO (ex.: falha de
+        autenticação): a janela não muda e, no estado meio aberto, a chamada de teste é
+        liberada para outra thread.
+        """
+        with self._condicao:
+            if self._sonda == threading.get_ident():
+                self._sonda = None
+                self._condicao.notify_all()
+
+    def estatisticas(self):
+        """
+        Retorna o estado do circuito e os números da janela atual.
+        """
+        with self._condicao:
+            agora = time.monotonic()
+            self._atualizar(agora)
+            falhas = sum(1 for _, sucesso in self._resultados if not sucesso)
+            return {
+                "estado": self._estado,
+                "aberturas": self._aberturas,
+                "chamadas_janela": len(self._resultados),
+                "falhas_janela": falhas,
+                "reabre_em": round(max(0.0, self._aberto_ate - agora), 1) if self._estado == self.ABERTO else None
+            }
+
+
+disjuntor = DisjuntorCircuito()
+
+CIRCUITO_ABERTO = Medidor('serpro_circuito_aberto', 'Circuito do SERPRO por contratante: 1 aberto, '
+                          '0.5 meio aberto, 0 fechado.', ['contratante'])
+
+
+def _coletar_circuitos():
+    """
+    Atualiza o estado do circuito de cada contratante (CNPJ) antes da exportação de /metrics.
+    """
+    # Importado aqui: `contratantes` depende deste módulo
+    from contratantes import registro_contratantes
+
+    for cnpj, contratante in registro_contratantes().contratantes.items():
+        CIRCUITO_ABERTO.definir(
+            {DisjuntorCircuito.ABERTO: 1, DisjuntorCircuito.MEIO_ABERTO: 0.5}.get(contratante.disjuntor.estado, 0),
+            contratante=cnpj
+        )
+
+
+REGISTRO.registrar_coletor(_coletar_circuitos)
+
+
+def estatisticas_resiliencia():
+    """
+    Retorna os contadores de resiliência das chamadas ao SERPRO e o estado do circuito.
+
+    Retorna:
+        dict: {"contadores": {...}, "circuito": {...}}
+    """
+    return {"contadores": contadores.valores(), "circuito": disjuntor.estatisticas()}
@@ -1,7 +1,12 @@
 import base64
+import json
+import os
+import threading
 import time
 import logging
-from requests_pkcs12 import post  # Requisições HTTPS com certificado digital
+from clientes_http import obter_sessao_autenticacao  # Sessão HTTPS com certificado digital
+from resiliencia import TIMEOUT  # Timeouts de conexão e leitura
+from metricas import cronometrar, DURACAO_FUNCAO, TOKEN_CACHE  # Métricas expostas em /metrics
 from decouple import config  # Para carregar variáveis do .env
 from dotenv import load_dotenv  # Para carregar o .env no ambiente
 
@@ -12,55 +17,283 @@ from dotenv import load_dotenv  # Para carregar o .env no ambiente
 # Carrega as variáveis de ambiente do arquivo .env
 load_dotenv()
 
-# Configuração básica de logging para exibir logs no console
-logging.basicConfig(level=logging.INFO)
+# ===========================================
+# CONFIGURAÇÃO DO CACHE DE TOKEN
+# ===========================================
+
+# Segundos antes da expiração em que o token deixa de ser usado
+MARGEM_EXPIRACAO = config('SERPRO_TOKEN_MARGEM_EXPIRACAO', default=30, cast=int)
+
+# Segundos antes da expiração em que o token é renovado em segundo plano
+MARGEM_RENOVACAO = config('SERPRO_TOKEN_MARGEM_RENOVACAO', default=300, cast=int)
+
+# Arquivo opcional para compartilhar o token entre processos (ex.: workers do gunicorn)
+ARQUIVO_TOKEN = config('SERPRO_TOKEN_ARQUIVO', default='')
+
+# URL do endpoint de autenticação (alterável para apontar para um servidor de testes)
+AUTH_URL = config('SERPRO_AUTH_URL', default='https://autenticacao.sapi.serpro.gov.br/authenticate')
+
 
 # ===========================================
-# CACHE PARA TOKEN DE AUTENTICAÇÃO
+# ARMAZENAMENTO COMPARTILHADO DO TOKEN
 # ===========================================
-token_cache = {
-    "access_token": None,  # Token de acesso
-    "expires_in": None,    # Tempo de expiração (segundos)
-    "timestamp": None      # Registro de tempo para validar expiração
-}
+
+class ArmazenamentoTokenArquivo:
+    """
+    Guarda o token em um arquivo JSON para que vários processos reutilizem o mesmo token.
+
+    A escrita é atômica (arquivo temporário + `os.replace`) e a renovação entre processos
+    é serializada por um arquivo de trava criado com `O_EXCL`, que funciona em Linux e Windows.
+    """
+
+    def __init__(self, caminho, trava_expiracao=60):
+        """
+        Parâmetros:
+            caminho (str): Caminho do arquivo JSON do token.
+            trava_expiracao (int): Segundos após os quais uma trava abandonada é descartada.
+        """
+        self.caminho = caminho
+        self.caminho_trava = f"{caminho}.lock"
+        self.trava_expiracao = trava_expiracao
+
+    def carregar(self):
+        """
+        Retorna o token salvo, ou None se o arquivo não existir ou estiver ilegível.
+        """
+        try:
+            with open(self.caminho, 'r', encoding='utf8') as arquivo:
+                return json.load(arquivo)
+        except (OSError, ValueError):
+            return None
+
+    def salvar(self, token):
+        """
+        Grava o token de forma atômica.
+        """
+        temporario = f"{self.caminho}.{os.getpid()}.tmp"
+        with open(temporario, 'w', encoding='utf8') as arquivo:
+            json.dump(token, arquivo)
+        os.replace(temporario, self.caminho)
+
+    def travar(self, timeout=30):
+        """
+        Obtém a trava entre processos, aguardando até `timeout` segundos.
+
+        Retorna:
+            bool: True se a trava foi obtida.
+        """
+        limite = time.monotonic() + timeout
+        while time.monotonic() < limite:
+            try:
+                os.close(os.open(self.caminho_trava, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                return True
+            except FileExistsError:
+                try:
+                    if time.time() - os.path.getmtime(self.caminho_trava) > self.trava_expiracao:
+                        os.remove(self.caminho_trava)
+                        continue
+                except OSError:
+                    continue
+                time.sleep(0.1)
+        return False
+
+    def destravar(self):
+        try:
+            os.remove(self.caminho_trava)
+        except OSError:
+            pass
 
 
 # ===========================================
-# FUNÇÃO PARA OBTER TOKEN DE AUTENTICAÇÃO
+# GERENCIADOR DE TOKEN
 # ===========================================
-def obter_token_autenticacao():
+
+class GerenciadorToken:
     """
-    Obtém o token de autenticação do SERPRO.
+    Cache do token de autenticação, seguro para uso entre threads.
 
-    Retorna:
-        tuple: (access_token, jwt_token) em caso de sucesso.
-        Exception: Lança exceção em caso de erro.
+    - Single-flight: apenas uma thread autentica por vez; as demais aguardam e
+      reutilizam o token obtido.
+    - Renovação antecipada: o token é renovado em segundo plano MARGEM_RENOVACAO
+      segundos antes de expirar, de modo que as requisições não pagam a latência
+      da autenticação mTLS.
+    - Armazenamento opcional: com SERPRO_TOKEN_ARQUIVO, o token é compartilhado
+      entre processos.
     """
 
-    # Verifica se o token armazenado ainda é válido
-    if token_cache["access_token"] and token_cache["expires_in"] and token_cache["timestamp"]:
-        # Calcula o tempo desde que o token foi gerado
-        tempo_passado = time.time() - token_cache["timestamp"]
-        # Se o token for válido (faltando pelo menos 30 segundos para expirar), reutiliza-o
-        if tempo_passado < (token_cache["expires_in"] - 30):
-            logging.info("Utilizando token em cache")
-            return token_cache["access_token"], token_cache["jwt_token"]
+    def __init__(self, autenticar, armazenamento=None, margem_expiracao=MARGEM_EXPIRACAO,
+                 margem_renovacao=MARGEM_RENOVACAO):
+        """
+        Parâmetros:
+            autenticar (callable): Função que autentica no SERPRO e retorna o JSON da resposta.
+            armazenamento (ArmazenamentoTokenArquivo): Armazenamento compartilhado opcional.
+            margem_expiracao (int): Segundos antes da expiração em que o token deixa de ser usado.
+            margem_renovacao (int): Segundos antes da expiração em que o token é renovado.
+        """
+        self.autenticar = autenticar
+        self.armazenamento = armazenamento
+        self.margem_expiracao = margem_expiracao
+        self.margem_renovacao = margem_renovacao
 
-    # ===========================================
-    # CONFIGURAÇÃO DE CREDENCIAIS E CERTIFICADO
-    # ===========================================
+        self._token = None
+        self._condicao = threading.Condition()
+        self._renovando = False
+        self._erro = None
+        self._timer = None
+        self._invalidado = None
 
-    # URL do endpoint de autenticação
-    url = "https://autenticacao.sapi.serpro.gov.br/authenticate"
+    # -------------------------------------------
+    # Validação do token
+    # -------------------------------------------
+
+    def _valido(self, token, margem):
+        return bool(token and token.get("access_token") and time.time() < token["expira_em"] - margem)
+
+    # -------------------------------------------
+    # Obtenção do token
+    # -------------------------------------------
+
+    def obter(self):
+        """
+        Retorna um token válido, autenticando apenas se necessário.
+
+        Retorna:
+            tuple: (access_token, jwt_token)
+
+        Exceções:
+            Exception: Se a autenticação falhar.
+        """
+        with self._condicao:
+            while True:
+                if self._valido(self._token, self.margem_expiracao):
+                    logging.debug("Utilizando token em cache")
+                    TOKEN_CACHE.inc(resultado='hit')
+                    return self._token["access_token"], self._token["jwt_token"]
+
+                if not self._renovando:
+                    break
+
+                # Outra thread já está autenticando: aguarda o resultado dela
+                self._condicao.wait()
+                if self._erro and not self._valido(self._token, self.margem_expiracao):
+                    raise Exception(f"Erro ao autenticar: {self._erro}")
+
+            self._renovando = True
+            self._erro = None
+
+        TOKEN_CACHE.inc(resultado='miss')
+        self._renovar()
+
+        with self._condicao:
+            if self._erro:
+                raise Exception(f"Erro ao autenticar: {self._erro}")
+            return self._token["access_token"], self._token["jwt_token"]
+
+    def invalidar(self):
+        """
+        Descarta o token em cache (ex.: após uma resposta 401 do gateway).
+        """
+        with self._condicao:
+            if self._token:
+                self._invalidado = self._token["access_token"]
+            self._token = None
+
+    # -------------------------------------------
+    # Renovação
+    # -------------------------------------------
+
+    def _renovar(self):
+        """
+        Obtém um novo token, consultando antes o armazenamento compartilhado.
+        Deve ser chamada apenas pela thread que marcou `_renovando`.
+        """
+        token = None
+        erro = None
+        travado = False
+
+        try:
+            if self.armazenamento:
+                travado = self.armazenamento.travar()
+                # Outro processo pode ter renovado o token enquanto aguardávamos a trava
+                salvo = self.armazenamento.carregar()
+                if self._valido(salvo, self.margem_renovacao) and salvo["access_token"] != self._invalidado:
+                    logging.info("Utilizando token do armazenamento compartilhado")
+                    token = salvo
 
-    # Caminho e informações do certificado digital
-    caminho_certificado = config('CAMINHO_CERTIFICADO')  # Caminho para o certificado
-    certificado = f"{caminho_certificado}/{config('NOME_CERTIFICADO')}"  # Nome do arquivo PFX
-    senha_certificado = config('SENHA_CERTIFICADO')  # Senha do certificado
+            if token is None:
+                resposta = self.autenticar()
+                token = {
+                    "access_token": resposta.get("access_token"),
+                    "jwt_token": resposta.get("jwt_token"),
+                    "expira_em": time.time() + (resposta.get("expires_in") or 0)
+                }
+                if self.armazenamento:
+                    self.armazenamento.salvar(token)
+                logging.info("Token obtido com sucesso")
 
-    # Credenciais do consumidor para autenticação na API
-    consumer_key = config('CONSUMER_KEY')  # Chave do consumidor
-    consumer_secret = config('CONSUMER_SECRET')  # Segredo do consumidor
+        except Exception as e:
+            logging.error("Erro ao obter token de autenticação: %s", e)
+            erro = e
+
+        finally:
+            if travado:
+                self.armazenamento.destravar()
+
+        with self._condicao:
+            if token is not None:
+                self._token = token
+            self._erro = erro
+            self._renovando = False
+            self._condicao.notify_all()
+
+        if token is not None:
+            self._agendar_renovacao(token)
+
+    def _agendar_renovacao(self, token):
+        """
+        Agenda a renovação do token em segundo plano antes que ele expire.
+        """
+        espera = token["expira_em"] - self.margem_renovacao - time.time()
+        if espera <= 0:
+            return
+
+        if self._timer:
+            self._timer.cancel()
+        self._timer = threading.Timer(espera, self._renovar_em_segundo_plano)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _renovar_em_segundo_plano(self):
+        with self._condicao:
+            if self._renovando:
+                return
+            self._renovando = True
+            self._erro = None
+
+        logging.info("Renovando token em segundo plano")
+        self._renovar()
+
+
+# ===========================================
+# AUTENTICAÇÃO NO SERPRO
+# ===========================================
+def autenticar(certificado, senha_certificado, consumer_key, consumer_secret):
+    """
+    Autentica no SERPRO com o certificado digital de um contratante.
+
+    Parâmetros:
+        certificado (str): Caminho do arquivo PFX.
+        senha_certificado (str): Senha do certificado.
+        consumer_key (str): Chave do consumidor na API.
+        consumer_secret (str): Segredo do consumidor na API.
+
+    Retorna:
+        dict: JSON da resposta, com access_token, jwt_token e expires_in.
+        Exception: Lança exceção em caso de erro.
+    """
+
+    # URL do endpoint de autenticação
+    url = AUTH_URL
 
     # ===========================================
     # CABEÇALHOS E CORPO DA REQUISIÇÃO
@@ -78,37 +311,46 @@ def obter_token_autenticacao():
     # ===========================================
     # ENVIO DA REQUISIÇÃO PARA O SERVIDOR
     # ===========================================
-    try:
-        # Envia a requisição POST usando o certificado digital
-        response = post(
-            url,
-            data=body,
-            headers=headers,
-            verify=True,  # Habilita validação SSL
-            pkcs12_filename=certificado,  # Caminho do certificado PFX
-            pkcs12_password=senha_certificado  # Senha do certificado
-        )
-
-        # Levanta erro se a resposta não for bem-sucedida (status 200)
-        response.raise_for_status()
-
-        # ===========================================
-        # TRATAMENTO DA RESPOSTA
-        # ===========================================
-        response_data = response.json()
-
-        # Armazena os tokens no cache para reutilização
-        token_cache["access_token"] = response_data.get("access_token")
-        token_cache["jwt_token"] = response_data.get("jwt_token")
-        token_cache["expires_in"] = response_data.get("expires_in")
-        token_cache["timestamp"] = time.time()  # Marca o momento em que o token foi obtido
-
-        logging.info("Token obtido com sucesso")
-
-        # Retorna o token de acesso e o JWT token
-        return token_cache["access_token"], token_cache["jwt_token"]
-
-    except Exception as e:
-        # Em caso de erro, registra no log e lança exceção
-        logging.error(f"Erro ao obter token de autenticação: {e}")
-        raise Exception(f"Erro ao autenticar: {e}")
+
+    # Envia a requisição POST pela sessão mTLS, que mantém o certificado carregado
+    sessao = obter_sessao_autenticacao(certificado, senha_certificado)
+    response = sessao.post(
+        url,
+        data=body,
+        headers=headers,
+        verify=True,  # Habilita validação SSL
+        timeout=TIMEOUT
+    )
+
+    # Levanta erro se a resposta não for bem-sucedida (status 200)
+    response.raise_for_status()
+
+    return response.json()
+
+
+# ===========================================
+# FUNÇÃO PARA OBTER TOKEN DE AUTENTICAÇÃO
+# ===========================================
+@cronometrar(DURACAO_FUNCAO, funcao='obter_token_autenticacao')
+def obter_token_autenticacao(contratante=None):
+    """
+    Obtém o token de autenticação do SERPRO de um contratante, reutilizando o token em cache
+    enquanto válido. Cada contratante tem o seu próprio cache (ver `contratantes.py`).
+
+    Parâmetros:
+        contratante (Contratante | str): Contratante ou seu CNPJ (padrão: contratante padrão).
+
+    Retorna:
+        tuple: (access_token, jwt_token) em caso de sucesso.
+        Exception: Lança exceção em caso de erro.
+    """
+    from contratantes import obter_contratante
+    return obter_contratante(contratante).token.obter()
+
+
+def invalidar_token_autenticacao(contratante=None):
+    """
+    Descarta o token em cache do contratante, forçando uma nova autenticação na próxima chamada.
+    """
+    from contratantes import obter_contratante
+    obter_contratante(contratante).token.invalidar()
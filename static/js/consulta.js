@@ -1,19 +1,96 @@
  function filtrar() {
             const contribuinte = document.querySelector('input[name="contribuinte"]').value;
             const mes = document.querySelector('select[name="mes"]').value;
+            const ano = document.querySelector('input[name="ano"]').value;
 
             let queryString = "/consulta?";
             if (contribuinte) {
-                queryString += contribuinte=${contribuinte}&;
+                queryString += `contribuinte=${encodeURIComponent(contribuinte)}&`;
             }
             if (mes) {
-                queryString += mes=${mes}&;
+                queryString += `mes=${mes}&`;
+            }
+            if (ano) {
+                queryString += `ano=${ano}&`;
             }
 
             window.location.href = queryString;
         }
 
-        // Função para baixar todos os PDFs em lote
+        // Função para baixar os PDFs em lote, respeitando os filtros da página
         function baixarTodos() {
-            window.location.href = '/baixar_todos_recibos';
-        }
\ No newline at end of file
+            window.location.href = '/baixar_todos_recibos' + window.location.search;
+        }
+        // Guias marcadas para download, mantidas entre as páginas da consulta
+        const CHAVE_SELECAO = 'guiasSelecionadas';
+
+        function lerSelecao() {
+            return new Set(JSON.parse(sessionStorage.getItem(CHAVE_SELECAO) || '[]'));
+        }
+
+        function gravarSelecao(selecao) {
+            sessionStorage.setItem(CHAVE_SELECAO, JSON.stringify([...selecao]));
+            document.getElementById('quantidade-selecionados').textContent = selecao.size;
+            document.getElementById('baixar-selecionados').disabled = selecao.size === 0;
+        }
+
+        function atualizarSelecionarTodos() {
+            const caixas = [...document.querySelectorAll('.selecao-guia')];
+            const todos = document.getElementById('selecionar-todos');
+            todos.checked = caixas.length > 0 && caixas.every(caixa => caixa.checked);
+            todos.indeterminate = !todos.checked && caixas.some(caixa => caixa.checked);
+        }
+
+        // Baixa um ZIP apenas com as guias selecionadas. O formulário POST faz o navegador
+        // receber o ZIP em streaming, como um download comum.
+        function baixarSelecionados() {
+            const selecao = lerSelecao();
+            if (selecao.size === 0) {
+                return;
+            }
+
+            const formulario = document.createElement('form');
+            formulario.method = 'POST';
+            formulario.action = '/baixar_recibos_selecionados';
+
+            const campo = document.createElement('input');
+            campo.type = 'hidden';
+            campo.name = 'ids';
+            campo.value = [...selecao].join(',');
+            formulario.appendChild(campo);
+
+            document.body.appendChild(formulario);
+            formulario.submit();
+            formulario.remove();
+
+            gravarSelecao(new Set());
+            document.querySelectorAll('.selecao-guia').forEach(caixa => { caixa.checked = false; });
+            atualizarSelecionarTodos();
+        }
+
+        document.addEventListener('DOMContentLoaded', () => {
+            const selecao = lerSelecao();
+
+            document.querySelectorAll('.selecao-guia').forEach(caixa => {
+                caixa.checked = selecao.has(caixa.value);
+                caixa.addEventListener('change', () => {
+                    const atual = lerSelecao();
+                    caixa.checked ? atual.add(caixa.value) : atual.delete(caixa.value);
+                    gravarSelecao(atual);
+                    atualizarSelecionarTodos();
+                });
+            });
+
+            document.getElementById('selecionar-todos').addEventListener('change', evento => {
+                const atual = lerSelecao();
+                document.querySelectorAll('.selecao-guia').forEach(caixa => {
+                    caixa.checked = evento.target.checked;
+                    caixa.checked ? atual.add(caixa.value) : atual.delete(caixa.value);
+                });
+                gravarSelecao(atual);
+                atualizarSelecionarTodos();
+            });
+
+            gravarSelecao(selecao);
+            atualizarSelecionarTodos();
+        });
@@ -60,9 +60,9 @@
 
                 // Mostrar a mensagem específica do erro, se houver
                 if (body.mensagem) {
-                    errorMessage.innerText = Erro ao enviar: ${body.mensagem};
+                    errorMessage.innerText = `Erro ao enviar: ${body.mensagem}`;
                 } else if (body.error) {
-                    errorMessage.innerText = Erro ao enviar: ${body.error};
+                    errorMessage.innerText = `Erro ao enviar: ${body.error}`;
                 } else {
                     errorMessage.innerText = "Erro ao enviar. Por favor, tente novamente.";
                 }
@@ -99,46 +99,172 @@
         detailedMessage.style.display = "none";
         batchSubmitButton.disabled = true;
 
-        fetch('/enviar_em_lote', {
-            method: 'POST',
-            body: formData
-        }).then(response => {
-            if (!response.ok) {
-                throw new Error("Erro ao enviar o arquivo.");
-            }
-            return response.json();
-        })
-        .then(data => {
+        // Monta uma linha "Rótulo: valor - ..." com nós de texto: os valores vêm da planilha
+        // e do SERPRO e nunca são interpretados como HTML
+        function linhaCampos(campos) {
+            const fragmento = document.createDocumentFragment();
+            campos.forEach(([rotulo, valor], indice) => {
+                if (indice > 0) {
+                    fragmento.append(" - ");
+                }
+                const negrito = document.createElement("strong");
+                negrito.textContent = `${rotulo}:`;
+                fragmento.append(negrito, ` ${valor}`);
+            });
+            fragmento.append(document.createElement("br"));
+            return fragmento;
+        }
+
+        function titulo(texto) {
+            const negrito = document.createElement("b");
+            negrito.textContent = texto;
+            const fragmento = document.createDocumentFragment();
+            fragmento.append(negrito, document.createElement("br"));
+            return fragmento;
+        }
+
+        function formatarResultado(result) {
+            return linhaCampos([["CNPJ", result.CNPJ], ["Status", result.status], ["Mensagem", result.mensagem]]);
+        }
+
+        function exibirProgresso(progresso) {
+            batchMessage.innerText = `Envio em lote em andamento: ${progresso.processados} de ${progresso.total} linhas processadas...`;
+        }
+
+        function exibirConclusao(progresso) {
             batchMessage.classList.remove("alert-info");
+            batchMessage.classList.add("alert-success");
+            batchMessage.innerText = `Envio em lote concluído! ${progresso.concluidos} guias geradas, ${progresso.erros} erros.`;
+            batchSubmitButton.disabled = false;
+        }
+
+        // Exibe o resumo final do lote
+        function exibirResumo(progresso) {
+            detailedMessage.replaceChildren(titulo("Resumo do envio:"));
+            progresso.resultados.forEach(result => {
+                detailedMessage.append(formatarResultado(result));
+            });
+            detailedMessage.append(listarRejeitadas(rejeitadas, totalRejeitadas));
+            detailedMessage.style.display = "block";
+            exibirConclusao(progresso);
+        }
+
+        // Consulta periodicamente o progresso do lote até a conclusão
+        function acompanharLote(progressoUrl) {
+            fetch(progressoUrl)
+            .then(response => {
+                if (!response.ok) {
+                    throw new Error("Erro ao consultar o progresso do lote.");
+                }
+                return response.json();
+            })
+            .then(progresso => {
+                if (progresso.status === "Concluído") {
+                    return fetch(`${progressoUrl}?detalhes=1`)
+                        .then(response => response.json())
+                        .then(exibirResumo);
+                }
+
+                exibirProgresso(progresso);
+                setTimeout(() => acompanharLote(progressoUrl), 2000);
+            })
+            .catch(exibirErro);
+        }
+
+        // Acompanha o lote pelos eventos do servidor, exibindo cada linha assim que é processada
+        function acompanharEventos(eventosUrl, progressoUrl) {
+            const lista = document.createElement("div");
+            lista.id = "batchResultados";
+            detailedMessage.replaceChildren(titulo("Resumo do envio:"), lista, listarRejeitadas(rejeitadas, totalRejeitadas));
+            detailedMessage.style.display = "block";
 
-            if (data.message === "Envio em lote concluído") {
-                batchMessage.classList.add("alert-success");
-                batchMessage.innerText = "Envio em lote concluído com sucesso!";
+            // Após uma reconexão, o servidor pode reenviar linhas já exibidas
+            const exibidas = new Set();
+            const fonte = new EventSource(eventosUrl);
 
-                let detalhes = "<b>Resumo do envio:</b><br>";
-                data.resultados.forEach(result => {
-                    detalhes += <strong>CNPJ:</strong> ${result.CNPJ} - <strong>Status:</strong> ${result.status} - <strong>Mensagem:</strong> ${result.mensagem}<br>;
+            fonte.addEventListener("linhas", event => {
+                const novas = document.createDocumentFragment();
+                JSON.parse(event.data).forEach(result => {
+                    if (!exibidas.has(result.linha)) {
+                        exibidas.add(result.linha);
+                        novas.append(formatarResultado(result));
+                    }
                 });
+                lista.append(novas);
+            });
 
-                detailedMessage.innerHTML = detalhes;
-                detailedMessage.style.display = "block";
-            } else {
-                batchMessage.classList.add("alert-danger");
-                batchMessage.innerText = "Erro ao iniciar o envio em lote.";
-                detailedMessage.innerHTML = "";
-                detailedMessage.style.display = "none";
+            fonte.addEventListener("progresso", event => exibirProgresso(JSON.parse(event.data)));
+
+            fonte.addEventListener("fim", event => {
+                fonte.close();
+                exibirConclusao(JSON.parse(event.data));
+            });
+
+            // O navegador reconecta sozinho; se a conexão for recusada, volta à consulta periódica
+            fonte.onerror = () => {
+                if (fonte.readyState === EventSource.CLOSED) {
+                    acompanharLote(progressoUrl);
+                }
+            };
+        }
+
+        // Linhas da planilha recusadas na validação, antes do envio ao SERPRO
+        let rejeitadas = [];
+        let totalRejeitadas = 0;
+
+        function listarRejeitadas(linhas, total) {
+            const fragmento = document.createDocumentFragment();
+            if (!total) {
+                return fragmento;
             }
-        })
-        .catch(error => {
+            fragmento.append(document.createElement("br"), titulo(`Linhas rejeitadas (${total}):`));
+            linhas.forEach(erro => {
+                fragmento.append(linhaCampos([["Linha", erro.linha], ["CNPJ", erro.CNPJ], ["Motivo", erro.mensagem]]));
+            });
+            if (total > linhas.length) {
+                fragmento.append(`... e mais ${total - linhas.length} linhas.`, document.createElement("br"));
+            }
+            return fragmento;
+        }
+
+        function exibirErro(error) {
             console.error("Erro ao enviar o arquivo:", error);
             batchMessage.classList.remove("alert-info");
             batchMessage.classList.add("alert-danger");
             batchMessage.innerText = "Erro ao enviar o arquivo. Verifique os detalhes abaixo.";
 
-            detailedMessage.innerHTML = "Não foi possível iniciar o envio. Verifique o arquivo e tente novamente.";
+            detailedMessage.replaceChildren(
+                error.detalhe || "Não foi possível iniciar o envio. Verifique o arquivo e tente novamente.",
+                listarRejeitadas(error.rejeitadas || [], error.totalRejeitadas || 0)
+            );
             detailedMessage.style.display = "block";
-        })
-        .finally(() => {
             batchSubmitButton.disabled = false; // Reabilitar botão
-        });
-    });
\ No newline at end of file
+        }
+
+        fetch('/enviar_em_lote', {
+            method: 'POST',
+            body: formData
+        }).then(response => {
+            return response.json().then(data => {
+                if (!response.ok) {
+                    const erro = new Error("Erro ao enviar o arquivo.");
+                    erro.detalhe = data.error;
+                    erro.rejeitadas = data.rejeitadas;
+                    erro.totalRejeitadas = data.total_rejeitadas;
+                    throw erro;
+                }
+                return data;
+            });
+        })
+        .then(data => {
+            rejeitadas = data.rejeitadas || [];
+            totalRejeitadas = data.total_rejeitadas || 0;
+            // O lote é processado em segundo plano; acompanha o progresso pelo identificador retornado
+            if (window.EventSource && data.eventos_url) {
+                acompanharEventos(data.eventos_url, data.progresso_url);
+            } else {
+                acompanharLote(data.progresso_url);
+            }
+        })
+        .catch(exibirErro);
+    });
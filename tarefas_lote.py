@@ -0,0 +1,692 @@
+"""
+Módulo: tarefas_lote.py
+
+Descrição:
+    Subsistema de envio em lote assíncrono.
+    O upload da planilha apenas registra o lote e suas linhas como requisições
+    "Pendente"; workers em segundo plano emitem as guias pelo motor de lote
+    e atualizam cada requisição com o resultado.
+
+    Como o estado fica no banco, um lote interrompido (queda do servidor,
+    reinício do processo) é retomado a partir das linhas ainda pendentes,
+    sem reemitir guias que já foram concluídas.
+
+    Cada linha é emitida pelo contratante da empresa (ver `contratantes.py`). As linhas
+    de cada contratante são processadas em paralelo, cada grupo com o limite de taxa e o
+    disjuntor do seu contratante, de modo que o throttling de um não atrasa os outros.
+
+Configuração (.env):
+    SERPRO_LOTE_HEARTBEAT_EXPIRACAO: segundos sem sinal do worker para que
+        um lote seja considerado órfão e retomado (padrão: 60).
+    SERPRO_LOTE_SUPERVISOR_INTERVALO: intervalo, em segundos, da varredura
+        de lotes órfãos (padrão: 30).
+    SERPRO_LOTE_COMMIT_LINHAS: resultados acumulados antes de cada gravação (padrão: 50).
+    SERPRO_LOTE_COMMIT_MS: tempo máximo, em milissegundos, que um resultado
+        aguarda no buffer antes de ser gravado (padrão: 1000).
+    SERPRO_LOTE_EVENTOS_INTERVALO: intervalo, em segundos, entre as leituras do banco
+        nos eventos de progresso (padrão: 1).
+    SERPRO_LOTE_EVENTOS_HEARTBEAT: segundos sem eventos até o envio de um sinal de
+        vida, que mantém a conexão aberta em proxies (padrão: 15).
+"""
+import datetime
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from decouple import config
+from sqlalchemy import delete, func, insert, or_, update
+from models import Session, Requisicao, Lote
+from cache_emissao import ResultadoEmissao, chave_emissao, emitir_guia, liberar_reservas
+from lote import executar_em_lote
+from empresas import normalizar_documento, contratantes_empresas
+from contratantes import obter_contratante
+from metricas import LINHAS_LOTE, DURACAO_GRAVACAO
+
+# ===========================================
+# CONFIGURAÇÃO
+# ===========================================
+
+HEARTBEAT_EXPIRACAO = config('SERPRO_LOTE_HEARTBEAT_EXPIRACAO', default=60, cast=int)
+SUPERVISOR_INTERVALO = config('SERPRO_LOTE_SUPERVISOR_INTERVALO', default=30, cast=int)
+COMMIT_LINHAS = config('SERPRO_LOTE_COMMIT_LINHAS', default=50, cast=int)
+COMMIT_MS = config('SERPRO_LOTE_COMMIT_MS', default=1000, cast=int)
+EVENTOS_INTERVALO = config('SERPRO_LOTE_EVENTOS_INTERVALO', default=1.0, cast=float)
+EVENTOS_HEARTBEAT = config('SERPRO_LOTE_EVENTOS_HEARTBEAT', default=15.0, cast=float)
+
+# Lotes em processamento neste processo
+_lotes_ativos = set()
+_lotes_lock = threading.Lock()
+_supervisor = None
+
+
+def _agora():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+# ===========================================
+# CRIAÇÃO DO LOTE
+# ===========================================
+
+def _linha_requisicao(row, indice, lote_id, tipo_contribuinte, data_envio):
+    """
+    Monta os valores de uma requisição pendente a partir de uma linha da planilha.
+    A linha registrada é a da planilha (LINHA), ou a posição no lote para linhas sem planilha.
+    """
+    contribuinte = normalizar_documento(row['CNPJ'])
+    valores = {
+        'contribuinte': contribuinte,
+        'tipo_contribuinte': tipo_contribuinte,
+        'id_sistema': str(row['ID_SISTEMA']),
+        'id_servico': str(row['ID_SERVICO']),
+        'data_envio': data_envio,
+        'status': "Pendente",
+        'response_message': None,
+        'data_resposta': None,
+        'parcela': None,
+        'chave_emissao': None,
+        'lote_id': lote_id,
+        'linha': int(row['LINHA']) if row.get('LINHA') is not None else indice,
+        'contratante': None
+    }
+    try:
+        parcela = row['PARCELA']
+        valores['parcela'] = parcela
+        valores['chave_emissao'] = chave_emissao(
+            contribuinte, tipo_contribuinte, valores['id_sistema'], valores['id_servico'], parcela
+        )
+    except ValueError as e:
+        valores['status'] = "Erro"
+        valores['response_message'] = str(e)
+        valores['data_resposta'] = data_envio
+    return valores
+
+
+def criar_lote(linhas, nome_arquivo=None, tipo_contribuinte=2, forcar_emissao=False, tamanho_bloco=1000):
+    """
+    Registra um novo lote e grava suas linhas como requisições pendentes.
+
+    As linhas são consumidas uma a uma e inseridas em blocos de `tamanho_bloco`,
+    sem montar objetos ORM, de modo que a memória não cresce com o tamanho da planilha.
+
+    Cada bloco é gravado em uma transação curta, com o lote no status "Recebendo": a
+    leitura e a validação da planilha acontecem fora da transação, sem bloquear os
+    demais escritores do banco (outros lotes, /gerar_das, reservas de emissão). Os
+    lotes "Recebendo" não são processados; o lote passa a "Pendente" após o último
+    bloco. Se a leitura falhar, o lote e as linhas já gravadas são descartados; um lote
+    sem linhas não é gravado.
+
+    Parâmetros:
+        linhas (iterable): Dicionários com as chaves CNPJ, ID_SISTEMA, ID_SERVICO, PARCELA
+            (AAAAMM) e, opcionalmente, LINHA (número da linha na planilha). Pode ser um gerador.
+        nome_arquivo (str): Nome da planilha de origem.
+        tipo_contribuinte (int): Tipo do contribuinte das linhas (padrão: 2 - CNPJ).
+        forcar_emissao (bool): Ignora o cache de emissão e solicita todas as guias ao SERPRO.
+        tamanho_bloco (int): Linhas por INSERT.
+
+    Retorna:
+        str: Identificador do lote criado, ou None se não houver linhas.
+    """
+    db = Session()
+    lote_id = uuid.uuid4().hex
+    try:
+        db.add(Lote(id=lote_id, nome_arquivo=nome_arquivo, status="Recebendo",
+                    forcar_emissao=forcar_emissao, heartbeat=_agora()))
+        db.commit()
+
+        agora = _agora()
+        total = 0
+        bloco = []
+        for indice, row in enumerate(linhas):
+            bloco.append(_linha_requisicao(row, indice, lote_id, tipo_contribuinte, agora))
+            if len(bloco) >= tamanho_bloco:
+                _gravar_bloco(db, lote_id, bloco)
+                total += len(bloco)
+                bloco = []
+        if bloco:
+            _gravar_bloco(db, lote_id, bloco)
+            total += len(bloco)
+
+        if not total:
+            _descartar_lote(db, lote_id)
+            return None
+
+        db.execute(update(Lote).where(Lote.id == lote_id).values(status="Pendente", total=total))
+        db.commit()
+        logging.info(f"Lote {lote_id} criado com {total} linhas.")
+        return lote_id
+    except Exception:
+        db.rollback()
+        _descartar_lote(db, lote_id)
+        raise
+    finally:
+        db.close()
+
+
+def _gravar_bloco(db, lote_id, bloco):
+    """
+    Grava um bloco de linhas do lote em recebimento e renova o seu sinal de vida.
+    """
+    _inserir_bloco(db, bloco)
+    db.execute(update(Lote).where(Lote.id == lote_id).values(heartbeat=_agora()))
+    db.commit()
+
+
+def _descartar_lote(db, lote_id):
+    """
+    Remove um lote cujo recebimento não terminou, com as linhas já gravadas.
+    """
+    try:
+        db.execute(delete(Requisicao).where(Requisicao.lote_id == lote_id))
+        db.execute(delete(Lote).where(Lote.id == lote_id))
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logging.error(f"Erro ao descartar o lote {lote_id}: {str(e)}")
+
+
+def _inserir_bloco(db, bloco):
+    """
+    Grava um bloco de linhas, com o contratante de cada empresa resolvido em uma única consulta.
+    """
+    contratantes = contratantes_empresas(db, {valores['contribuinte'] for valores in bloco})
+    for valores in bloco:
+        valores['contratante'] = contratantes.get(valores['contribuinte'])
+    db.execute(insert(Requisicao), bloco)
+
+
+# ===========================================
+# PROCESSAMENTO EM SEGUNDO PLANO
+# ===========================================
+
+def _reivindicar_lote(db, lote_id):
+    """
+    Marca o lote como em processamento por este worker.
+
+    A atualização é condicional: só tem efeito se o lote estiver pendente ou se o
+    worker anterior deixou de sinalizar há mais de SERPRO_LOTE_HEARTBEAT_EXPIRACAO
+    segundos. Assim, vários processos não retomam o mesmo lote ao mesmo tempo.
+
+    Retorna:
+        bool: True se o lote foi reivindicado.
+    """
+    limite = _agora() - datetime.timedelta(seconds=HEARTBEAT_EXPIRACAO)
+    resultado = db.execute(
+        update(Lote)
+        .where(Lote.id == lote_id)
+        .where(or_(
+            Lote.status == "Pendente",
+            (Lote.status == "Processando") & (or_(Lote.heartbeat.is_(None), Lote.heartbeat < limite))
+        ))
+        .values(status="Processando", heartbeat=_agora())
+    )
+    db.commit()
+    return resultado.rowcount == 1
+
+
+class GravadorLote:
+    """
+    Acumula os resultados das emissões de um lote e os grava em blocos.
+
+    Cada bloco é um único UPDATE em massa (executemany) seguido de um commit, em vez
+    de um commit por linha. O bloco é gravado quando atinge SERPRO_LOTE_COMMIT_LINHAS
+    resultados ou quando o resultado mais antigo aguarda há SERPRO_LOTE_COMMIT_MS.
+
+    Em caso de queda, perdem-se no máximo os resultados do bloco atual; essas linhas
+    continuam "Pendente" no banco e são reemitidas quando o lote for retomado.
+
+    Os métodos são seguros para uso entre threads (um motor de lote por contratante).
+    """
+
+    def __init__(self, db, lote_id, max_linhas=COMMIT_LINHAS, max_ms=COMMIT_MS):
+        self.db = db
+        self._lock = threading.RLock()
+        self.lote_id = lote_id
+        self.max_linhas = max_linhas
+        self.max_ms = max_ms
+        self._buffer = []
+        self._reservas = []
+        self._primeiro = None
+        self._ultimo_heartbeat = time.monotonic()
+
+    def adicionar(self, requisicao_id, resultado):
+        """
+        Registra o resultado de uma emissão e grava o bloco se o limite for atingido.
+
+        Parâmetros:
+            requisicao_id (int): ID da requisição pendente.
+            resultado (ResultadoEmissao): Resultado retornado por `emitir_guia`.
+        """
+        registro = {'id': requisicao_id, 'data_resposta': _agora()}
+
+        if resultado.pdf:
+            registro.update(Requisicao.campos_pdf(resultado.pdf))
+            registro.update(status="Concluído", response_message=resultado.mensagem)
+        else:
+            registro.update(status="Erro", response_message=resultado.mensagem or "Erro ao gerar o documento DAS")
+
+        with self._lock:
+            if not self._buffer:
+                self._primeiro = time.monotonic()
+            self._buffer.append(registro)
+            if resultado.reservada:
+                self._reservas.append(resultado.chave)
+            self.gravar_se_necessario()
+
+    def gravar_se_necessario(self):
+        """
+        Grava o bloco se ele atingiu o limite de linhas ou de tempo.
+
+        Sem resultados novos (ex.: motor pausado pelo disjuntor do SERPRO), apenas renova o
+        heartbeat, para que o lote não seja considerado órfão durante a pausa.
+        """
+        with self._lock:
+            if not self._buffer:
+                if time.monotonic() - self._ultimo_heartbeat >= HEARTBEAT_EXPIRACAO / 3:
+                    self.db.execute(update(Lote).where(Lote.id == self.lote_id).values(heartbeat=_agora()))
+                    self.db.commit()
+                    self._ultimo_heartbeat = time.monotonic()
+                return
+            if len(self._buffer) >= self.max_linhas or (time.monotonic() - self._primeiro) * 1000 >= self.max_ms:
+                self.gravar()
+
+    def gravar(self):
+        """
+        Grava todos os resultados acumulados em uma única transação.
+        """
+        with self._lock:
+            if not self._buffer:
+                return
+
+            inicio = time.perf_counter()
+            # Registros com e sem PDF têm colunas diferentes; cada grupo vira um executemany
+            com_pdf = [registro for registro in self._buffer if 'pdf' in registro]
+            sem_pdf = [registro for registro in self._buffer if 'pdf' not in registro]
+            for registros in (com_pdf, sem_pdf):
+                if registros:
+                    self.db.execute(update(Requisicao), registros)
+
+            # As guias emitidas passam a estar no cache: libera as reservas na mesma transação
+            liberar_reservas(self.db, self._reservas)
+            self.db.execute(update(Lote).where(Lote.id == self.lote_id).values(heartbeat=_agora()))
+            self.db.commit()
+            self._ultimo_heartbeat = time.monotonic()
+            DURACAO_GRAVACAO.observar(time.perf_counter() - inicio, operacao='resultados_lote')
+
+            logging.debug("Lote %s: %d resultados gravados.", self.lote_id, len(self._buffer))
+            self._buffer = []
+            self._reservas = []
+            self._primeiro = None
+
+
+def _emitir(item):
+    """
+    Emite a guia de uma requisição pendente. Executada nas threads do motor de lote.
+
+    Retorna:
+        ResultadoEmissao: Resultado da emissão (ou da guia reaproveitada do cache).
+    """
+    try:
+        return emitir_guia(
+            item['contribuinte'],
+            item['tipo_contribuinte'],
+            item['id_sistema'],
+            item['id_servico'],
+            item['parcela'],
+            forcar=item['forcar'],
+            forcar_desde=item['forcar_desde'],
+            contratante=item['contratante']
+        )
+    except Exception as e:
+        return ResultadoEmissao(
+            None, f"Erro ao processar o CNPJ {item['contribuinte']}: {str(e)}", None, False, False
+        )
+
+
+def _agrupar_por_contratante(pendentes, registrar_resultado):
+    """
+    Separa as linhas pendentes por contratante. Linhas de um contratante que não está mais
+    configurado são registradas como erro, sem chamada ao SERPRO.
+
+    Retorna:
+        list: [(Contratante, [linhas])]
+    """
+    grupos = {}
+    for indice, item in enumerate(pendentes):
+        try:
+            contratante = obter_contratante(item['contratante'])
+        except ValueError as e:
+            registrar_resultado(indice, item, ResultadoEmissao(None, str(e), None, False, False))
+            continue
+        item['contratante'] = contratante.cnpj
+        grupos.setdefault(contratante.cnpj, (contratante, []))[1].append(item)
+    return list(grupos.values())
+
+
+def processar_lote(lote_id):
+    """
+    Emite as guias das requisições pendentes de um lote e grava o resultado de cada uma.
+
+    Parâmetros:
+        lote_id (str): Identificador do lote.
+    """
+    db = Session()
+    try:
+        if not _reivindicar_lote(db, lote_id):
+            logging.info(f"Lote {lote_id} já está sendo processado por outro worker.")
+            return
+
+        # Com emissão forçada, só valem as guias emitidas depois da criação do lote
+        forcar, criado_em = db.query(Lote.forcar_emissao, Lote.data_criacao).filter(Lote.id == lote_id).one()
+        pendentes = [
+            {
+                'id': req.id,
+                'contribuinte': req.contribuinte,
+                'tipo_contribuinte': req.tipo_contribuinte,
+                'id_sistema': req.id_sistema,
+                'id_servico': req.id_servico,
+                'parcela': req.parcela,
+                'forcar': bool(forcar),
+                'forcar_desde': criado_em,
+                'contratante': req.contratante
+            }
+            for req in db.query(Requisicao)
+            .filter(Requisicao.lote_id == lote_id, Requisicao.status == "Pendente")
+            .order_by(Requisicao.linha)
+        ]
+        logging.info(f"Processando lote {lote_id}: {len(pendentes)} linhas pendentes.")
+
+        gravador = GravadorLote(db, lote_id)
+
+        def registrar_resultado(indice, item, resultado):
+            if resultado.pdf:
+                logging.debug("Documento DAS gerado com sucesso para CNPJ: %s", item['contribuinte'])
+            else:
+                logging.warning("Erro ao gerar o documento DAS para CNPJ: %s - %s", item['contribuinte'], resultado.mensagem)
+            LINHAS_LOTE.inc(status="Concluído" if resultado.pdf else "Erro")
+            gravador.adicionar(item['id'], resultado)
+
+        def executar(contratante, itens):
+            executar_em_lote(
+                itens,
+                _emitir,
+                ao_concluir=registrar_resultado,
+                ao_ocioso=gravador.gravar_se_necessario,
+                intervalo_ocioso=gravador.max_ms / 1000,
+                guardar_resultados=False,
+                disjuntor=contratante.disjuntor,
+                limitador=contratante.limitador
+            )
+
+        try:
+            grupos = _agrupar_por_contratante(pendentes, registrar_resultado)
+            if len(grupos) == 1:
+                executar(*grupos[0])
+            elif grupos:
+                with ThreadPoolExecutor(max_workers=len(grupos), thread_name_prefix='lote-contratante') as executor:
+                    futuros = [executor.submit(executar, contratante, itens) for contratante, itens in grupos]
+                    for futuro in futuros:
+                        futuro.result()
+        finally:
+            # Grava o que estiver no buffer mesmo se o processamento for interrompido
+            gravador.gravar()
+
+        db.execute(
+            update(Lote).where(Lote.id == lote_id).values(status="Concluído", data_conclusao=_agora())
+        )
+        db.commit()
+        logging.info(f"Lote {lote_id} concluído.")
+
+    except Exception as e:
+        db.rollback()
+        logging.error(f"Erro ao processar o lote {lote_id}: {str(e)}")
+    finally:
+        db.close()
+        with _lotes_lock:
+            _lotes_ativos.discard(lote_id)
+
+
+def iniciar_lote(lote_id):
+    """
+    Inicia o processamento do lote em uma thread de segundo plano.
+
+    Retorna:
+        bool: False se o lote já estiver em processamento neste processo.
+    """
+    with _lotes_lock:
+        if lote_id in _lotes_ativos:
+            return False
+        _lotes_ativos.add(lote_id)
+
+    threading.Thread(target=processar_lote, args=(lote_id,), name=f'lote-{lote_id[:8]}', daemon=True).start()
+    return True
+
+
+def retomar_lotes_pendentes():
+    """
+    Retoma os lotes que ainda não foram concluídos (ex.: após um reinício do servidor)
+    e descarta os lotes cujo recebimento foi interrompido.
+
+    Retorna:
+        int: Quantidade de lotes retomados neste processo.
+    """
+    db = Session()
+    try:
+        # Lotes "Recebendo" sem sinal de vida foram abandonados durante o upload (queda do processo)
+        limite = _agora() - datetime.timedelta(seconds=HEARTBEAT_EXPIRACAO)
+        for (lote_id,) in db.query(Lote.id).filter(Lote.status == "Recebendo", Lote.heartbeat < limite).all():
+            logging.warning(f"Descartando o lote {lote_id}, cujo recebimento foi interrompido.")
+            _descartar_lote(db, lote_id)
+
+        lote_ids = [
+            lote_id for (lote_id,) in db.query(Lote.id).filter(Lote.status.notin_(("Concluído", "Recebendo")))
+        ]
+    finally:
+        db.close()
+
+    return sum(1 for lote_id in lote_ids if iniciar_lote(lote_id))
+
+
+def iniciar_supervisor():
+    """
+    Inicia a thread que varre periodicamente os lotes órfãos e os retoma.
+    Chamadas repetidas no mesmo processo não iniciam uma segunda thread.
+    """
+    global _supervisor
+
+    with _lotes_lock:
+        if _supervisor is not None and _supervisor.is_alive():
+            return
+        _supervisor = threading.Thread(target=_supervisionar, name='lote-supervisor', daemon=True)
+        _supervisor.start()
+
+
+def _supervisionar():
+    while True:
+        try:
+            retomar_lotes_pendentes()
+        except Exception as e:
+            logging.error(f"Erro ao retomar lotes pendentes: {str(e)}")
+        time.sleep(SUPERVISOR_INTERVALO)
+
+
+# ===========================================
+# CONSULTA DE PROGRESSO
+# ===========================================
+
+def _contagem_lote(db, lote):
+    """
+    Conta as linhas do lote por status.
+    """
+    contagem = dict(
+        db.query(Requisicao.status, func.count(Requisicao.id))
+        .filter(Requisicao.lote_id == lote.id)
+        .group_by(Requisicao.status)
+    )
+    concluidos = contagem.get("Concluído", 0)
+    erros = contagem.get("Erro", 0)
+
+    return {
+        "lote_id": lote.id,
+        "status": lote.status,
+        "total": lote.total,
+        "pendentes": contagem.get("Pendente", 0),
+        "concluidos": concluidos,
+        "erros": erros,
+        "processados": concluidos + erros
+    }
+
+
+def _resultado_linha(linha, contribuinte, status, mensagem):
+    return {
+        "linha": linha,
+        "CNPJ": contribuinte,
+        "status": "Sucesso" if status == "Concluído" else status,
+        "mensagem": "Documento DAS gerado com sucesso" if status == "Concluído" else mensagem
+    }
+
+
+def progresso_lote(lote_id, detalhes=False):
+    """
+    Retorna o progresso de um lote.
+
+    Parâmetros:
+        lote_id (str): Identificador do lote.
+        detalhes (bool): Se True, inclui o resultado de cada linha já processada.
+
+    Retorna:
+        dict | None: Contadores do lote, ou None se o lote não existir.
+    """
+    db = Session()
+    try:
+        lote = db.get(Lote, lote_id)
+        if not lote:
+            return None
+
+        progresso = _contagem_lote(db, lote)
+
+        if detalhes:
+            progresso["resultados"] = [
+                _resultado_linha(*linha) for linha in
+                db.query(Requisicao.linha, Requisicao.contribuinte, Requisicao.status, Requisicao.response_message)
+                .filter(Requisicao.lote_id == lote_id, Requisicao.status != "Pendente")
+                .order_by(Requisicao.linha)
+            ]
+
+        return progresso
+    finally:
+        db.close()
+
+
+def eventos_lote(lote_id, apos_linha=-1, intervalo=EVENTOS_INTERVALO, heartbeat=EVENTOS_HEARTBEAT,
+                 tamanho_bloco=500):
+    """
+    Acompanha um lote, gerando os resultados das linhas à medida que são gravados.
+
+    As linhas são lidas do banco na ordem da planilha, a partir de uma fronteira: a última
+    linha antes da primeira ainda pendente. Como os workers processam o lote nessa ordem,
+    a janela após a fronteira costuma ser pequena, e apenas as linhas já enviadas dentro
+    dela ficam em memória. Se a fronteira parar em uma linha pendente com um bloco inteiro
+    de linhas depois dela (ex.: os contratantes são processados em paralelo e um deles está
+    com o circuito aberto), as linhas seguintes ao bloco também são varridas, um bloco por
+    leitura, para que os demais resultados continuem a ser enviados. Por ler o banco,
+    funciona mesmo quando o lote é processado por outro processo.
+
+    Parâmetros:
+        lote_id (str): Identificador do lote.
+        apos_linha (int): Fronteira inicial; linhas até ela não são enviadas, na reconexão
+            (padrão: -1, desde a primeira linha).
+        intervalo (float): Segundos entre as leituras do banco.
+        heartbeat (float): Segundos sem eventos até gerar um sinal de vida.
+        tamanho_bloco (int): Linhas lidas por consulta.
+
+    Retorna:
+        generator: Tuplas (evento, dados, fronteira), onde evento é:
+            - "linhas": lista de resultados ({"linha", "CNPJ", "status", "mensagem"});
+            - "progresso": contadores do lote, quando mudam (como em `progresso_lote`);
+            - "fim": contadores finais; é o último evento;
+            - None: sinal de vida, sem dados.
+        Nada é gerado se o lote não existir.
+    """
+    fronteira = apos_linha
+    # Linhas após a fronteira já enviadas
+    enviadas = set()
+    # Última linha lida pela varredura adiante do bloco da fronteira (None: recomeça após o bloco)
+    varredura = None
+    ultimo_progresso = None
+    ultimo_evento = time.monotonic()
+
+    while True:
+        db = Session()
+        try:
+            lote = db.get(Lote, lote_id)
+            if not lote:
+                return
+            # O status é lido antes das linhas: se o lote já estava concluído, nenhuma está pendente
+            concluido = lote.status == "Concluído"
+            progresso = _contagem_lote(db, lote)
+            linhas = (
+                db.query(Requisicao.linha, Requisicao.contribuinte, Requisicao.status, Requisicao.response_message)
+                .filter(Requisicao.lote_id == lote_id, Requisicao.linha > fronteira)
+                .order_by(Requisicao.linha)
+                .limit(tamanho_bloco)
+                .all()
+            )
+            adiante = []
+            if len(linhas) == tamanho_bloco and any(status == "Pendente" for _, _, status, _ in linhas):
+                fim_bloco = linhas[-1][0]
+                inicio = varredura if varredura is not None and varredura > fim_bloco else fim_bloco
+                adiante = (
+                    db.query(Requisicao.linha, Requisicao.contribuinte, Requisicao.status,
+                             Requisicao.response_message)
+                    .filter(Requisicao.lote_id == lote_id, Requisicao.linha > inicio)
+                    .order_by(Requisicao.linha)
+                    .limit(tamanho_bloco)
+                    .all()
+                )
+                # Ao chegar ao fim do lote, a próxima varredura recomeça logo após o bloco
+                varredura = adiante[-1][0] if len(adiante) == tamanho_bloco else None
+        finally:
+            db.close()
+
+        novas = []
+        bloqueada = False
+        for linha, contribuinte, status, mensagem in linhas:
+            if status == "Pendente":
+                bloqueada = True
+                continue
+            if linha not in enviadas:
+                novas.append(_resultado_linha(linha, contribuinte, status, mensagem))
+                enviadas.add(linha)
+            if not bloqueada:
+                fronteira = linha
+                enviadas.discard(linha)
+        # As linhas adiante ficam em `enviadas` até a fronteira passar por elas
+        for linha, contribuinte, status, mensagem in adiante:
+            if status != "Pendente" and linha not in enviadas:
+                novas.append(_resultado_linha(linha, contribuinte, status, mensagem))
+                enviadas.add(linha)
+
+        if concluido and len(linhas) < tamanho_bloco:
+            if novas:
+                yield "linhas", novas, fronteira
+            yield "fim", progresso, fronteira
+            return
+
+        mudou = progresso != ultimo_progresso
+        if novas:
+            yield "linhas", novas, fronteira
+        if mudou:
+            ultimo_progresso = progresso
+            yield "progresso", progresso, fronteira
+
+        agora = time.monotonic()
+        if novas or mudou:
+            ultimo_evento = agora
+        elif agora - ultimo_evento >= heartbeat:
+            ultimo_evento = agora
+            yield None, None, fronteira
+
+        # Bloco cheio e fronteira avançando: lê o próximo sem esperar
+        if len(linhas) < tamanho_bloco or bloqueada:
+            time.sleep(intervalo)
@@ -1,7 +1,13 @@
 import json
+import time
 import requests
-from serpro_auth import obter_token_autenticacao
+from serpro_auth import obter_token_autenticacao, invalidar_token_autenticacao
+from contratantes import obter_contratante
+from resiliencia import TENTATIVAS, TIMEOUT, STATUS_RETENTAVEIS, calcular_espera, ler_retry_after, contadores
+from registro import logger, amostrar, Resumo, CabecalhosMascarados
+from metricas import cronometrar, DURACAO_FUNCAO, DURACAO_SERPRO
 from dotenv import load_dotenv
+from decouple import config
 import datetime
 import re
 from models import session, Requisicao
@@ -9,8 +15,12 @@ from models import session, Requisicao
 # Carrega as variáveis do ambiente
 load_dotenv()
 
+# URL base do Integra Contador (alterável para apontar para um servidor de testes)
+GATEWAY_URL = config('SERPRO_GATEWAY_URL', default='https://gateway.apiserpro.serpro.gov.br/integra-contador/v1')
 
-def fazer_requisicao_serpro(endpoint='/Emitir', method='POST', data=None):
+
+@cronometrar(DURACAO_FUNCAO, funcao='fazer_requisicao_serpro')
+def fazer_requisicao_serpro(endpoint='/Emitir', method='POST', data=None, contratante=None):
     """
     Faz uma requisição para o endpoint da API do SERPRO.
 
@@ -18,47 +28,121 @@ def fazer_requisicao_serpro(endpoint='/Emitir', method='POST', data=None):
         endpoint (str): Caminho do endpoint da API (padrão: '/Emitir').
         method (str): Método HTTP usado na requisição (padrão: 'POST').
         data (dict): Dados a serem enviados no corpo da requisição.
+        contratante (Contratante | str): Contratante ou CNPJ cujo token, conexões e disjuntor
+            são usados (padrão: contratante padrão; ver `contratantes.py`).
+
+    Falhas transitórias (429, 5xx, timeouts e erros de conexão) são retentadas com backoff
+    exponencial, respeitando o Retry-After; uma resposta 401 renova o token e repete a chamada.
+    Enquanto o circuito do contratante estiver aberto, a chamada é recusada sem ir à rede
+    (ver `resiliencia.py`).
 
     Retorna:
         tuple:
             - docArrecadacaoPdfB64 (str): Base64 do PDF gerado.
             - mensagem_texto (str): Mensagem retornada pela API.
     """
-    # Obtém os tokens de autenticação
-    try:
-        access_token, jwt_token = obter_token_autenticacao()
-    except Exception as e:
-        print(f"Erro ao obter o token de autenticação: {e}")
-        return None
-
     # Monta a URL da requisição
-    url = f'https://gateway.apiserpro.serpro.gov.br/integra-contador/v1{endpoint}'
+    url = f'{GATEWAY_URL}{endpoint}'
 
-    # Define os cabeçalhos HTTP
-    headers = {
-        'Authorization': f'Bearer {access_token}',
-        'Content-Type': 'application/json',
-        'jwt_token': jwt_token
-    }
+    if method not in ('POST', 'GET'):
+        logger.error("Método HTTP não suportado: %s", method)
+        return None, "Método HTTP não suportado."
 
-    # Log de depuração
-    print(f"Fazendo requisição para {url}")
-    print(f"Headers: {headers}")
-    print(f"Payload de Dados: {json.dumps(data, indent=2)}")
+    try:
+        contratante = obter_contratante(contratante)
+    except ValueError as e:
+        logger.error("%s", e)
+        return None, str(e)
+    disjuntor = contratante.disjuntor
+
+    contadores.incrementar('chamadas')
+    token_renovado = False
+    response = None
+    detalhar = amostrar()
+    corpo = json.dumps(data) if method == 'POST' else None
+    inicio = time.perf_counter()
 
     try:
-        # Envia a requisição com base no método HTTP especificado
-        if method == 'POST':
-            response = requests.post(url, headers=headers, data=json.dumps(data))
-        elif method == 'GET':
-            response = requests.get(url, headers=headers)
-        else:
-            print("Método HTTP não suportado.")
-            return None
+        for tentativa in range(TENTATIVAS):
+            if not disjuntor.permitir():
+                return None, "Serviço do SERPRO temporariamente indisponível (circuito aberto). Tente novamente mais tarde."
+
+            # Obtém os tokens de autenticação
+            try:
+                access_token, jwt_token = obter_token_autenticacao(contratante)
+            except Exception as e:
+                logger.error("Erro ao obter o token de autenticação: %s", e)
+                disjuntor.registrar_indefinido()
+                return None, f"Erro ao obter o token de autenticação: {e}"
 
-        # Log de resposta
-        print(f"Status da resposta: {response.status_code}")
-        print(f"Corpo da resposta: {response.text}")
+            # Define os cabeçalhos HTTP
+            headers = {
+                'Authorization': f'Bearer {access_token}',
+                'Content-Type': 'application/json',
+                'jwt_token': jwt_token
+            }
+
+            # Detalhes apenas em DEBUG e na amostra: sem segredos e sem o corpo
+            if detalhar:
+                logger.debug("Requisição ao SERPRO: %s %s tentativa=%d/%d headers=%s payload=%s",
+                             method, endpoint, tentativa + 1, TENTATIVAS, CabecalhosMascarados(headers), Resumo(corpo))
+
+            contadores.incrementar('tentativas')
+            ultima = tentativa == TENTATIVAS - 1
+            inicio_tentativa = time.perf_counter()
+            try:
+                # Envia a requisição pela sessão compartilhada, reaproveitando as conexões do pool
+                sessao = contratante.sessao_gateway()
+                if method == 'POST':
+                    response = sessao.post(url, headers=headers, data=corpo, timeout=TIMEOUT)
+                else:
+                    response = sessao.get(url, headers=headers, timeout=TIMEOUT)
+            except (requests.Timeout, requests.ConnectionError) as e:
+                DURACAO_SERPRO.observar(time.perf_counter() - inicio_tentativa, endpoint=endpoint,
+                                        status='timeout' if isinstance(e, requests.Timeout) else 'erro_conexao')
+                # Timeout de leitura também é retentado: emitir a mesma guia de novo não tem efeito colateral
+                contadores.incrementar('timeouts' if isinstance(e, requests.Timeout) else 'erros_conexao')
+                disjuntor.registrar_falha()
+                logger.warning("Falha de rede na chamada ao SERPRO %s (tentativa %d/%d): %s",
+                               endpoint, tentativa + 1, TENTATIVAS, e)
+                if ultima:
+                    contadores.incrementar('falhas')
+                    return None, f"Erro na requisição: {str(e)}"
+                contadores.incrementar('retentativas')
+                time.sleep(calcular_espera(tentativa))
+                continue
+
+            DURACAO_SERPRO.observar(time.perf_counter() - inicio_tentativa, endpoint=endpoint,
+                                    status=response.status_code)
+
+            # Token expirado ou revogado: renova uma única vez e repete a chamada
+            if response.status_code == 401 and not token_renovado:
+                contadores.incrementar('renovacoes_token_401')
+                invalidar_token_autenticacao(contratante)
+                token_renovado = True
+                continue
+
+            if response.status_code == 401:
+                # 401 mesmo com o token renovado: falha de credenciais, não indisponibilidade do SERPRO
+                disjuntor.registrar_indefinido()
+            elif response.status_code in STATUS_RETENTAVEIS:
+                contadores.incrementar('respostas_429' if response.status_code == 429 else 'respostas_5xx')
+                disjuntor.registrar_falha()
+                logger.warning("SERPRO respondeu %d em %s (tentativa %d/%d)",
+                               response.status_code, endpoint, tentativa + 1, TENTATIVAS)
+                if not ultima:
+                    contadores.incrementar('retentativas')
+                    time.sleep(calcular_espera(tentativa, ler_retry_after(response.headers.get('Retry-After'))))
+                    continue
+            else:
+                disjuntor.registrar_sucesso()
+            break
+
+        if detalhar:
+            logger.debug("Resposta do SERPRO: %s status=%d duracao_ms=%.1f corpo=%s",
+                         endpoint, response.status_code, (time.perf_counter() - inicio) * 1000, Resumo(response.content))
+
+        contadores.incrementar('sucessos' if response.status_code == 200 else 'falhas')
 
         # Processa a resposta
         if response.status_code == 200:
@@ -93,7 +177,7 @@ def fazer_requisicao_serpro(endpoint='/Emitir', method='POST', data=None):
                 )
                 return None, mensagem_texto
             except ValueError:
-                return None, f"Erro na requisição ao SERPRO: {response.status_code} - {response.text}"
+                return None, f"Erro na requisição ao SERPRO: {response.status_code} - {response.text[:500]}"
 
     except requests.RequestException as e:
         return None, f"Erro na requisição: {str(e)}"
@@ -112,7 +196,8 @@ def formatar_numero_documento(numero):
     return re.sub(r'\D', '', numero)
 
 
-def montar_json_gerardas(numero_contribuinte, tipo_contribuinte, id_sistema, id_servico, parcela_para_emitir):
+def montar_json_gerardas(numero_contribuinte, tipo_contribuinte, id_sistema, id_servico, parcela_para_emitir,
+                         contratante=None):
     """
     Monta o JSON necessário para solicitar o documento de arrecadação DAS.
 
@@ -122,19 +207,24 @@ def montar_json_gerardas(numero_contribuinte, tipo_contribuinte, id_sistema, id_
         id_sistema (str): ID do sistema solicitado.
         id_servico (str): ID do serviço solicitado.
         parcela_para_emitir (str): Data da parcela (AAAAMM).
+        contratante (Contratante | str): Contratante ou CNPJ que faz o pedido (padrão: contratante padrão).
 
     Retorna:
         dict: Estrutura JSON formatada para envio.
+
+    Exceções:
+        ValueError: Se o contratante não estiver configurado.
     """
     numero_contribuinte = formatar_numero_documento(numero_contribuinte)
+    contratante = obter_contratante(contratante)
 
     json_dados = {
         "contratante": {
-            "numero": "00000000000000",  # Substituir pelo CNPJ do contratante
+            "numero": contratante.cnpj,
             "tipo": 2
         },
         "autorPedidoDados": {
-            "numero": "00000000000000",  # Substituir pelo CNPJ do autor
+            "numero": contratante.autor_pedido,
             "tipo": 2
         },
         "contribuinte": {
@@ -151,7 +241,6 @@ def montar_json_gerardas(numero_contribuinte, tipo_contribuinte, id_sistema, id_
         }
     }
 
-    print(f"JSON montado para envio: {json.dumps(json_dados, indent=2)}")
     return json_dados
 
 
@@ -167,11 +256,11 @@ def salvar_resposta_recibo(requisicao_id, resposta_base64, status="Concluído",
     """
     requisicao = session.query(Requisicao).get(requisicao_id)
     if requisicao:
-        requisicao.resposta_base64 = resposta_base64
+        requisicao.definir_pdf_base64(resposta_base64)
         requisicao.status = status
         requisicao.response_message = mensagem
         requisicao.data_resposta = datetime.datetime.now(datetime.timezone.utc)
         session.commit()
-        print(f"Requisição {requisicao_id} atualizada com sucesso.")
+        logger.info("Requisição %s atualizada com sucesso.", requisicao_id)
     else:
-        print(f"Requisição {requisicao_id} não encontrada.")
+        logger.warning("Requisição %s não encontrada.", requisicao_id)
@@ -0,0 +1,35 @@
+"""
+Módulo: wsgi.py
+
+Descrição:
+    Ponto de entrada da aplicação para servidores WSGI de produção.
+
+    - Linux: gunicorn -c gunicorn.conf.py wsgi:app
+    - Windows (ou sem o gunicorn): python wsgi.py, servido pelo waitress com várias threads.
+
+    O app é criado sem as threads de segundo plano (supervisor de lotes e agendador),
+    que não sobrevivem ao fork dos workers: o gunicorn as inicia em cada worker
+    (gunicorn.conf.py) e o waitress, antes de servir. Outros servidores WSGI devem
+    chamar `iniciar_segundo_plano(app)` em cada processo.
+
+Configuração (.env):
+    SERVIDOR_HOST: endereço de escuta do waitress (padrão: 0.0.0.0).
+    SERVIDOR_PORTA: porta do waitress (padrão: 8000).
+    SERVIDOR_THREADS: threads do waitress (padrão: 8).
+"""
+from decouple import config
+from app import criar_app, iniciar_segundo_plano
+
+app = criar_app(iniciar_servicos=False)
+
+
+if __name__ == "__main__":
+    from waitress import serve
+
+    iniciar_segundo_plano(app)
+    serve(
+        app,
+        host=config('SERVIDOR_HOST', default='0.0.0.0'),
+        port=config('SERVIDOR_PORTA', default=8000, cast=int),
+        threads=config('SERVIDOR_THREADS', default=8, cast=int)
+    )